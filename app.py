@@ -5,6 +5,9 @@ from container import Container
 from settings import settings
 from src.apps.common.routers import common_bp
 from src.apps.manage.routers import auth_bp
+from src.core.commands import benchmark_cli
+from src.core.db.unit_of_work import begin_unit_of_work, commit_unit_of_work, close_unit_of_work
+from src.core.web.conditional import apply_cache_control
 from src.exceptions import ProximaException
 
 
@@ -13,10 +16,16 @@ def create_app() -> Flask:
     app.config.from_object(settings)
     # 注册容器
     _register_container(app)
+    # 注册请求级数据库工作单元
+    _register_unit_of_work(app)
     # 注册蓝图
     _register_blueprints(app)
     # 注册异常处理程序
     _register_error_handler(app)
+    # 注册响应处理程序
+    _register_response_handler(app)
+    # 注册命令行命令
+    _register_commands(app)
     return app
 
 
@@ -27,6 +36,13 @@ def _register_container(app: Flask) -> None:
     app.container = container
 
 
+def _register_unit_of_work(app: Flask) -> None:
+    """ 注册请求级数据库工作单元，请求中所有数据库操作共享一个连接和事务 """
+    app.before_request(begin_unit_of_work)
+    app.after_request(commit_unit_of_work)
+    app.teardown_appcontext(close_unit_of_work)
+
+
 def _register_blueprints(app: Flask) -> None:
     """ 注册蓝图 """
     # 统一注册所有路由
@@ -49,6 +65,16 @@ def _register_error_handler(app: Flask) -> None:
             return ProximaException(error_code=2, code=400, description=str(exc))
 
 
+def _register_response_handler(app: Flask) -> None:
+    """ 注册响应处理程序 """
+    app.after_request(apply_cache_control)
+
+
+def _register_commands(app: Flask) -> None:
+    """ 注册命令行命令 """
+    app.cli.add_command(benchmark_cli)
+
+
 application = create_app()
 
 
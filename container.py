@@ -1,13 +1,18 @@
 from dependency_injector.containers import DeclarativeContainer, WiringConfiguration
-from dependency_injector.providers import ThreadSafeSingleton, Resource, Factory, Dependency
+from dependency_injector.providers import ThreadSafeSingleton, Resource, Factory, Dependency, Dict, Selector
 
 from settings import settings
 from src.apps.common.repository import *
 from src.apps.common.services import *
 from src.apps.manage.repository import *
+from src.apps.manage.permission import PermissionCache
 from src.apps.manage.services import *
+from src.core.cache import InvalidationBus, TwoLevelCache
 from src.core.db.session import SessionFactory, SessionContext
+from src.core.hashing import init_password_hasher
+from src.core.query_cache import QueryCache, LocalQueryCacheBackend, RedisQueryCacheBackend
 from src.core.redis import get_redis
+from src.core.web.session import UserSessionCache, TokenCache, TokenRevocationList
 
 
 class Container(DeclarativeContainer):
@@ -17,16 +22,124 @@ class Container(DeclarativeContainer):
 
     redis = Resource(get_redis, dsn=settings.REDIS_DSN, max_connections=settings.REDIS_MAX_CONNECTIONS)
 
-    session_factory = ThreadSafeSingleton(SessionFactory, dsn=settings.SQLALCHEMY_DATABASE_URI)
+    password_hasher = Resource(
+        init_password_hasher,
+        max_workers=settings.PASSWORD_HASH_WORKERS,
+        max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+        timeout=settings.PASSWORD_HASH_TIMEOUT
+    )
+
+    session_factory = ThreadSafeSingleton(
+        SessionFactory,
+        dsn=settings.SQLALCHEMY_DATABASE_URI,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        replicas=settings.SQLALCHEMY_REPLICA_URIS,
+        replica_retry_interval=settings.DB_REPLICA_RETRY_SECONDS
+    )
 
     session_context = Factory(SessionContext, factory=session_factory)
 
+    # 不加入请求级工作单元、立即提交的上下文，用于与文件系统等非事务资源配合的写操作
+    isolated_session_context = Factory(SessionContext, factory=session_factory, isolated=True)
+
+    invalidation_bus = ThreadSafeSingleton(InvalidationBus, redis=redis)
+
+    session_cache = ThreadSafeSingleton(UserSessionCache, bus=invalidation_bus)
+
+    token_cache = ThreadSafeSingleton(TokenCache, maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+
+    revocation_list = ThreadSafeSingleton(
+        TokenRevocationList,
+        redis=redis,
+        bus=invalidation_bus,
+        capacity=settings.TOKEN_REVOCATION_CAPACITY,
+        error_rate=settings.TOKEN_REVOCATION_ERROR_RATE,
+        refresh_interval=settings.TOKEN_REVOCATION_REFRESH_SECONDS
+    )
+
+    authority_tree_cache = ThreadSafeSingleton(
+        TwoLevelCache,
+        redis=redis,
+        namespace="authority-tree",
+        ttl=settings.AUTHORITY_TREE_CACHE_TTL,
+        local_size=1,
+        bus=invalidation_bus
+    )
+
+    # 实体缓存，同一实体类的所有repository共享。用户实体包含密码哈希，不缓存
+    role_cache = ThreadSafeSingleton(
+        TwoLevelCache,
+        redis=redis,
+        namespace="entity:role",
+        ttl=settings.ROLE_CACHE_TTL,
+        local_ttl=settings.ENTITY_LOCAL_CACHE_TTL,
+        local_size=settings.ENTITY_LOCAL_CACHE_SIZE,
+        bus=invalidation_bus
+    )
+
+    authority_cache = ThreadSafeSingleton(
+        TwoLevelCache,
+        redis=redis,
+        namespace="entity:authority",
+        ttl=settings.AUTHORITY_CACHE_TTL,
+        local_ttl=settings.ENTITY_LOCAL_CACHE_TTL,
+        local_size=settings.ENTITY_LOCAL_CACHE_SIZE,
+        bus=invalidation_bus
+    )
+
+    file_cache = ThreadSafeSingleton(
+        TwoLevelCache,
+        redis=redis,
+        namespace="entity:file",
+        ttl=settings.FILE_CACHE_TTL,
+        local_ttl=settings.ENTITY_LOCAL_CACHE_TTL,
+        local_size=settings.ENTITY_LOCAL_CACHE_SIZE,
+        bus=invalidation_bus
+    )
+
+    # repository查询结果缓存，存储方式由settings.QUERY_CACHE_BACKEND选择
+    query_cache = ThreadSafeSingleton(
+        QueryCache,
+        backend=Selector(
+            lambda: settings.QUERY_CACHE_BACKEND,
+            local=ThreadSafeSingleton(LocalQueryCacheBackend, maxsize=settings.QUERY_CACHE_LOCAL_SIZE,
+                                      bus=invalidation_bus),
+            redis=ThreadSafeSingleton(RedisQueryCacheBackend, redis=redis)
+        ),
+        ttl=settings.QUERY_CACHE_TTL
+    )
+
+    # 各缓存的命中统计
+    caches = Dict(
+        role=role_cache,
+        authority=authority_cache,
+        file=file_cache,
+        authority_tree=authority_tree_cache,
+        query=query_cache
+    )
+
+    permission_cache = ThreadSafeSingleton(
+        PermissionCache,
+        redis=redis,
+        bus=invalidation_bus,
+        user_repository=Factory(UserRepository, session_context=session_context, redis=redis).provider,
+        authority_repository=Factory(AuthorityRepository, session_context=session_context, redis=redis).provider
+    )
+
     auth_service = Dependency(
         instance_of=AuthService,
         default=Factory(
             AuthServiceImpl,
             redis=redis,
-            repository=Factory(UserRepository, session_context=session_context)
+            repository=Factory(UserRepository, session_context=session_context, redis=redis),
+            permission_cache=permission_cache,
+            session_cache=session_cache,
+            password_hasher=password_hasher,
+            revocation_list=revocation_list
         )
     )
 
@@ -34,7 +147,9 @@ class Container(DeclarativeContainer):
         instance_of=FileService,
         default=Factory(
             LocalFileService,
-            repository=Factory(FileRepository, session_context=session_context)
+            repository=Factory(FileRepository, session_context=isolated_session_context, redis=redis,
+                               entity_cache=file_cache),
+            redis=redis
         )
     )
 
@@ -42,7 +157,9 @@ class Container(DeclarativeContainer):
         instance_of=UserService,
         default=Factory(
             UserServiceImpl,
-            repository=Factory(UserRepository, session_context=session_context)
+            repository=Factory(UserRepository, session_context=session_context, redis=redis, query_cache=query_cache),
+            permission_cache=permission_cache,
+            password_hasher=password_hasher
         )
     )
 
@@ -50,7 +167,9 @@ class Container(DeclarativeContainer):
         instance_of=RoleService,
         default=Factory(
             RoleServiceImpl,
-            repository=Factory(RoleRepository, session_context=session_factory)
+            repository=Factory(RoleRepository, session_context=session_context, redis=redis, entity_cache=role_cache,
+                               query_cache=query_cache),
+            permission_cache=permission_cache
         )
     )
 
@@ -58,6 +177,9 @@ class Container(DeclarativeContainer):
         instance_of=AuthorityService,
         default=Factory(
             AuthorityServiceImpl,
-            repository=Factory(AuthorityRepository, session_context=session_context)
+            repository=Factory(AuthorityRepository, session_context=session_context, redis=redis,
+                               entity_cache=authority_cache, query_cache=query_cache),
+            permission_cache=permission_cache,
+            tree_cache=authority_tree_cache
         )
     )
@@ -1,5 +1,5 @@
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 from pydantic import BaseSettings, validator, RedisDsn
 
@@ -13,6 +13,25 @@ class Settings(BaseSettings):
 
     BASE_DIR: str = os.path.dirname(__file__)
     UPLOAD_DIR: str = "static/upload/"
+    # 流式上传时每次从请求体中读取的字节数
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    # 批量上传时并发写入文件的线程数
+    UPLOAD_WORKERS: int = 8
+    # 流式上传支持的最大文件(10G)，不受MAX_CONTENT_LENGTH限制
+    STREAM_UPLOAD_MAX_SIZE: int = 10 * 1024 * 1024 * 1024
+    # 分块上传配置 - 任务有效期(小时，每次上传分块后重新计时)、单个分块的最大字节数、最大分块数
+    MULTIPART_UPLOAD_EXPIRE_HOURS: int = 24
+    MULTIPART_PART_MAX_SIZE: int = 512 * 1024 * 1024
+    MULTIPART_MAX_PARTS: int = 10000
+    # 合并分块的超时时间(秒)，合并期间拒绝上传分块及取消任务；进程异常退出时超时后才能重新合并
+    MULTIPART_COMPLETE_TIMEOUT: int = 1800
+    # 内容寻址存储：文件以内容的SHA-256命名，相同内容只保存一份，删除最后一条引用时才删除文件。
+    # 开启后支持通过X-Content-SHA256请求头秒传，知道文件hash即可获得该文件的引用，仅适用于信任已登录用户的场景
+    FILE_DEDUPLICATE: bool = False
+    # 文件下载时交由前端代理发送文件内容，可选值参照`src.common.enums.DownloadOffload`，为空时由应用发送
+    FILE_DOWNLOAD_OFFLOAD: Optional[str] = None
+    # X-Accel-Redirect模式下，nginx中指向UPLOAD_DIR的internal location
+    FILE_ACCEL_REDIRECT_LOCATION: str = "/protected/upload/"
 
     # 数据库配置
     DB_HOST: str
@@ -21,6 +40,19 @@ class Settings(BaseSettings):
     DB_NAME: str
     DB_PASS: str
     SQLALCHEMY_DATABASE_URI: Optional[str]
+    # 数据库连接池配置 - 保持的连接数、额外允许的连接数、等待可用连接的超时时间(秒)。
+    # 每个进程一个连接池，DB_POOL_SIZE + DB_MAX_OVERFLOW应不小于进程的线程数
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 10
+    # 连接的最长使用时间(秒)，应小于MySQL的wait_timeout，避免使用已被服务端关闭的连接
+    DB_POOL_RECYCLE: int = 3600
+    # 取出连接时先检测连接可用
+    DB_POOL_PRE_PING: bool = True
+    # 只读副本的连接串(JSON数组)，为空时所有查询使用主库。连接池配置与主库相同
+    SQLALCHEMY_REPLICA_URIS: List[str] = []
+    # 只读副本连接失败后暂停使用的时间(秒)，到期后检测连接可用再恢复使用
+    DB_REPLICA_RETRY_SECONDS: float = 30
 
     @validator("SQLALCHEMY_DATABASE_URI", pre=True)
     def assemble_db_connection(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
@@ -53,9 +85,83 @@ class Settings(BaseSettings):
             path=f"/{values.get('REDIS_NAME')}"
         )
 
+    # 新密码使用的哈希算法: pbkdf2、scrypt、argon2(需要安装argon2-cffi)。已有密码在登录成功后自动升级为当前算法及参数
+    PASSWORD_HASH_ALGORITHM: str = "pbkdf2"
+    # 各算法的计算代价，可通过`flask benchmark hash`测试当前机器上的耗时后调整
+    PBKDF2_ITERATIONS: int = 260000
+    PBKDF2_DIGEST: str = "sha256"
+    SCRYPT_N: int = 2 ** 15
+    SCRYPT_R: int = 8
+    SCRYPT_P: int = 1
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST: int = 65536
+    ARGON2_PARALLELISM: int = 4
+
+    # 密码哈希进程池配置 - 进程数(为0时在请求线程中直接计算)、等待中的任务上限、等待超时时间(秒)
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    PASSWORD_HASH_TIMEOUT: float = 10
+
+    # 批量导入用户配置 - 每批校验及插入的行数、结果中最多返回的错误行数
+    USER_IMPORT_BATCH_SIZE: int = 1000
+    USER_IMPORT_MAX_ERRORS: int = 1000
+
     # jwt配置
     TOKEN_EXPIRED_MINUTES: Optional[int] = 60
 
+    # 会话剩余有效期低于该值(分钟)时才刷新有效期，为空时取TOKEN_EXPIRED_MINUTES的一半。设置为TOKEN_EXPIRED_MINUTES时每次请求都刷新
+    TOKEN_REFRESH_THRESHOLD_MINUTES: Optional[int] = None
+
+    @validator("TOKEN_REFRESH_THRESHOLD_MINUTES", pre=True, always=True)
+    def assemble_token_refresh_threshold(cls, v: Optional[int], values: Dict[str, Any]) -> Any:
+        if v is not None:
+            return v
+        expired_minutes: Optional[int] = values.get("TOKEN_EXPIRED_MINUTES")
+        if expired_minutes is None:
+            raise ValueError("TOKEN_EXPIRED_MINUTES为空时需要设置TOKEN_REFRESH_THRESHOLD_MINUTES")
+        return expired_minutes // 2
+
+    # token校验结果进程内缓存配置 - 有效期(秒，实际不超过token的exp)、条目上限
+    TOKEN_CACHE_TTL: int = 300
+    TOKEN_CACHE_SIZE: int = 10000
+
+    # token吊销列表配置 - 本地布隆过滤器的预计条目数、误判率、按redis中的记录重建的间隔(秒)
+    TOKEN_REVOCATION_CAPACITY: int = 100000
+    TOKEN_REVOCATION_ERROR_RATE: float = 0.001
+    TOKEN_REVOCATION_REFRESH_SECONDS: int = 300
+
+    # 登录用户进程内缓存配置 - 有效期(秒)、条目上限
+    SESSION_LOCAL_CACHE_TTL: int = 300
+    SESSION_LOCAL_CACHE_SIZE: int = 10000
+
+    # 权限缓存配置 - redis中的有效期(秒)、进程内缓存的有效期(秒)及条目上限
+    PERMISSION_CACHE_TTL: int = 3600
+    PERMISSION_LOCAL_CACHE_TTL: int = 60
+    PERMISSION_LOCAL_CACHE_SIZE: int = 4096
+    # 序列化后的权限树缓存有效期(秒)
+    AUTHORITY_TREE_CACHE_TTL: int = 3600
+
+    # 实体缓存(get_by_id的二级缓存)配置 - 各实体在redis中的有效期(秒)，进程内缓存的有效期(秒)及每个实体的条目上限。
+    # 读取只读副本时，复制延迟内写入的旧数据最多保留一个有效期
+    ROLE_CACHE_TTL: int = 3600
+    AUTHORITY_CACHE_TTL: int = 3600
+    FILE_CACHE_TTL: int = 600
+    ENTITY_LOCAL_CACHE_TTL: int = 60
+    ENTITY_LOCAL_CACHE_SIZE: int = 2048
+
+    # repository查询结果缓存(@cached)配置 - 存储方式，可选值参照`src.common.enums.CacheBackend`；
+    # 默认有效期(秒)；进程内存储时的条目上限
+    QUERY_CACHE_BACKEND: str = "redis"
+    QUERY_CACHE_TTL: int = 300
+    QUERY_CACHE_LOCAL_SIZE: int = 4096
+
+    # 按蓝图名称配置GET请求响应的Cache-Control。no-cache表示浏览器可以缓存，但每次使用前需要通过ETag向服务端确认
+    CACHE_CONTROL: Dict[str, str] = {
+        "user": "private, no-cache",
+        "role": "private, no-cache",
+        "perm": "private, no-cache",
+    }
+
     class Config:
         case_sensitive = True
         env_file = os.path.join(os.path.dirname(__file__), ".env")
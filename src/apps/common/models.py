@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, Integer, String
+from sqlalchemy import Column, BigInteger, String
 
 from src.core.db.model import DeclarativeModel
 
@@ -6,10 +6,11 @@ from src.core.db.model import DeclarativeModel
 class File(DeclarativeModel):
     __tablename__ = "file"
 
-    size = Column("size", Integer, nullable=False, comment="文件大小")
+    size = Column("size", BigInteger, nullable=False, comment="文件大小")
     key = Column("key", String(150), nullable=False, comment="文件存储路径")
     filename = Column("filename", String(64), nullable=False, comment="文件名")
     content_type = Column("content_type", String(32), comment="文件类型")
+    hash = Column("hash", String(64), index=True, comment="文件内容的SHA-256")
     upload_time = Column("upload_time", BigInteger, comment="上传日期")
 
 
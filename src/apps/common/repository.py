@@ -1,3 +1,5 @@
+from sqlalchemy import select, func
+
 from src.apps.common.models import File
 from src.core.repository import Repository
 
@@ -5,5 +7,16 @@ from src.core.repository import Repository
 class FileRepository(Repository[File]):
     entity_class = File
 
+    def count_references(self, key: str, file_hash: str) -> int:
+        """
+        统计引用某存储路径的文件记录数(内容寻址存储)。存储路径由hash决定，先按有索引的hash列过滤，避免扫描全表
+
+        :param key: 文件存储路径
+        :param file_hash: 文件内容的SHA-256
+        :return: 记录数
+        """
+        with self.session_context as session:
+            stmt = select(func.count()).select_from(File).where(File.hash == file_hash, File.key == key)
+            return session.execute(stmt).scalar()
 
 __all__ = ["FileRepository"]
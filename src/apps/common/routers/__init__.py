@@ -2,7 +2,9 @@ from flask import Blueprint
 
 from src.apps.common.routers.auth import bp as auth_bp
 from src.apps.common.routers.file import bp as file_bp
+from src.apps.common.routers.monitor import bp as monitor_bp
 
 common_bp = Blueprint("common", __name__, url_prefix="/")
 common_bp.register_blueprint(auth_bp)
 common_bp.register_blueprint(file_bp)
+common_bp.register_blueprint(monitor_bp)
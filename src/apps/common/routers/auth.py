@@ -1,3 +1,5 @@
+from typing import Optional
+
 from dependency_injector.wiring import inject, Provide
 from flask import Blueprint, request
 
@@ -7,6 +9,7 @@ from src.apps.common.services.auth import AuthService
 from src.core.web.response import Response
 from src.core.security import login_required
 from src.core.web.request import current_user
+from src.core.web.schemas import TokenPayload
 
 bp: Blueprint = Blueprint("auth", __name__)
 
@@ -26,6 +29,10 @@ def login(auth_service: AuthService = Provide[Container.auth_service]) -> Respon
 @inject
 @login_required
 def logout(auth_service: AuthService = Provide[Container.auth_service]) -> Response[str]:
-    """ 登出 """
-    auth_service.logout(user_id=current_user.id)
+    """ 登出当前设备，参数all为true时登出所有设备 """
+    token: Optional[TokenPayload] = getattr(request, "token", None)
+    if token is None or request.args.get("all", "false").lower() == "true":
+        auth_service.logout(user_id=current_user.id)
+    else:
+        auth_service.logout(user_id=current_user.id, jti=token.jti, expired_at=token.exp)
     return Response.ok()
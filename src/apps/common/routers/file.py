@@ -8,15 +8,17 @@ from typing import List, Optional
 from urllib.parse import urljoin
 
 from dependency_injector.wiring import inject, Provide
-from flask import Blueprint, request, send_file
+from flask import Blueprint, request
 
 from container import Container
 from settings import settings
 from src.apps.common.models import File
-from src.apps.common.schemas import FileViewSchema
+from src.apps.common.schemas import FileViewSchema, MultipartInitiateSchema, MultipartUploadSchema, UploadPartSchema
 from src.apps.common.services import FileService
 from src.core.security import login_required
+from src.core.web.files import send_local_file
 from src.core.web.response import Response
+from src.exceptions import ProximaException
 
 bp = Blueprint("file", __name__, url_prefix="/file")
 
@@ -39,6 +41,91 @@ def upload(service: FileService = Provide[Container.file_service]) -> Response[L
     return Response.ok(data=result)
 
 
+@bp.post("/upload/batch")
+@login_required
+@inject
+def upload_batch(service: FileService = Provide[Container.file_service]) -> Response[List[FileViewSchema]]:
+    """
+    批量上传文件，并发写入文件，所有文件记录在同一个事务中保存 WARNING: 只有使用本地文件服务时，才可以使用此接口
+    """
+    result: List[FileViewSchema] = service.upload_batch(
+        [storage for _, storage in request.files.items(multi=True)]
+    )
+    for file in result:
+        file.url = urljoin(request.host_url, file.url)
+    return Response.ok(data=result)
+
+
+@bp.post("/upload/stream")
+@login_required
+@inject
+def upload_stream(service: FileService = Provide[Container.file_service]) -> Response[FileViewSchema]:
+    """
+    流式上传单个文件，请求体即文件内容(非multipart)，文件名通过查询参数filename传递。
+    不受MAX_CONTENT_LENGTH限制，内存占用与文件大小无关 WARNING: 只有使用本地文件服务时，才可以使用此接口
+    """
+    filename: Optional[str] = request.args.get("filename", None)
+    if not filename:
+        raise ProximaException(description="缺少文件名")
+    file: Optional[FileViewSchema] = None
+    # 秒传: 客户端提供了文件hash，且已存在相同内容的文件时，不再读取请求体
+    file_hash: Optional[str] = request.headers.get("X-Content-SHA256", None)
+    if file_hash:
+        file = service.upload_by_hash(file_hash.lower(), filename, request.mimetype or None)
+    if file is None:
+        file = service.upload_stream(request.stream, filename, request.mimetype or None)
+    file.url = urljoin(request.host_url, file.url)
+    return Response.ok(data=file)
+
+
+@bp.post("/multipart/initiate")
+@login_required
+@inject
+def initiate_multipart_upload(
+        service: FileService = Provide[Container.file_service]) -> Response[MultipartUploadSchema]:
+    """ 分块上传 - 创建上传任务 """
+    schema: MultipartInitiateSchema = MultipartInitiateSchema(**request.json)
+    return Response.ok(data=service.initiate_multipart_upload(schema.filename, schema.content_type))
+
+
+@bp.put("/multipart/<upload_id>/<int:part_number>")
+@login_required
+@inject
+def upload_part(upload_id: str, part_number: int,
+                service: FileService = Provide[Container.file_service]) -> Response[UploadPartSchema]:
+    """ 分块上传 - 上传分块，请求体即分块内容 """
+    return Response.ok(data=service.upload_part(upload_id, part_number, request.stream))
+
+
+@bp.get("/multipart/<upload_id>")
+@login_required
+@inject
+def get_multipart_upload(upload_id: str,
+                         service: FileService = Provide[Container.file_service]) -> Response[MultipartUploadSchema]:
+    """ 分块上传 - 查询已上传的分块 """
+    return Response.ok(data=service.get_multipart_upload(upload_id))
+
+
+@bp.post("/multipart/<upload_id>/complete")
+@login_required
+@inject
+def complete_multipart_upload(upload_id: str,
+                              service: FileService = Provide[Container.file_service]) -> Response[FileViewSchema]:
+    """ 分块上传 - 合并分块 """
+    file: FileViewSchema = service.complete_multipart_upload(upload_id)
+    file.url = urljoin(request.host_url, file.url)
+    return Response.ok(data=file)
+
+
+@bp.delete("/multipart/<upload_id>")
+@login_required
+@inject
+def abort_multipart_upload(upload_id: str, service: FileService = Provide[Container.file_service]) -> Response[str]:
+    """ 分块上传 - 取消上传任务 """
+    service.abort_multipart_upload(upload_id)
+    return Response.ok(msg="上传任务已取消")
+
+
 @bp.get("/download/<int:ident>")
 @login_required
 @inject
@@ -54,8 +141,8 @@ def download(ident: int, service: FileService = Provide[Container.file_service])
     if file is None:
         return Response.error(msg="文件不存在")
     file_path: PathLike = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, file.key)
-    mimetype: str = file.content_type.split(";")[0]
-    return send_file(file_path, as_attachment=True, attachment_filename=file.filename, mimetype=mimetype)
+    mimetype: Optional[str] = file.content_type.split(";")[0] if file.content_type else None
+    return send_local_file(file_path, file.filename, mimetype)
 
 
 @bp.delete("/delete/<int:ident>")
@@ -0,0 +1,29 @@
+from typing import Any, Dict, Union
+
+from dependency_injector.wiring import inject, Provide
+from flask import Blueprint
+
+from container import Container
+from src.core.cache import TwoLevelCache
+from src.core.query_cache import QueryCache
+from src.core.db.session import SessionFactory
+from src.core.security import login_required
+from src.core.web.response import Response
+
+bp: Blueprint = Blueprint("monitor", __name__, url_prefix="/monitor")
+
+
+@bp.get("/pool")
+@inject
+@login_required
+def pool(session_factory: SessionFactory = Provide[Container.session_factory]) -> Response[Dict[str, Any]]:
+    """ 当前进程的数据库连接池状态及指标 """
+    return Response.ok(data=session_factory.get_pool_status())
+
+
+@bp.get("/cache")
+@inject
+@login_required
+def cache(caches: Dict[str, Union[TwoLevelCache, QueryCache]] = Provide[Container.caches]) -> Response[Dict[str, Any]]:
+    """ 当前进程各缓存的命中统计 """
+    return Response.ok(data={name: item.get_stats() for name, item in caches.items()})
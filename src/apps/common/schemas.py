@@ -2,7 +2,8 @@
 # @Author        : Yao YuHang
 # @CreatedTime   : 21/10/12 15:44
 # @Description   :
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List, Optional
 
 from pydantic import Field, EmailStr
 
@@ -28,6 +29,34 @@ class FileViewSchema:
     url: str
     size: int
     filename: str
+    # 文件内容的SHA-256
+    hash: Optional[str] = None
 
 
-__all__ = ["LoginSchema", "BearerToken", "FileViewSchema"]
+class MultipartInitiateSchema(BaseValidationSchema):
+    """ 创建分块上传任务 """
+    filename: str = Field(..., max_length=64, description="文件名")
+    content_type: Optional[str] = Field(None, max_length=32, description="文件类型")
+
+
+@dataclass
+class UploadPartSchema:
+    part_number: int
+    size: int
+    # 分块内容的SHA-256，客户端可用于校验
+    hash: str
+
+
+@dataclass
+class MultipartUploadSchema:
+    upload_id: str
+    filename: str
+    # 参照`src.common.enums.FileUploadStatus`
+    status: int
+    parts: List[UploadPartSchema] = field(default_factory=list)
+
+
+__all__ = [
+    "LoginSchema", "BearerToken", "FileViewSchema", "MultipartInitiateSchema", "UploadPartSchema",
+    "MultipartUploadSchema"
+]
@@ -7,12 +7,16 @@ from redis import Redis
 from sqlalchemy.engine import Result
 from sqlalchemy.sql import select, distinct
 
+from logger import logger
 from settings import settings
 from src.apps.common.schemas import BearerToken
 from src.apps.manage.models import User, Authority, UserRoleRel, RoleAuthRel
+from src.apps.manage.permission import PermissionCache
 from src.apps.manage.repository import UserRepository
 from src.common.constant import Constant
+from src.core.hashing import PasswordHasher
 from src.core.web.schemas import CurrentUser
+from src.core.web.session import UserSessionCache, TokenRevocationList
 from src.exceptions import ProximaException, InvalidAccountException
 from src.utils import DateUtil
 from src.utils import SecurityUtil
@@ -31,10 +35,12 @@ class AuthService(ABC):
         raise NotImplemented
 
     @abstractmethod
-    def logout(self, user_id) -> NoReturn:
+    def logout(self, user_id, jti: Optional[str] = None, expired_at: Optional[int] = None) -> NoReturn:
         """
-        登出用户
+        登出用户。指定了token时只吊销该token(登出当前设备)，否则清除用户会话(登出所有设备)
         :param user_id: 用户id
+        :param jti: token唯一标识
+        :param expired_at: token的过期时间戳
         :return:
         """
         raise NotImplemented
@@ -42,25 +48,34 @@ class AuthService(ABC):
 
 class AuthServiceImpl(AuthService):
 
-    def __init__(self, redis: Redis, repository: UserRepository) -> NoReturn:
+    def __init__(self, redis: Redis, repository: UserRepository, permission_cache: Optional[PermissionCache] = None,
+                 session_cache: Optional[UserSessionCache] = None,
+                 password_hasher: Optional[PasswordHasher] = None,
+                 revocation_list: Optional[TokenRevocationList] = None) -> NoReturn:
         self.redis: Final[Redis] = redis
         self.repository: Final[UserRepository] = repository
+        self.permission_cache: Final[Optional[PermissionCache]] = permission_cache
+        self.session_cache: Final[Optional[UserSessionCache]] = session_cache
+        self.password_hasher: Final[Optional[PasswordHasher]] = password_hasher
+        self.revocation_list: Final[Optional[TokenRevocationList]] = revocation_list
 
     def authenticate(self, email: str, password: str) -> BearerToken:
         user: Optional[User] = self.repository.get_user_by_email(email)
-        if user is None or not SecurityUtil.verify_password(password, user.password):
+        if user is None or not self._verify_password(password, user.password):
             raise ProximaException(description="用户名或密码错误")
 
         if user.status == 1:
             raise InvalidAccountException
 
-        stmt = select(distinct(Authority.code)) \
-            .select_from(Authority) \
-            .join(RoleAuthRel, Authority.id == RoleAuthRel.auth_id) \
-            .join(UserRoleRel, UserRoleRel.role_id == RoleAuthRel.role_id) \
-            .join(User, User.id == UserRoleRel.user_id).where(User.email == email)
-        result: Result = self.repository.execute_query(stmt)
-        authorities: Set[str] = {res[0] for res in result.fetchall()}
+        # 密码哈希使用了过时的算法或参数时，使用本次提交的明文密码重新生成
+        if SecurityUtil.password_needs_rehash(user.password):
+            self._rehash_password(user.id, password)
+
+        # 优先通过权限缓存解析，避免每次登录都执行多表关联查询
+        if self.permission_cache is not None:
+            authorities: Set[str] = self.permission_cache.resolve(user.id)
+        else:
+            authorities: Set[str] = self._query_authorities(email)
 
         # 用户id是1的是超级用户
         is_super: bool = True if user.id == 1 else False
@@ -76,12 +91,51 @@ class AuthServiceImpl(AuthService):
         expire: timedelta = timedelta(minutes=settings.TOKEN_EXPIRED_MINUTES)
         # 使用主键作为redis键，则每次登录就会覆盖之前的值(存在的话)
         self.redis.set(name=Constant.AUTH_REDIS_KEY + uid, value=current_user.json(), ex=expire)
+        # 各进程中缓存的旧会话已失效
+        if self.session_cache is not None:
+            self.session_cache.evict(uid)
         token: str = SecurityUtil.create_token(subject=uid)
         expired_at: int = DateUtil.timestamp() + expire.seconds
         return BearerToken(access_token=token, token_type=Constant.TOKEN_SCHEMA, expired_at=expired_at)
 
-    def logout(self, user_id) -> NoReturn:
+    def _verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        """ 优先交给密码哈希执行器校验，避免占用请求线程 """
+        if self.password_hasher is not None:
+            return self.password_hasher.verify(plain_password, hashed_password)
+        return SecurityUtil.verify_password(plain_password, hashed_password)
+
+    def _rehash_password(self, user_id: int, password: str) -> None:
+        """ 升级失败不影响本次登录，下次登录时会再次尝试 """
+        try:
+            if self.password_hasher is not None:
+                hashed_password: str = self.password_hasher.generate(password)
+            else:
+                hashed_password: str = SecurityUtil.generate_password(password)
+            self.repository.update_password(user_id, hashed_password)
+        except Exception as exc:
+            logger.warning("升级密码哈希失败: " + str(exc))
+
+    def _query_authorities(self, email: str) -> Set[str]:
+        """
+        直接从数据库查询用户所有的权限标识
+        :param email: 用户邮箱
+        :return: 权限标识集合
+        """
+        stmt = select(distinct(Authority.code)) \
+            .select_from(Authority) \
+            .join(RoleAuthRel, Authority.id == RoleAuthRel.auth_id) \
+            .join(UserRoleRel, UserRoleRel.role_id == RoleAuthRel.role_id) \
+            .join(User, User.id == UserRoleRel.user_id).where(User.email == email)
+        result: Result = self.repository.execute_query(stmt)
+        return {res[0] for res in result.fetchall()}
+
+    def logout(self, user_id, jti: Optional[str] = None, expired_at: Optional[int] = None) -> NoReturn:
+        if self.revocation_list is not None and jti is not None and expired_at is not None:
+            self.revocation_list.revoke(jti, expired_at)
+            return
         redis_key: str = Constant.AUTH_REDIS_KEY + str(user_id)
         if self.redis.exists(redis_key):
             self.redis.delete(redis_key)
+        if self.session_cache is not None:
+            self.session_cache.evict(str(user_id))
 
@@ -1,15 +1,29 @@
+import hashlib
+import itertools
 import os
 import pathlib
+import re
+import shutil
+import tempfile
+import time
 from abc import abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack, nullcontext
 from datetime import date
+from typing import BinaryIO, ContextManager, Dict, Final, Iterable, Iterator, List, Optional, Sequence, Tuple
 
+import orjson
+from redis import Redis
 from werkzeug.datastructures import FileStorage
 
 from settings import settings
 from src.apps.common.models import File
 from src.apps.common.repository import FileRepository
-from src.apps.common.schemas import FileViewSchema
+from src.apps.common.schemas import FileViewSchema, MultipartUploadSchema, UploadPartSchema
+from src.common.constant import Constant
+from src.common.enums import FileUploadStatus
 from src.core.service import IService, ServiceImpl
+from src.exceptions import ProximaException
 from src.utils import StringUtil
 
 
@@ -25,10 +39,102 @@ class FileService(IService):
         """
         raise NotImplemented
 
+    @abstractmethod
+    def upload_batch(self, file_storages: Sequence[FileStorage]) -> List[FileViewSchema]:
+        """
+        批量上传文件 - 并发写入文件，所有文件记录在同一个事务中保存
+        :param file_storages: 文件对象
+        :return: 文件URL，与文件对象的顺序一致
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def upload_stream(self, stream: BinaryIO, filename: str, content_type: Optional[str] = None) -> FileViewSchema:
+        """
+        流式上传文件 - 边读取边写入，内存占用与文件大小无关，适用于大文件
+        :param stream: 文件内容的输入流(请求体)
+        :param filename: 文件名
+        :param content_type: 文件类型
+        :return: 文件URL
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def upload_by_hash(self, file_hash: str, filename: str,
+                       content_type: Optional[str] = None) -> Optional[FileViewSchema]:
+        """
+        秒传 - 已存在相同内容的文件时直接新增文件记录，无需上传文件内容。仅在开启内容寻址存储时可用
+        :param file_hash: 客户端计算的文件内容SHA-256
+        :param filename: 文件名
+        :param content_type: 文件类型
+        :return: 文件URL，不存在相同内容的文件时为空
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def initiate_multipart_upload(self, filename: str, content_type: Optional[str] = None) -> MultipartUploadSchema:
+        """
+        分块上传 - 创建上传任务
+        :param filename: 文件名
+        :param content_type: 文件类型
+        :return: 上传任务
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def upload_part(self, upload_id: str, part_number: int, stream: BinaryIO) -> UploadPartSchema:
+        """
+        分块上传 - 上传分块，不同分块可以并行上传，重复上传同一分块时覆盖之前的内容
+        :param upload_id: 上传任务id
+        :param part_number: 分块序号，从1开始
+        :param stream: 分块内容的输入流
+        :return: 分块信息
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def get_multipart_upload(self, upload_id: str) -> MultipartUploadSchema:
+        """
+        分块上传 - 查询上传任务及已上传的分块，用于断点续传
+        :param upload_id: 上传任务id
+        :return: 上传任务
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def complete_multipart_upload(self, upload_id: str) -> FileViewSchema:
+        """
+        分块上传 - 按序号合并所有分块，分块序号必须连续
+        :param upload_id: 上传任务id
+        :return: 文件URL
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def abort_multipart_upload(self, upload_id: str) -> None:
+        """
+        分块上传 - 取消上传任务并删除已上传的分块
+        :param upload_id: 上传任务id
+        :return:
+        """
+        raise NotImplemented
+
 
 class LocalFileService(ServiceImpl[FileRepository, File], FileService):
+    """ 本地文件服务。分块上传的任务状态保存在redis中，分块保存在本地文件系统中，因此任意进程都可以接收任意分块 """
+
+    def __init__(self, repository: FileRepository, redis: Optional[Redis] = None):
+        super().__init__(repository)
+        self.redis: Final[Optional[Redis]] = redis
 
     def upload(self, file_storage: FileStorage) -> FileViewSchema:
+        if settings.FILE_DEDUPLICATE:
+            try:
+                return self._store_chunks(self._read_chunks(file_storage.stream), file_storage.filename,
+                                          file_storage.content_type)
+            finally:
+                file_storage.close()
+
         key: str = self._create_key_by_filename(file_storage.filename)
         path = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, key)
 
@@ -53,6 +159,396 @@ class LocalFileService(ServiceImpl[FileRepository, File], FileService):
         finally:
             file_storage.close()
 
+    def upload_batch(self, file_storages: Sequence[FileStorage]) -> List[FileViewSchema]:
+        if settings.FILE_DEDUPLICATE:
+            return self._upload_batch_deduplicated(file_storages)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(len(file_storages), settings.UPLOAD_WORKERS))) as pool:
+                keys: List[str] = [self._create_key_by_filename(storage.filename) for storage in file_storages]
+                paths: List[pathlib.Path] = [pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, key) for key in keys]
+                futures: List[Future] = [
+                    pool.submit(self._write_chunks, self._read_chunks(storage.stream), path)
+                    for storage, path in zip(file_storages, paths)
+                ]
+                wait(futures)
+        finally:
+            for storage in file_storages:
+                storage.close()
+
+        files: List[File] = []
+        for storage, key, future in zip(file_storages, keys, futures):
+            if future.exception() is not None:
+                continue
+            size, file_hash = future.result()
+            file: File = File()
+            file.key = key
+            file.filename = storage.filename
+            file.size = size
+            file.hash = file_hash
+            file.content_type = storage.content_type
+            files.append(file)
+        try:
+            if len(files) < len(futures):
+                raise next(future.exception() for future in futures if future.exception() is not None)
+            self.repository.batch_insert(files)
+        except BaseException:
+            # 任一文件写入失败或保存记录失败时，删除已写入的文件
+            for path in paths:
+                if path.exists():
+                    path.unlink()
+            raise
+        return [
+            FileViewSchema(id=file.id, size=file.size, filename=file.filename, url=settings.UPLOAD_DIR + file.key,
+                           hash=file.hash)
+            for file in files
+        ]
+
+    def _upload_batch_deduplicated(self, file_storages: Sequence[FileStorage]) -> List[FileViewSchema]:
+        """
+        内容寻址存储的批量上传。并发写入暂存区并计算hash，然后在所有存储路径的锁内将暂存文件移动到目标位置，
+        所有文件记录在同一个事务中保存。任一文件写入失败或保存记录失败时，删除本次新增的存储文件
+        """
+        staging_dir = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, Constant.CAS_UPLOAD_DIR, ".staging")
+        stagings: List[pathlib.Path] = [staging_dir.joinpath(StringUtil.get_unique_key()) for _ in file_storages]
+        files: List[File] = []
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(len(file_storages), settings.UPLOAD_WORKERS))) as pool:
+                futures: List[Future] = [
+                    pool.submit(self._write_chunks, self._read_chunks(storage.stream), staging)
+                    for storage, staging in zip(file_storages, stagings)
+                ]
+                wait(futures)
+            for future in futures:
+                if future.exception() is not None:
+                    raise future.exception()
+            hashes: List[str] = [future.result()[1] for future in futures]
+            keys: List[str] = [self._get_blob_key(file_hash) for file_hash in hashes]
+            created: List[pathlib.Path] = []
+            with ExitStack() as stack:
+                # 按固定顺序加锁，避免与其他批量上传互相等待
+                for key in sorted(set(keys)):
+                    stack.enter_context(self._lock_key(key))
+                for storage, staging, key, file_hash in zip(file_storages, stagings, keys, hashes):
+                    path = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, key)
+                    if not path.exists():
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        os.replace(staging, path)
+                        created.append(path)
+                    file: File = File()
+                    file.key = key
+                    file.filename = storage.filename
+                    file.size = path.stat().st_size
+                    file.hash = file_hash
+                    file.content_type = storage.content_type
+                    files.append(file)
+                try:
+                    self.repository.batch_insert(files)
+                except BaseException:
+                    # 持有锁期间新增的存储文件不会被其他记录引用
+                    for path in created:
+                        if path.exists():
+                            path.unlink()
+                    raise
+        finally:
+            for storage in file_storages:
+                storage.close()
+            for staging in stagings:
+                if staging.exists():
+                    staging.unlink()
+        return [
+            FileViewSchema(id=file.id, size=file.size, filename=file.filename, url=settings.UPLOAD_DIR + file.key,
+                           hash=file.hash)
+            for file in files
+        ]
+
+    def upload_stream(self, stream: BinaryIO, filename: str, content_type: Optional[str] = None) -> FileViewSchema:
+        return self._store_chunks(self._read_chunks(stream), filename, content_type, settings.STREAM_UPLOAD_MAX_SIZE)
+
+    def upload_by_hash(self, file_hash: str, filename: str,
+                       content_type: Optional[str] = None) -> Optional[FileViewSchema]:
+        if not settings.FILE_DEDUPLICATE or not re.fullmatch(r"[0-9a-f]{64}", file_hash):
+            return None
+        return self._link_blob(file_hash, filename, content_type)
+
+    def delete(self, ident: int) -> None:
+        file: Optional[File] = self.repository.get_by_id(ident)
+        if file is None:
+            return
+        key: str = file.key
+        path = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, key)
+        if not self._is_shared(key):
+            # 每条记录独占自己的文件，不需要统计引用
+            self.repository.delete(ident)
+            if path.exists():
+                path.unlink()
+            return
+        with self._lock_key(key):
+            self.repository.delete(ident)
+            # 内容寻址存储时多条文件记录引用同一份存储，最后一条记录删除后才删除文件
+            if self.repository.count_references(key, file.hash) == 0 and path.exists():
+                path.unlink()
+
+    def initiate_multipart_upload(self, filename: str, content_type: Optional[str] = None) -> MultipartUploadSchema:
+        self._purge_expired_parts()
+        upload_id: str = StringUtil.get_unique_key()
+        session_key: str = Constant.UPLOAD_REDIS_KEY + upload_id
+        with self.redis.pipeline() as pipe:
+            pipe.hset(session_key, mapping={
+                "filename": filename,
+                "content_type": content_type or "",
+                "status": FileUploadStatus.initial.value
+            })
+            pipe.expire(session_key, settings.MULTIPART_UPLOAD_EXPIRE_HOURS * 3600)
+            pipe.execute()
+        return MultipartUploadSchema(upload_id=upload_id, filename=filename, status=FileUploadStatus.initial)
+
+    def upload_part(self, upload_id: str, part_number: int, stream: BinaryIO) -> UploadPartSchema:
+        if part_number < 1 or part_number > settings.MULTIPART_MAX_PARTS:
+            raise ProximaException(description=f"分块序号必须在1-{settings.MULTIPART_MAX_PARTS}之间")
+        session: Dict[str, str] = self._get_upload_session(upload_id)
+        if int(session["status"]) not in (FileUploadStatus.initial, FileUploadStatus.uploading):
+            raise ProximaException(description="上传任务已结束")
+        self._check_not_completing(upload_id)
+
+        # 同一分块重复上传时覆盖之前的内容，写入是原子的，因此可以安全地重试
+        path = self._get_parts_dir(upload_id).joinpath(str(part_number))
+        size, part_hash = self._write_chunks(self._read_chunks(stream), path, settings.MULTIPART_PART_MAX_SIZE)
+        session_key: str = Constant.UPLOAD_REDIS_KEY + upload_id
+        parts_key: str = Constant.UPLOAD_PART_REDIS_KEY + upload_id
+        expire: int = settings.MULTIPART_UPLOAD_EXPIRE_HOURS * 3600
+        with self.redis.pipeline() as pipe:
+            pipe.hset(parts_key, str(part_number), orjson.dumps({"size": size, "hash": part_hash}))
+            pipe.hset(session_key, "status", FileUploadStatus.uploading.value)
+            pipe.expire(parts_key, expire)
+            pipe.expire(session_key, expire)
+            pipe.execute()
+        return UploadPartSchema(part_number=part_number, size=size, hash=part_hash)
+
+    def get_multipart_upload(self, upload_id: str) -> MultipartUploadSchema:
+        session: Dict[str, str] = self._get_upload_session(upload_id)
+        return MultipartUploadSchema(
+            upload_id=upload_id,
+            filename=session["filename"],
+            status=int(session["status"]),
+            parts=self._get_parts(upload_id)
+        )
+
+    def complete_multipart_upload(self, upload_id: str) -> FileViewSchema:
+        session: Dict[str, str] = self._get_upload_session(upload_id)
+        session_key: str = Constant.UPLOAD_REDIS_KEY + upload_id
+        # 已完成的任务直接返回结果，客户端可以安全地重试
+        if int(session["status"]) == FileUploadStatus.finished:
+            return FileViewSchema(id=int(session["file_id"]), url=session["url"],
+                                  size=int(session["size"]), filename=session["filename"], hash=session["hash"])
+        parts: List[UploadPartSchema] = self._get_parts(upload_id)
+        if len(parts) == 0 or parts[-1].part_number != len(parts):
+            raise ProximaException(description="分块不完整", data=[part.part_number for part in parts])
+        # 防止多个进程同时合并同一个上传任务。标记带有效期，合并的进程异常退出后超时即可重新合并
+        completing_key: str = Constant.UPLOAD_COMPLETING_REDIS_KEY + upload_id
+        if not self.redis.set(completing_key, 1, nx=True, ex=settings.MULTIPART_COMPLETE_TIMEOUT):
+            raise ProximaException(description="上传任务正在合并")
+
+        parts_dir: pathlib.Path = self._get_parts_dir(upload_id)
+        try:
+            chunks: Iterator[bytes] = itertools.chain.from_iterable(
+                self._read_file_chunks(parts_dir.joinpath(str(part.part_number))) for part in parts
+            )
+            result: FileViewSchema = self._store_chunks(chunks, session["filename"], session["content_type"] or None)
+        except BaseException:
+            self.redis.delete(completing_key)
+            raise
+
+        with self.redis.pipeline() as pipe:
+            pipe.hset(session_key, mapping={
+                "status": FileUploadStatus.finished.value,
+                "file_id": result.id,
+                "url": result.url,
+                "size": result.size,
+                "hash": result.hash
+            })
+            pipe.delete(Constant.UPLOAD_PART_REDIS_KEY + upload_id, completing_key)
+            pipe.execute()
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        return result
+
+    def abort_multipart_upload(self, upload_id: str) -> None:
+        session: Dict[str, str] = self._get_upload_session(upload_id)
+        if int(session["status"]) == FileUploadStatus.finished:
+            raise ProximaException(description="上传任务已完成")
+        self._check_not_completing(upload_id)
+        self.redis.delete(Constant.UPLOAD_REDIS_KEY + upload_id, Constant.UPLOAD_PART_REDIS_KEY + upload_id)
+        shutil.rmtree(self._get_parts_dir(upload_id), ignore_errors=True)
+
+    def _get_upload_session(self, upload_id: str) -> Dict[str, str]:
+        session: Dict[str, str] = self.redis.hgetall(Constant.UPLOAD_REDIS_KEY + upload_id)
+        if not session:
+            raise ProximaException(code=404, description="上传任务不存在或已过期")
+        return session
+
+    def _get_parts(self, upload_id: str) -> List[UploadPartSchema]:
+        parts: Dict[str, str] = self.redis.hgetall(Constant.UPLOAD_PART_REDIS_KEY + upload_id)
+        result: List[UploadPartSchema] = [
+            UploadPartSchema(part_number=int(number), **orjson.loads(value)) for number, value in parts.items()
+        ]
+        return sorted(result, key=lambda part: part.part_number)
+
+    def _check_not_completing(self, upload_id: str) -> None:
+        """ 合并期间分块正在被读取，不能再上传分块或取消任务 """
+        if self.redis.exists(Constant.UPLOAD_COMPLETING_REDIS_KEY + upload_id):
+            raise ProximaException(description="上传任务正在合并")
+
+    @staticmethod
+    def _get_parts_dir(upload_id: str) -> pathlib.Path:
+        return pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, Constant.MULTIPART_UPLOAD_DIR, upload_id)
+
+    @staticmethod
+    def _purge_expired_parts() -> None:
+        """ 删除已过期的上传任务残留的分块(目录最后修改时间早于任务有效期) """
+        root = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, Constant.MULTIPART_UPLOAD_DIR)
+        if not root.exists():
+            return
+        deadline: float = time.time() - settings.MULTIPART_UPLOAD_EXPIRE_HOURS * 3600
+        for parts_dir in root.iterdir():
+            if parts_dir.is_dir() and parts_dir.stat().st_mtime < deadline:
+                shutil.rmtree(parts_dir, ignore_errors=True)
+
+    def _store_chunks(self, chunks: Iterable[bytes], filename: str, content_type: Optional[str],
+                      max_size: Optional[int] = None) -> FileViewSchema:
+        """
+        保存文件内容并新增文件记录。开启内容寻址存储(FILE_DEDUPLICATE)时，文件以SHA-256命名，相同内容的文件共用同一份存储
+
+        :param chunks: 文件内容
+        :param filename: 文件名
+        :param content_type: 文件类型
+        :param max_size: 文件大小上限，为空时不限制
+        :return: 文件URL
+        """
+        if not settings.FILE_DEDUPLICATE:
+            key: str = self._create_key_by_filename(filename)
+            path = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, key)
+            size, file_hash = self._write_chunks(chunks, path, max_size)
+            return self._save_file(path, key, filename, content_type, size, file_hash)
+
+        # 写入前无法得知文件内容的hash，先写入暂存区
+        staging = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, Constant.CAS_UPLOAD_DIR, ".staging",
+                               StringUtil.get_unique_key())
+        try:
+            _, file_hash = self._write_chunks(chunks, staging, max_size)
+            return self._link_blob(file_hash, filename, content_type, staging)
+        finally:
+            if staging.exists():
+                staging.unlink()
+
+    def _link_blob(self, file_hash: str, filename: str, content_type: Optional[str],
+                   staging: Optional[pathlib.Path] = None) -> Optional[FileViewSchema]:
+        """
+        内容寻址存储 - 新增一条引用该内容的文件记录。文件已存在时丢弃暂存文件，否则将暂存文件移动到目标位置
+
+        :param file_hash: 文件内容的SHA-256
+        :param filename: 文件名
+        :param content_type: 文件类型
+        :param staging: 暂存文件，为空时要求文件已存在
+        :return: 文件URL，staging为空且文件不存在时为空
+        """
+        key: str = self._get_blob_key(file_hash)
+        path = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, key)
+        # 与删除互斥，避免删除最后一条引用时误删刚刚新增引用的文件
+        with self._lock_key(key):
+            if not path.exists():
+                if staging is None:
+                    return None
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(staging, path)
+            size: int = path.stat().st_size
+            file: File = File()
+            file.key = key
+            file.filename = filename
+            file.size = size
+            file.hash = file_hash
+            file.content_type = content_type
+            try:
+                file_id = self.repository.save(file)
+            except Exception:
+                if self.repository.count_references(key, file_hash) == 0:
+                    path.unlink()
+                raise
+        return FileViewSchema(id=file_id, size=size, filename=filename, url=settings.UPLOAD_DIR + key, hash=file_hash)
+
+    @staticmethod
+    def _get_blob_key(file_hash: str) -> str:
+        """ 内容寻址存储的存储路径，按hash前缀分为两级目录 """
+        return "/".join((Constant.CAS_UPLOAD_DIR, file_hash[:2], file_hash[2:4], file_hash))
+
+    @staticmethod
+    def _is_shared(key: str) -> bool:
+        """ 是否为内容寻址存储的路径(可能被多条记录引用)。关闭FILE_DEDUPLICATE之前保存的文件仍按引用计数删除 """
+        return key.startswith(Constant.CAS_UPLOAD_DIR + "/")
+
+    def _lock_key(self, key: str) -> ContextManager:
+        """ 内容寻址存储时，对同一存储路径的引用变更需要加锁 """
+        if not self._is_shared(key) or self.redis is None:
+            return nullcontext()
+        return self.redis.lock(Constant.FILE_LOCK_REDIS_KEY + key, timeout=60, blocking_timeout=30)
+
+    def _save_file(self, path: pathlib.Path, key: str, filename: str, content_type: Optional[str], size: int,
+                   file_hash: str) -> FileViewSchema:
+        """ 保存已写入磁盘的文件记录，保存失败时删除文件 """
+        file: File = File()
+        file.key = key
+        file.filename = filename
+        file.size = size
+        file.hash = file_hash
+        file.content_type = content_type
+        try:
+            file_id = self.repository.save(file)
+        except Exception:
+            path.unlink()
+            raise
+        return FileViewSchema(id=file_id, size=size, filename=filename, url=settings.UPLOAD_DIR + key, hash=file_hash)
+
+    @staticmethod
+    def _read_chunks(stream: BinaryIO) -> Iterator[bytes]:
+        while True:
+            chunk: bytes = stream.read(settings.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    @classmethod
+    def _read_file_chunks(cls, path: pathlib.Path) -> Iterator[bytes]:
+        with open(path, "rb") as stream:
+            yield from cls._read_chunks(stream)
+
+    @staticmethod
+    def _write_chunks(chunks: Iterable[bytes], path: pathlib.Path, max_size: Optional[int] = None) -> Tuple[int, str]:
+        """
+        将数据块依次写入同目录下的临时文件，同时计算文件大小和SHA-256，全部写入后原子性地重命名为目标文件，
+        因此目标路径上不会出现不完整的文件
+
+        :param chunks: 数据块
+        :param path: 目标路径
+        :param max_size: 文件大小上限，为空时不限制
+        :return: 文件大小、SHA-256
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".part")
+        size: int = 0
+        sha256 = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise ProximaException(code=413, description="文件大小超出限制")
+                    sha256.update(chunk)
+                    temp_file.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return size, sha256.hexdigest()
+
     @staticmethod
     def _create_key_by_filename(filename: str) -> str:
         path = pathlib.Path(filename)
@@ -0,0 +1,101 @@
+from typing import Any, Callable, Dict, FrozenSet, Final, Iterable, List, Optional, Set
+
+import orjson
+from redis import Redis
+
+from settings import settings
+from src.apps.manage.repository import AuthorityRepository, UserRepository
+from src.common.constant import Constant
+from src.core.cache import InvalidationBus, TwoLevelCache
+
+
+class PermissionCache:
+    """
+    权限解析缓存，包含 用户 -> 角色id集合、角色 -> 权限标识集合 两级映射，各使用一个两级缓存，依次从进程内LRU、redis、数据库中加载。
+    角色授权或用户角色发生变更时，清除redis中的缓存并通过InvalidationBus通知所有进程清除本地缓存，无需重新登录即可生效；
+    与清除并发的加载不会把变更前的权限写回缓存(见TwoLevelCache.get_many_or_load)
+    """
+
+    def __init__(self, redis: Redis, user_repository: Callable[[], UserRepository],
+                 authority_repository: Callable[[], AuthorityRepository], bus: Optional[InvalidationBus] = None):
+        """
+        :param redis: redis客户端
+        :param user_repository: 用户repository的工厂(缓存为单例，不能持有repository的会话上下文)
+        :param authority_repository: 权限repository的工厂
+        :param bus: 缓存失效广播
+        """
+        self.user_repository: Final[Callable[[], UserRepository]] = user_repository
+        self.authority_repository: Final[Callable[[], AuthorityRepository]] = authority_repository
+        options: Dict[str, Any] = {
+            "ttl": settings.PERMISSION_CACHE_TTL,
+            "local_ttl": settings.PERMISSION_LOCAL_CACHE_TTL,
+            "local_size": settings.PERMISSION_LOCAL_CACHE_SIZE,
+            "bus": bus,
+            "decode": lambda value: frozenset(orjson.loads(value)),
+        }
+        self.user_roles: Final[TwoLevelCache] = TwoLevelCache(redis, Constant.PERM_USER_CACHE_NAMESPACE, **options)
+        self.role_authorities: Final[TwoLevelCache] = TwoLevelCache(redis, Constant.PERM_ROLE_CACHE_NAMESPACE,
+                                                                    **options)
+
+    def resolve(self, user_id: int) -> Set[str]:
+        """
+        获取用户所有的权限标识
+
+        :param user_id: 用户id
+        :return: 权限标识集合
+        """
+        authorities: Set[str] = set()
+        for codes in self.get_role_authorities(self.get_user_roles(user_id)).values():
+            authorities.update(codes)
+        return authorities
+
+    def get_user_roles(self, user_id: int) -> FrozenSet[int]:
+        """
+        获取用户绑定的角色id
+
+        :param user_id: 用户id
+        :return: 角色id集合
+        """
+        return self.user_roles.get_or_load(
+            str(user_id), lambda: orjson.dumps(sorted(self.user_repository().get_role_ids(user_id))).decode()
+        )
+
+    def get_role_authorities(self, role_ids: Iterable[int]) -> Dict[int, FrozenSet[str]]:
+        """
+        批量获取角色对应的权限标识。本地未命中的角色通过一次MGET读取redis，redis仍未命中的通过一次查询读取数据库
+
+        :param role_ids: 角色id
+        :return: 角色id -> 权限标识集合
+        """
+
+        def load(keys: List[str]) -> Dict[str, str]:
+            loaded: Dict[int, Set[str]] = self.authority_repository().get_codes_by_roles([int(key) for key in keys])
+            return {str(role_id): orjson.dumps(sorted(codes)).decode() for role_id, codes in loaded.items()}
+
+        cached: Dict[str, FrozenSet[str]] = self.role_authorities.get_many_or_load(
+            [str(role_id) for role_id in role_ids], load
+        )
+        return {int(key): codes for key, codes in cached.items()}
+
+    def evict_user(self, user_id: int) -> None:
+        """
+        用户的角色绑定发生变更后调用
+
+        :param user_id: 用户id
+        :return:
+        """
+        self.user_roles.delete(str(user_id))
+
+    def evict_roles(self, role_ids: Iterable[int]) -> None:
+        """
+        角色的授权发生变更(角色授权变更、角色删除、权限变更)后调用
+
+        :param role_ids: 角色id
+        :return:
+        """
+        keys: List[str] = [str(role_id) for role_id in role_ids]
+        if len(keys) > 0:
+            self.role_authorities.delete(*keys)
+
+
+__all__ = ["PermissionCache"]
@@ -1,16 +1,22 @@
-from typing import Optional, Sequence, Dict, List, Final
+from typing import Optional, Sequence, Dict, List, Set, Tuple
 
 from sqlalchemy import insert, or_, delete, update
 from sqlalchemy import select, func
 from sqlalchemy.engine import Result
 
 from src.apps.manage.models import User, Role, Authority, UserRoleRel, RoleAuthRel
+from src.common.enums import CountMode
+from src.core.query_cache import cached
 from src.core.repository import Repository
 
 
 class UserRepository(Repository[User]):
 
-    entity_class = Final[User]
+    entity_class = User
+    cursor_columns = ("id", "email")
+    count_mode = CountMode.cached
+    export_columns = ("id", "username", "nickname", "email", "mobile", "gender", "avatar", "status", "remark",
+                      "created", "updated")
 
     def add_user(self, user: User, roles: Sequence[int] = None) -> int:
         """
@@ -27,6 +33,7 @@ class UserRepository(Repository[User]):
                 session.execute(insert(UserRoleRel), entities)
             # 保存用户
             session.commit()
+            self._on_changed()
             return user.id
 
     def update_user(self, ident: int, data: Dict, roles: Sequence[int] = None) -> None:
@@ -48,6 +55,7 @@ class UserRepository(Repository[User]):
             session.execute(update(User).where(User.id == ident).values(**data))
             # 提交事务
             session.commit()
+            self._on_changed([ident])
 
     def delete_user(self, ident: int) -> None:
         """
@@ -61,6 +69,52 @@ class UserRepository(Repository[User]):
             # 再删除用户
             session.execute(delete(User).where(User.id == ident))
             session.commit()
+            self._on_changed([ident])
+
+    def bulk_add_users(self, users: Sequence[Dict], roles: Sequence[Sequence[int]]) -> None:
+        """
+        批量添加用户及其角色绑定，使用多行插入，所有数据在同一个事务中提交。
+        使用独立的事务并立即提交，每一批的成败不影响请求中的其他批次
+        :param users: 用户数据，所有元素的键必须一致
+        :param roles: 与用户一一对应的角色id列表
+        :return:
+        """
+        with self.session_context.independent() as session:
+            session.execute(insert(User), users)
+            # 多行插入无法可靠地返回每一行的主键，通过唯一的邮箱查回
+            stmt = select(User.email, User.id).where(User.email.in_([user["email"] for user in users]))
+            ids: Dict[str, int] = {email: ident for email, ident in session.execute(stmt)}
+            entities = [{"user_id": ids[user["email"]], "role_id": role_id}
+                        for user, role_ids in zip(users, roles) for role_id in role_ids]
+            if len(entities) > 0:
+                session.execute(insert(UserRoleRel), entities)
+            session.commit()
+            self._on_changed()
+
+    def get_existing_accounts(self, usernames: Sequence[str], emails: Sequence[str],
+                              mobiles: Sequence[str]) -> Tuple[Set[str], Set[str], Set[str]]:
+        """
+        查询已被使用的用户名、邮箱和手机号，用于批量检查唯一性
+        :param usernames: 用户名
+        :param emails: 邮箱
+        :param mobiles: 手机号(未填写手机号的用户为空字符串，同样需要唯一)
+        :return: 已存在的用户名集合、已存在的邮箱集合、已存在的手机号集合
+        """
+        with self.session_context as session:
+            stmt = select(User.username, User.email, User.mobile).where(
+                or_(User.username.in_(usernames), User.email.in_(emails), User.mobile.in_(mobiles))
+            )
+            rows = session.execute(stmt).all()
+            return {row.username for row in rows}, {row.email for row in rows}, {row.mobile for row in rows}
+
+    def get_existing_role_ids(self, role_ids: Sequence[int]) -> Set[int]:
+        """
+        查询存在的角色id
+        :param role_ids: 角色id
+        :return: 其中存在的角色id
+        """
+        with self.session_context as session:
+            return set(session.execute(select(Role.id).where(Role.id.in_(role_ids))).scalars().all())
 
     def get_user_by_email(self, email: str) -> Optional[User]:
         """
@@ -71,6 +125,27 @@ class UserRepository(Repository[User]):
         with self.session_context as session:
             return session.execute(select(User).where(User.email == email)).scalar_one_or_none()
 
+    def update_password(self, ident: int, password: str) -> None:
+        """
+        更新用户的密码哈希码
+        :param ident: 用户id
+        :param password: 哈希码
+        :return:
+        """
+        with self.session_context as session:
+            session.execute(update(User).where(User.id == ident).values(password=password))
+            session.commit()
+
+    def get_role_ids(self, user_id: int) -> List[int]:
+        """
+        获取用户绑定的所有角色id
+        :param user_id: 用户id
+        :return: 角色id列表
+        """
+        with self.session_context as session:
+            stmt = select(UserRoleRel.role_id).where(UserRoleRel.user_id == user_id)
+            return session.execute(stmt).scalars().all()
+
     def get_by_username_or_email(self, username: str, email: str) -> List[User]:
         """
         通过用户名或邮箱检索用户
@@ -85,7 +160,7 @@ class UserRepository(Repository[User]):
 
 
 class RoleRepository(Repository[Role]):
-    entity_class = Final[Role]
+    entity_class = Role
 
     def add_role(self, role: Role, authorities: Sequence[int] = None) -> int:
         """
@@ -102,6 +177,7 @@ class RoleRepository(Repository[Role]):
                 entities = [{"role_id": role.id, "auth_id": auth} for auth in authorities]
                 session.execute(insert(RoleAuthRel), entities)
             session.commit()
+            self._on_changed()
             return role.id
 
     def update_role(self, ident: int, data: Dict, authorities: Sequence[int] = None) -> None:
@@ -121,6 +197,7 @@ class RoleRepository(Repository[Role]):
             session.execute(update(Role).where(Role.id == ident).values(**data))
 
             session.commit()
+            self._on_changed([ident])
 
     def delete_role(self, ident) -> None:
         with self.session_context as session:
@@ -131,7 +208,9 @@ class RoleRepository(Repository[Role]):
             # 删除角色本体
             session.execute(delete(Role).where(Role.id == ident))
             session.commit()
+            self._on_changed([ident])
 
+    @cached(tags=("role:{role_id}", "user"))
     def get_user_count_by_role(self, role_id: int):
         """
         获取某角色对应人数
@@ -143,6 +222,7 @@ class RoleRepository(Repository[Role]):
             count: int = session.execute(count_stmt).scalar()
             return count
 
+    @cached(tags=("role",))
     def get_count_by_name(self, name: str) -> int:
         """
         通过用户名和邮箱检索用户
@@ -156,8 +236,9 @@ class RoleRepository(Repository[Role]):
 
 
 class AuthorityRepository(Repository[Authority]):
-    entity_class = Final[Authority]
+    entity_class = Authority
 
+    @cached(tags=("role:{role_id}",))
     def get_authorities_by_role(self, role_id: int) -> List[int]:
         """
         通过角色id获取该角色对应的权限
@@ -169,6 +250,33 @@ class AuthorityRepository(Repository[Authority]):
             res: Result = session.execute(stmt)
             return res.scalars().all()
 
+    def get_codes_by_roles(self, role_ids: Sequence[int]) -> Dict[int, Set[str]]:
+        """
+        批量获取角色对应的权限标识
+        :param role_ids: 角色id列表
+        :return: 角色id -> 权限标识集合(没有权限的角色对应空集合)
+        """
+        result: Dict[int, Set[str]] = {role_id: set() for role_id in role_ids}
+        if len(result) == 0:
+            return result
+        with self.session_context as session:
+            stmt = select(RoleAuthRel.role_id, Authority.code) \
+                .join(Authority, Authority.id == RoleAuthRel.auth_id) \
+                .where(RoleAuthRel.role_id.in_(role_ids))
+            for role_id, code in session.execute(stmt):
+                result[role_id].add(code)
+        return result
+
+    def get_role_ids_by_authority(self, ident: int) -> List[int]:
+        """
+        获取拥有某权限的所有角色id
+        :param ident: 权限id
+        :return: 角色id列表
+        """
+        with self.session_context as session:
+            stmt = select(RoleAuthRel.role_id).where(RoleAuthRel.auth_id == ident)
+            return session.execute(stmt).scalars().all()
+
     def get_role_count_by_authority(self, ident) -> int:
         with self.session_context as session:
             # 检测是否有用户依赖该角色
@@ -1,13 +1,15 @@
-from typing import List, Dict, Any
-
 from dependency_injector.wiring import inject, Provide
-from flask import Blueprint, request
+from flask import Blueprint, request, current_app
 
 from container import Container
 from src.apps.manage.models import Authority
 from src.apps.manage.schemas import AuthorityViewSchema, AuthorityCreateSchema, AuthorityUpdateSchema
 from src.apps.manage.services import AuthorityService
+from src.common.enums import DataFormat
+from src.core.web.conditional import conditional
+from src.core.web.export import send_export
 from src.core.web.response import Response
+from src.utils import RequestUtil
 
 bp = Blueprint("perm", __name__, url_prefix="/perm")
 
@@ -15,10 +17,11 @@ bp = Blueprint("perm", __name__, url_prefix="/perm")
 @bp.get("/tree")
 # @login_required
 @inject
+@conditional(Authority)
 def tree(service: AuthorityService = Provide[Container.authority_service]) -> Response[AuthorityViewSchema]:
-    authorities: List[Authority] = service.get_by_map(None)
-    trees: List[Dict[str, Any]] = service.build_authority_tree(authorities)
-    return Response.ok(data=trees)
+    # 直接返回缓存的序列化结果，避免每次请求都查询数据库并重新构建、序列化权限树
+    body: bytes = service.get_authority_tree_response()
+    return current_app.response_class(body, mimetype="application/json")
 
 
 @bp.post("/add")
@@ -31,6 +34,15 @@ def add(service: AuthorityService = Provide[Container.authority_service]):
     return Response.ok(msg="权限添加成功")
 
 
+@bp.get("/export")
+# @login_required
+@inject
+def export(service: AuthorityService = Provide[Container.authority_service]):
+    """ 流式导出所有权限，参数format指定格式(csv/jsonl)，默认为CSV """
+    data_format: DataFormat = RequestUtil.parse_enum_arg("format", DataFormat, default=DataFormat.csv)
+    return send_export(service.export(data_format), data_format, "authorities")
+
+
 @bp.get("/info/<int:ident>")
 # @login_required
 @inject
@@ -1,3 +1,5 @@
+from typing import Optional, Union
+
 from dependency_injector.wiring import inject, Provide
 from flask import Blueprint, request
 
@@ -6,8 +8,11 @@ from src.apps.manage.models import Role
 from src.apps.manage.schemas import RoleCreateSchema, RoleUpdateSchema, RoleViewSchema
 from src.apps.manage.services.role import RoleService
 from src.common.constant import Constant
+from src.common.enums import CountMode, DataFormat
+from src.core.web.conditional import conditional
+from src.core.web.export import send_export
 from src.core.web.response import Response
-from src.core.web.schemas import Page
+from src.core.web.schemas import Page, CursorPage
 from src.utils import RequestUtil
 
 bp = Blueprint("role", __name__, url_prefix="/role")
@@ -16,17 +21,34 @@ bp = Blueprint("role", __name__, url_prefix="/role")
 @bp.get("/page")
 @inject
 # @login_required
-def page(service: RoleService = Provide[Container.role_service]) -> Response[Page[RoleViewSchema]]:
+def page(service: RoleService = Provide[Container.role_service]) -> Response[Union[Page, CursorPage]]:
     current: int = RequestUtil.parse_int_arg("current", default=Constant.CURRENT_PAGE)
     size: int = RequestUtil.parse_int_arg("size", default=Constant.PAGE_SIZE)
-    data: Page[Role] = service.get_page(current, size)
+    # 携带after/before参数(可为空)时使用游标分页
+    after: Optional[str] = request.args.get("after", None)
+    before: Optional[str] = request.args.get("before", None)
+    order_by: Optional[str] = request.args.get("order_by", None)
+    # 页码分页时总数的统计方式
+    count_mode: Optional[CountMode] = RequestUtil.parse_enum_arg("count", CountMode)
+    data: Union[Page, CursorPage] = service.get_page(current, size, after=after, before=before, order_by=order_by,
+                                                     count_mode=count_mode)
     data.records = [RoleViewSchema.from_orm(role) for role in data.records]
     return Response.ok(data=data)
 
 
+@bp.get("/export")
+@inject
+# @login_required
+def export(service: RoleService = Provide[Container.role_service]):
+    """ 流式导出所有角色，参数format指定格式(csv/jsonl)，默认为CSV """
+    data_format: DataFormat = RequestUtil.parse_enum_arg("format", DataFormat, default=DataFormat.csv)
+    return send_export(service.export(data_format), data_format, "roles")
+
+
 @bp.get("/info/<int:ident>")
 @inject
 # @login_required
+@conditional(Role)
 def info(ident: int, service: RoleService = Provide[Container.role_service]) -> Response[RoleViewSchema]:
     role: RoleViewSchema = RoleViewSchema.from_orm(service.get_by_id(ident))
     return Response.ok(data=role)
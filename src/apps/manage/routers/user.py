@@ -1,14 +1,19 @@
+from typing import Optional, Union
+
 from dependency_injector.wiring import inject, Provide
 from flask import Blueprint, request
 
 from container import Container
 from src.apps.manage.models import User
-from src.apps.manage.schemas import UserCreateSchema, UserUpdateSchema, UserViewSchema
+from src.apps.manage.schemas import UserCreateSchema, UserUpdateSchema, UserViewSchema, UserImportResultSchema
 from src.apps.manage.services import UserService
 from src.common.constant import Constant
+from src.common.enums import CountMode, DataFormat
 from src.core.security import login_required
+from src.core.web.conditional import conditional
+from src.core.web.export import send_export
 from src.core.web.response import Response
-from src.core.web.schemas import Page
+from src.core.web.schemas import Page, CursorPage
 from src.utils import RequestUtil
 
 bp = Blueprint("user", __name__, url_prefix="/user")
@@ -17,17 +22,34 @@ bp = Blueprint("user", __name__, url_prefix="/user")
 @bp.get("/page")
 @inject
 @login_required
-def page(service: UserService = Provide[Container.user_service]) -> Response[Page[UserViewSchema]]:
+def page(service: UserService = Provide[Container.user_service]) -> Response[Union[Page, CursorPage]]:
     """ 获取用户分页列表 """
     current: int = RequestUtil.parse_int_arg("current", default=Constant.CURRENT_PAGE)
     size: int = RequestUtil.parse_int_arg("size", default=Constant.PAGE_SIZE)
-    data: Page[UserViewSchema] = service.get_user_list(current=current, size=size)
+    # 携带after/before参数(可为空)时使用游标分页
+    after: Optional[str] = request.args.get("after", None)
+    before: Optional[str] = request.args.get("before", None)
+    order_by: Optional[str] = request.args.get("order_by", None)
+    # 页码分页时总数的统计方式
+    count_mode: Optional[CountMode] = RequestUtil.parse_enum_arg("count", CountMode)
+    data: Union[Page, CursorPage] = service.get_user_list(current=current, size=size, after=after, before=before,
+                                                          order_by=order_by, count_mode=count_mode)
     return Response.ok(data=data)
 
 
+@bp.get("/export")
+@inject
+@login_required
+def export(service: UserService = Provide[Container.user_service]):
+    """ 流式导出所有用户，参数format指定格式(csv/jsonl)，默认为CSV """
+    data_format: DataFormat = RequestUtil.parse_enum_arg("format", DataFormat, default=DataFormat.csv)
+    return send_export(service.export(data_format), data_format, "users")
+
+
 @bp.get("/info/<int:ident>")
 @inject
 @login_required
+@conditional(User)
 def info(ident: int, service: UserService = Provide[Container.user_service]) -> Response[UserViewSchema]:
     user: User = service.get_by_id(ident)
     return Response.ok(data=UserViewSchema.from_orm(user))
@@ -42,6 +64,16 @@ def add(service: UserService = Provide[Container.user_service]) -> Response[str]
     return Response.ok(msg="用户添加成功")
 
 
+@bp.post("/import")
+@inject
+@login_required
+def import_users(service: UserService = Provide[Container.user_service]) -> Response[UserImportResultSchema]:
+    """ 批量导入用户。请求体为CSV(首行为表头)或JSONL，通过参数format指定格式，默认为CSV，边读取边导入 """
+    data_format: DataFormat = RequestUtil.parse_enum_arg("format", DataFormat, default=DataFormat.csv)
+    result: UserImportResultSchema = service.import_users(request.stream, data_format)
+    return Response.ok(data=result, msg=f"成功导入{result.created}个用户")
+
+
 @bp.post("/update/<int:ident>")
 @inject
 @login_required
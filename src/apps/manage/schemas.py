@@ -1,3 +1,4 @@
+from dataclasses import dataclass, field
 from typing import Optional, List, Union
 
 from pydantic import Field, EmailStr, NonNegativeInt
@@ -106,6 +107,27 @@ class UserRoleSchema(BaseValidationSchema):
     updated_at: Optional[int]
 
 
+@dataclass
+class UserImportErrorSchema:
+    """ 导入失败的行 """
+    # 行号
+    line: int
+    errors: List[str]
+
+
+@dataclass
+class UserImportResultSchema:
+    """ 批量导入用户的结果 """
+    # 读取的数据行数
+    total: int = 0
+    # 成功导入的用户数
+    created: int = 0
+    # 导入失败的行数
+    failed: int = 0
+    # 失败原因，最多返回settings.USER_IMPORT_MAX_ERRORS条
+    errors: List[UserImportErrorSchema] = field(default_factory=list)
+
+
 AuthorityViewSchema.update_forward_refs()
 
 __all__ = [
@@ -114,5 +136,5 @@ __all__ = [
     "UserCreateSchema", "UserUpdateSchema",
     "RoleCreateSchema", "RoleUpdateSchema",
     "AuthorityCreateSchema", "AuthorityUpdateSchema",
-    "UserRoleSchema"
+    "UserRoleSchema", "UserImportErrorSchema", "UserImportResultSchema"
 ]
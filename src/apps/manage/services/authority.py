@@ -1,9 +1,16 @@
 from abc import abstractmethod
-from typing import List, MutableSequence, Dict, Any
+from functools import partial
+from typing import List, MutableSequence, Dict, Any, Optional, Final, Union
+
+import orjson
 
 from src.apps.manage.models import Authority
+from src.apps.manage.permission import PermissionCache
 from src.apps.manage.repository import AuthorityRepository
-from src.core.service import IService, ServiceImpl
+from src.core.cache import TwoLevelCache
+from src.core.db.unit_of_work import after_commit
+from src.core.service import IService, ServiceImpl, DataSchema, T
+from src.core.web.response import Response
 from src.core.web.schemas import TreeSchema
 from src.exceptions import ProximaException
 from src.utils import TreeUtil
@@ -20,6 +27,14 @@ class AuthorityService(IService):
         """
         raise NotImplemented
 
+    @abstractmethod
+    def get_authority_tree_response(self) -> bytes:
+        """
+        获取完整权限树的响应体(已序列化为JSON)。权限未变更时直接返回缓存
+        :return:
+        """
+        raise NotImplemented
+
     @abstractmethod
     def get_authorities_by_role_id(self, ident: int) -> List[int]:
         """
@@ -41,9 +56,40 @@ class AuthorityService(IService):
 
 class AuthorityServiceImpl(ServiceImpl[AuthorityRepository, Authority], AuthorityService):
 
+    # 权限树在缓存中的键
+    tree_cache_key: Final[str] = "tree"
+
+    def __init__(self, repository: AuthorityRepository, permission_cache: Optional[PermissionCache] = None,
+                 tree_cache: Optional[TwoLevelCache] = None):
+        super().__init__(repository)
+        self.permission_cache: Final[Optional[PermissionCache]] = permission_cache
+        self.tree_cache: Final[Optional[TwoLevelCache]] = tree_cache
+
+    def save(self, entity: Union[T, DataSchema]) -> int:
+        ident: int = super().save(entity)
+        self._evict_tree()
+        return ident
+
+    def update(self, ident: int, schema: DataSchema) -> None:
+        super().update(ident, schema)
+        self._evict_tree()
+        # 权限标识可能已变更，事务提交后使拥有该权限的角色的权限缓存失效
+        if self.permission_cache is not None:
+            after_commit(partial(self.permission_cache.evict_roles, self.repository.get_role_ids_by_authority(ident)))
+
     def build_authority_tree(self, authorities: List[Authority]) -> List[Dict[str, str]]:
         return TreeUtil.build_tree([TreeSchema.from_orm(authority) for authority in authorities])
 
+    def get_authority_tree_response(self) -> bytes:
+        if self.tree_cache is None:
+            return self._load_authority_tree(primary=False).encode()
+        # 权限树写入缓存，从主库读取
+        return self.tree_cache.get_or_load(self.tree_cache_key, partial(self._load_authority_tree, True)).encode()
+
+    def _load_authority_tree(self, primary: bool) -> str:
+        trees: List[Dict[str, Any]] = self.build_authority_tree(self.repository.get_by_map(None, primary=primary))
+        return orjson.dumps(Response.ok(data=trees)).decode()
+
     def get_authorities_by_role_id(self, ident: int) -> List[int]:
         return self.repository.get_authorities_by_role(ident)
 
@@ -54,3 +100,9 @@ class AuthorityServiceImpl(ServiceImpl[AuthorityRepository, Authority], Authorit
             raise ProximaException(description="角色删除失败, 有用户依赖于该角色")
         # 删除权限本体
         self.repository.delete(ident)
+        self._evict_tree()
+
+    def _evict_tree(self) -> None:
+        """ 权限发生变更后，在事务提交后清除所有进程中缓存的权限树 """
+        if self.tree_cache is not None:
+            after_commit(partial(self.tree_cache.delete, self.tree_cache_key))
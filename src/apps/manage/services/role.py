@@ -1,8 +1,12 @@
 from abc import abstractmethod
+from functools import partial
+from typing import Optional, Final
 
 from src.apps.manage.models import Role
+from src.apps.manage.permission import PermissionCache
 from src.apps.manage.repository import RoleRepository
 from src.apps.manage.schemas import RoleCreateSchema, RoleUpdateSchema
+from src.core.db.unit_of_work import after_commit
 from src.core.service import IService, ServiceImpl
 from src.exceptions import ProximaException
 
@@ -43,6 +47,10 @@ class RoleService(IService):
 
 class RoleServiceImpl(ServiceImpl[RoleRepository, Role], RoleService):
 
+    def __init__(self, repository: RoleRepository, permission_cache: Optional[PermissionCache] = None):
+        super().__init__(repository)
+        self.permission_cache: Final[Optional[PermissionCache]] = permission_cache
+
     def add_role(self, schema: RoleCreateSchema) -> None:
         count: int = self.repository.get_count_by_name(schema.name)
         if count > 0:
@@ -62,6 +70,9 @@ class RoleServiceImpl(ServiceImpl[RoleRepository, Role], RoleService):
         data = schema.dict(exclude_unset=True)
         authorities = data.pop("authorities", None)
         self.repository.update_role(ident, data, authorities)
+        # 角色授权已变更，事务提交后使该角色的权限缓存失效
+        if self.permission_cache is not None and authorities is not None:
+            after_commit(partial(self.permission_cache.evict_roles, [ident]))
 
     def delete_role(self, ident: int) -> None:
         count: int = self.repository.get_user_count_by_role(ident)
@@ -69,3 +80,5 @@ class RoleServiceImpl(ServiceImpl[RoleRepository, Role], RoleService):
             raise ProximaException(description="角色删除失败, 有用户依赖于该角色")
         # 删除角色何其所有关联权限
         self.repository.delete_role(ident)
+        if self.permission_cache is not None:
+            after_commit(partial(self.permission_cache.evict_roles, [ident]))
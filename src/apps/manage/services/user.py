@@ -1,25 +1,42 @@
+import re
 from abc import abstractmethod
-from typing import List, Optional
+from functools import partial
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple, Union, Final
 
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+
+from settings import settings
 from src.apps.manage.models import User
+from src.apps.manage.permission import PermissionCache
 from src.apps.manage.repository import UserRepository
-from src.apps.manage.schemas import UserCreateSchema, UserUpdateSchema, UserViewSchema
+from src.apps.manage.schemas import UserCreateSchema, UserUpdateSchema, UserViewSchema, UserImportErrorSchema, \
+    UserImportResultSchema
+from src.common.enums import CountMode, DataFormat
+from src.core.db.unit_of_work import after_commit
+from src.core.hashing import PasswordHasher
 from src.core.service import IService, ServiceImpl
-from src.core.web.schemas import Page
+from src.core.web.schemas import Page, CursorPage
 from src.exceptions import ProximaException
-from src.utils import SecurityUtil
+from src.utils import SecurityUtil, TabularUtil
 
 
 class UserService(IService):
     """ 用户相关业务逻辑 """
 
     @abstractmethod
-    def get_user_list(self, current: Optional[int] = 1, size: Optional[int] = 10) -> Page[UserViewSchema]:
+    def get_user_list(self, current: Optional[int] = 1, size: Optional[int] = 10, after: Optional[str] = None,
+                      before: Optional[str] = None, order_by: Optional[str] = None,
+                      count_mode: Optional[CountMode] = None) -> Union[Page[UserViewSchema], CursorPage]:
         """
         获取用户列表(可分页)
 
         :param current: 页码 默认1
         :param size: 每页数量 默认10
+        :param after: 下一页游标，与before任一不为None时使用游标分页
+        :param before: 上一页游标
+        :param order_by: 游标分页的排序字段
+        :param count_mode: 页码分页的总数统计方式
         :return: 分页数据
         """
         raise NotImplemented
@@ -34,6 +51,17 @@ class UserService(IService):
         """
         raise NotImplemented
 
+    @abstractmethod
+    def import_users(self, stream: BinaryIO, data_format: DataFormat) -> UserImportResultSchema:
+        """
+        批量导入用户
+
+        :param stream: 数据流，字段与新增用户时相同，CSV中的角色id使用逗号、分号或竖线分隔
+        :param data_format: 数据格式
+        :return: 导入结果
+        """
+        raise NotImplemented
+
     @abstractmethod
     def update_user(self, ident: int, schema: UserUpdateSchema) -> None:
         """
@@ -58,17 +86,29 @@ class UserService(IService):
 
 class UserServiceImpl(ServiceImpl[UserRepository, User], UserService):
 
-    def get_user_list(self, current: Optional[int] = 1, size: Optional[int] = 10) -> Page[UserViewSchema]:
+    def __init__(self, repository: UserRepository, permission_cache: Optional[PermissionCache] = None,
+                 password_hasher: Optional[PasswordHasher] = None):
+        super().__init__(repository)
+        self.permission_cache: Final[Optional[PermissionCache]] = permission_cache
+        self.password_hasher: Final[Optional[PasswordHasher]] = password_hasher
+
+    def get_user_list(self, current: Optional[int] = 1, size: Optional[int] = 10, after: Optional[str] = None,
+                      before: Optional[str] = None, order_by: Optional[str] = None,
+                      count_mode: Optional[CountMode] = None) -> Union[Page[UserViewSchema], CursorPage]:
         """
         获取用户列表(可分页)
 
         :param current: 页码
         :param size: 每页数量
+        :param after: 下一页游标，与before任一不为None时使用游标分页
+        :param before: 上一页游标
+        :param order_by: 游标分页的排序字段
+        :param count_mode: 页码分页的总数统计方式
         :return: 分页数据
         """
-        _res: Page[User] = self.repository.get_page(current, size)
-        result: Page[UserViewSchema] = Page(total=_res.total, current=_res.current, size=_res.size, pages=_res.pages)
-        result.records = [UserViewSchema.from_orm(obj) for obj in _res.records]
+        result: Union[Page, CursorPage] = self.get_page(current, size, after=after, before=before, order_by=order_by,
+                                                        count_mode=count_mode)
+        result.records = [UserViewSchema.from_orm(obj) for obj in result.records]
         return result
 
     def add_user(self, schema: UserCreateSchema) -> None:
@@ -85,10 +125,138 @@ class UserServiceImpl(ServiceImpl[UserRepository, User], UserService):
         user.email = schema.email
         user.mobile = schema.mobile
         user.avatar = schema.avatar
-        user.password = SecurityUtil.generate_password(schema.password)
-        self.repository.save(user)
+        if self.password_hasher is not None:
+            user.password = self.password_hasher.generate(schema.password)
+        else:
+            user.password = SecurityUtil.generate_password(schema.password)
         self.repository.add_user(user, schema.roles)
 
+    def import_users(self, stream: BinaryIO, data_format: DataFormat) -> UserImportResultSchema:
+        """
+        批量导入用户。逐行读取数据，每USER_IMPORT_BATCH_SIZE行为一批：
+         - 校验数据，一次IN查询检查整批用户名/邮箱/手机号的唯一性，一次查询检查角色是否存在
+         - 并行计算密码哈希
+         - 多行插入用户及角色绑定，每批一个事务
+        某一行出错不影响其他行，出错的行及原因记录在结果中
+
+        :param stream: 数据流
+        :param data_format: 数据格式
+        :return: 导入结果
+        """
+        result: UserImportResultSchema = UserImportResultSchema()
+        # 本次导入中已出现的用户名、邮箱和手机号，用于检查数据内部的重复
+        seen_usernames: Set[str] = set()
+        seen_emails: Set[str] = set()
+        seen_mobiles: Set[str] = set()
+        batch: List[Tuple[int, Dict]] = []
+        for line, row in TabularUtil.read_rows(stream, data_format):
+            result.total += 1
+            batch.append((line, row))
+            if len(batch) >= settings.USER_IMPORT_BATCH_SIZE:
+                self._import_batch(batch, result, seen_usernames, seen_emails, seen_mobiles)
+                batch = []
+        if len(batch) > 0:
+            self._import_batch(batch, result, seen_usernames, seen_emails, seen_mobiles)
+        result.errors.sort(key=lambda error: error.line)
+        return result
+
+    def _import_batch(self, batch: List[Tuple[int, Dict]], result: UserImportResultSchema, seen_usernames: Set[str],
+                      seen_emails: Set[str], seen_mobiles: Set[str]) -> None:
+        valid: List[Tuple[int, UserCreateSchema]] = []
+        for line, row in batch:
+            if isinstance(row.get("roles"), str):
+                row["roles"] = [role for role in re.split(r"[\s,;|]+", row["roles"]) if role]
+            try:
+                schema: UserCreateSchema = UserCreateSchema(**row)
+            except ValidationError as exc:
+                self._add_import_error(result, line, [
+                    f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in exc.errors()
+                ])
+                continue
+            errors: List[str] = []
+            if schema.username in seen_usernames:
+                errors.append("用户名重复")
+            if schema.email in seen_emails:
+                errors.append("邮箱重复")
+            # 手机号唯一，未填写的用户以空字符串写入，因此也只能有一个
+            mobile: str = schema.mobile or ""
+            if mobile in seen_mobiles:
+                errors.append("手机号重复" if mobile else "未填写手机号的用户重复")
+            seen_usernames.add(schema.username)
+            seen_emails.add(schema.email)
+            seen_mobiles.add(mobile)
+            if len(errors) > 0:
+                self._add_import_error(result, line, errors)
+            else:
+                valid.append((line, schema))
+        if len(valid) == 0:
+            return
+
+        existing_usernames, existing_emails, existing_mobiles = self.repository.get_existing_accounts(
+            [schema.username for _, schema in valid], [schema.email for _, schema in valid],
+            [schema.mobile or "" for _, schema in valid]
+        )
+        role_ids: Set[int] = {role_id for _, schema in valid for role_id in schema.roles or ()}
+        known_roles: Set[int] = self.repository.get_existing_role_ids(list(role_ids)) if len(role_ids) > 0 else set()
+        accepted: List[Tuple[int, UserCreateSchema]] = []
+        for line, schema in valid:
+            errors: List[str] = []
+            if schema.username in existing_usernames:
+                errors.append("用户名已存在")
+            if schema.email in existing_emails:
+                errors.append("邮箱已存在")
+            if (schema.mobile or "") in existing_mobiles:
+                errors.append("手机号已存在" if schema.mobile else "已存在未填写手机号的用户")
+            missing_roles: List[int] = [role_id for role_id in schema.roles or () if role_id not in known_roles]
+            if len(missing_roles) > 0:
+                errors.append("角色不存在: " + ",".join(str(role_id) for role_id in missing_roles))
+            if len(errors) > 0:
+                self._add_import_error(result, line, errors)
+            else:
+                accepted.append((line, schema))
+        if len(accepted) == 0:
+            return
+
+        passwords: List[str] = [schema.password for _, schema in accepted]
+        if self.password_hasher is not None:
+            hashed_passwords: List[str] = self.password_hasher.generate_many(passwords)
+        else:
+            hashed_passwords: List[str] = [SecurityUtil.generate_password(password) for password in passwords]
+        users: List[Dict] = [self._to_user_row(schema, hashed_password)
+                             for (_, schema), hashed_password in zip(accepted, hashed_passwords)]
+        roles: List[List[int]] = [schema.roles or [] for _, schema in accepted]
+        try:
+            self.repository.bulk_add_users(users, roles)
+            result.created += len(users)
+        except IntegrityError:
+            # 与并发的写入冲突，逐行插入以定位出错的行
+            for (line, _), user, role_ids in zip(accepted, users, roles):
+                try:
+                    self.repository.bulk_add_users([user], [role_ids])
+                    result.created += 1
+                except IntegrityError as exc:
+                    self._add_import_error(result, line, ["数据冲突: " + str(exc.orig)])
+
+    @staticmethod
+    def _to_user_row(schema: UserCreateSchema, hashed_password: str) -> Dict:
+        """ 多行插入要求每一行的键一致，非空列使用默认值填充 """
+        return {
+            "username": schema.username,
+            "nickname": schema.nickname or "",
+            "email": schema.email,
+            "mobile": schema.mobile or "",
+            "gender": schema.gender,
+            "avatar": schema.avatar,
+            "remark": schema.remark or "",
+            "password": hashed_password,
+        }
+
+    @staticmethod
+    def _add_import_error(result: UserImportResultSchema, line: int, errors: List[str]) -> None:
+        result.failed += 1
+        if len(result.errors) < settings.USER_IMPORT_MAX_ERRORS:
+            result.errors.append(UserImportErrorSchema(line=line, errors=errors))
+
     def update_user(self, ident: int, schema: UserUpdateSchema) -> None:
         """
         更新用户
@@ -101,6 +269,9 @@ class UserServiceImpl(ServiceImpl[UserRepository, User], UserService):
         data = schema.dict(exclude_unset=True)
         roles = data.pop("roles")
         self.repository.update_user(ident=ident, data=data, roles=roles)
+        # 角色绑定已变更，事务提交后使该用户的权限缓存失效
+        if self.permission_cache is not None:
+            after_commit(partial(self.permission_cache.evict_user, ident))
 
     def delete_user(self, ident: int) -> None:
         """
@@ -110,6 +281,8 @@ class UserServiceImpl(ServiceImpl[UserRepository, User], UserService):
         :return:
         """
         self.repository.delete_user(ident)
+        if self.permission_cache is not None:
+            after_commit(partial(self.permission_cache.evict_user, ident))
 
     def _check_available(self, username: str, email: str, ident: Optional[int] = -1) -> None:
         """
@@ -1,6 +1,26 @@
 class Constant:
     UTF8: str = "UTF-8"
+    # 读取时跳过开头的BOM(如Excel导出的CSV)
+    UTF8_SIG: str = "UTF-8-SIG"
     AUTH_REDIS_KEY: str = "auth-key:"
+    REVOKED_TOKEN_REDIS_KEY: str = "revoked-token"
+    COUNT_REDIS_KEY: str = "count-key:"
+    VERSION_REDIS_KEY: str = "version-key:"
+    PERM_ROLE_CACHE_NAMESPACE: str = "perm-role"
+    PERM_USER_CACHE_NAMESPACE: str = "perm-user"
+    CACHE_REDIS_KEY: str = "cache:"
+    CACHE_VERSION_REDIS_KEY: str = "cache-version:"
+    QUERY_CACHE_REDIS_KEY: str = "query-cache:"
+    QUERY_CACHE_TAG_REDIS_KEY: str = "query-tag:"
+    UPLOAD_REDIS_KEY: str = "upload-key:"
+    UPLOAD_PART_REDIS_KEY: str = "upload-part:"
+    UPLOAD_COMPLETING_REDIS_KEY: str = "upload-completing:"
+    # 分块上传时分块的存储目录(位于UPLOAD_DIR下)
+    MULTIPART_UPLOAD_DIR: str = ".multipart"
+    # 内容寻址存储的文件目录(位于UPLOAD_DIR下)
+    CAS_UPLOAD_DIR: str = "cas"
+    FILE_LOCK_REDIS_KEY: str = "file-lock:"
+    CACHE_INVALIDATION_CHANNEL: str = "cache-invalidation"
     TOKEN_SCHEMA: str = "Bearer"
     CURRENT_PAGE: int = 1
     PAGE_SIZE: int = 10
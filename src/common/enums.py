@@ -18,6 +18,34 @@ class Gender(IntEnum):
     female = 2
 
 
+class CountMode(str, Enum):
+    """ 分页查询时总数的统计方式 """
+    # 每次执行COUNT(*)
+    exact = "exact"
+    # 精确总数缓存在redis中，写操作时失效
+    cached = "cached"
+    # 读取MySQL表统计信息中的估算行数(带查询条件时退化为cached)
+    estimated = "estimated"
+    # 不统计总数，仅通过多查询一条数据判断是否存在下一页
+    none = "none"
+
+
+class DataFormat(str, Enum):
+    """ 批量导入/导出的数据格式 """
+    # 首行为表头的CSV
+    csv = "csv"
+    # 每行一个JSON对象
+    jsonl = "jsonl"
+
+
+class CacheBackend(str, Enum):
+    """ 查询结果缓存的存储 """
+    # 进程内，标签失效通过redis发布/订阅广播到所有进程
+    local = "local"
+    # redis，所有进程共享
+    redis = "redis"
+
+
 class FileUploadStatus(IntEnum):
     """
     文件上传状态
@@ -28,6 +56,14 @@ class FileUploadStatus(IntEnum):
     failed = 4
 
 
+class DownloadOffload(str, Enum):
+    """ 文件下载时交由前端代理发送文件内容的方式 """
+    # Apache(mod_xsendfile)、lighttpd等，响应头为文件路径
+    x_sendfile = "x-sendfile"
+    # nginx，响应头为internal location的URI
+    x_accel_redirect = "x-accel-redirect"
+
+
 class CosAction(str, Enum):
     """ 只列出了对象存储操作 """
     # 查询对象元数据
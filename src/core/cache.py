@@ -0,0 +1,388 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Final, Hashable, List, Optional, Sequence, Tuple
+
+import orjson
+from redis import Redis, RedisError
+
+from logger import logger
+from src.common.constant import Constant
+from src.utils import StringUtil
+
+
+class LocalCache:
+    """ 进程内LRU缓存，支持过期时间，线程安全 """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        :param maxsize: 最大条目数，超出时淘汰最久未使用的条目
+        :param ttl: 默认过期时间(秒)，为空时永不过期
+        """
+        self.maxsize: Final[int] = maxsize
+        self.ttl: Final[Optional[float]] = ttl
+        self._data: "OrderedDict[Hashable, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._lock: Final[threading.RLock] = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        获取缓存值，不存在或已过期时返回默认值
+
+        :param key: 缓存键
+        :param default: 默认值
+        :return: 缓存值
+        """
+        with self._lock:
+            item = self._data.get(key, None)
+            if item is None:
+                return default
+            expire_at, value = item
+            if expire_at is not None and expire_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        设置缓存值
+
+        :param key: 缓存键
+        :param value: 缓存值
+        :param ttl: 过期时间(秒)，为空时使用默认过期时间
+        :return:
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expire_at: Optional[float] = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class InvalidationBus:
+    """
+    基于redis发布/订阅的进程间缓存失效广播。
+    发布消息时先在本进程内立即生效，再通知其他进程；订阅连接断开期间可能丢失消息，因此重连后会通知所有订阅者清空缓存
+    """
+
+    # 表示清空该主题下所有缓存的键
+    ALL: Final[str] = "*"
+
+    def __init__(self, redis: Redis, channel: str = Constant.CACHE_INVALIDATION_CHANNEL, retry_interval: float = 5):
+        self._redis: Final[Redis] = redis
+        self._channel: Final[str] = channel
+        self._retry_interval: Final[float] = retry_interval
+        # 用于忽略本进程自己发出的消息
+        self._origin: Final[str] = StringUtil.get_unique_key()
+        self._handlers: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self._lock: Final[threading.Lock] = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def subscribe(self, topic: str, handler: Callable[[str], None]) -> None:
+        """
+        订阅某主题的失效消息
+
+        :param topic: 主题
+        :param handler: 回调，参数为失效的缓存键(ALL表示全部失效)
+        :return:
+        """
+        with self._lock:
+            self._handlers[topic].append(handler)
+        self._ensure_listening()
+
+    def publish(self, topic: str, *keys: str) -> None:
+        """
+        广播缓存失效消息
+
+        :param topic: 主题
+        :param keys: 失效的缓存键
+        :return:
+        """
+        self._dispatch(topic, keys)
+        try:
+            self._redis.publish(self._channel, orjson.dumps({"origin": self._origin, "topic": topic, "keys": keys}))
+        except RedisError as exc:
+            logger.warning("广播缓存失效消息失败: " + str(exc))
+
+    def _dispatch(self, topic: str, keys) -> None:
+        for handler in list(self._handlers.get(topic, [])):
+            for key in keys:
+                try:
+                    handler(key)
+                except Exception as exc:
+                    logger.error("处理缓存失效消息失败: " + str(exc))
+
+    def _ensure_listening(self) -> None:
+        """ 启动后台监听线程。fork出的子进程中不存在父进程的线程，需要重新启动 """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._listen, name="cache-invalidation", daemon=True)
+            self._thread.start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for message in pubsub.listen():
+                    self._on_message(message)
+            except RedisError as exc:
+                logger.warning("缓存失效消息订阅中断: " + str(exc))
+            # 断线期间的消息已丢失，清空所有订阅者的缓存
+            for topic in list(self._handlers.keys()):
+                self._dispatch(topic, (self.ALL,))
+            time.sleep(self._retry_interval)
+
+    def _on_message(self, message: Dict) -> None:
+        try:
+            data: Dict = orjson.loads(message["data"])
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            return
+        if data.get("origin") != self._origin:
+            self._dispatch(data.get("topic"), data.get("keys") or ())
+
+
+# 版本号未变化时才写入缓存。KEYS: 缓存键、该键的版本号、命名空间的版本号；ARGV: 读取到的两个版本号、缓存值、有效期
+_SET_IF_UNCHANGED_SCRIPT: Final[str] = """
+if (redis.call('GET', KEYS[2]) or '') == ARGV[1] and (redis.call('GET', KEYS[3]) or '') == ARGV[2] then
+    redis.call('SET', KEYS[1], ARGV[3], 'EX', ARGV[4])
+    return 1
+end
+return 0
+"""
+
+
+class TwoLevelCache:
+    """
+    两级缓存: 进程内LRU + redis。读取时依次查找本地、redis；删除时清除redis并通过InvalidationBus通知所有进程清除本地缓存。
+    redis不可用时仅使用本地缓存。
+    get_or_load/get_many_or_load在查询前记录版本号，删除或清空缓存时更新版本号，查询期间缓存被清除时不写入查询结果，
+    避免并发的读取把变更前的数据重新写入缓存
+    """
+
+    def __init__(self, redis: Redis, namespace: str, ttl: int, local_ttl: Optional[float] = None,
+                 local_size: int = 1024, bus: Optional[InvalidationBus] = None,
+                 decode: Optional[Callable[[str], Any]] = None):
+        """
+        :param redis: redis客户端
+        :param namespace: 命名空间，同时作为redis键前缀和广播主题
+        :param ttl: redis中的有效期(秒)
+        :param local_ttl: 本地缓存的有效期(秒)，为空时与redis相同
+        :param local_size: 本地缓存条目上限
+        :param bus: 缓存失效广播
+        :param decode: 将redis中的字符串转换为读取结果(如反序列化)，本地缓存保存转换后的对象，避免每次读取都重复转换。
+                       为空时读取结果为字符串。转换后的对象在线程间共享，应当是不可变的
+        """
+        self.redis: Final[Redis] = redis
+        self.namespace: Final[str] = namespace
+        self.ttl: Final[int] = ttl
+        self.bus: Final[Optional[InvalidationBus]] = bus
+        self._decode: Final[Optional[Callable[[str], Any]]] = decode
+        self._local: Final[LocalCache] = LocalCache(maxsize=local_size, ttl=local_ttl or ttl)
+        self._set_script = redis.register_script(_SET_IF_UNCHANGED_SCRIPT)
+        # 本地缓存的清除次数，用于判断读取期间本地缓存是否被清除过
+        self._generation: int = 0
+        # 命中计数(当前进程): 本地命中、redis命中、未命中
+        self._counter_lock: Final[threading.Lock] = threading.Lock()
+        self.local_hits: int = 0
+        self.redis_hits: int = 0
+        self.misses: int = 0
+        if bus is not None:
+            bus.subscribe(namespace, self._on_evict)
+
+    def get(self, key: str) -> Optional[Any]:
+        value: Any = self._local.get(key)
+        if value is not None:
+            self._count("local_hits")
+            return value
+        generation: int = self._generation
+        cached: Optional[str] = None
+        try:
+            cached = self.redis.get(self._redis_key(key))
+        except RedisError as exc:
+            logger.warning("读取缓存失败: " + str(exc))
+        if cached is None:
+            self._count("misses")
+            return None
+        self._count("redis_hits")
+        value = self._to_value(cached)
+        self._set_local({key: value}, generation)
+        return value
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[str]]) -> Optional[Any]:
+        """
+        读取缓存，未命中时执行查询并写入缓存。查询期间该键被删除或缓存被清空时只返回查询结果，不写入缓存
+
+        :param key: 缓存键
+        :param loader: 查询，返回空时不写入缓存
+        :return: 缓存值
+        """
+
+        def load(keys: List[str]) -> Dict[str, str]:
+            value: Optional[str] = loader()
+            return {} if value is None else {key: value}
+
+        return self.get_many_or_load([key], load).get(key)
+
+    def get_many_or_load(self, keys: Sequence[str], loader: Callable[[List[str]], Dict[str, str]]) -> Dict[str, Any]:
+        """
+        批量读取缓存。本地未命中的键通过一次MGET读取redis(同时读取版本号)，仍未命中的键通过一次查询加载并写入缓存。
+        查询期间被删除的键、或缓存被清空时只返回查询结果，不写入缓存
+
+        :param keys: 缓存键
+        :param loader: 查询，参数为未命中的键，返回 键 -> 缓存值，不存在的键可以不包含在内
+        :return: 键 -> 缓存值，不存在的键不包含在内
+        """
+        result: Dict[str, Any] = {}
+        missing: List[str] = []
+        for key in keys:
+            value: Any = self._local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                result[key] = value
+        self._count("local_hits", len(result))
+        if len(missing) == 0:
+            return result
+
+        generation: int = self._generation
+        values: Optional[List[Optional[str]]] = None
+        try:
+            values = self.redis.mget([self._redis_key(key) for key in missing] +
+                                     [self._version_key(key) for key in missing] + [self._version_key()])
+        except RedisError as exc:
+            logger.warning("读取缓存失败: " + str(exc))
+        cached: Dict[str, Any] = {}
+        not_cached: List[str] = []
+        for index, key in enumerate(missing):
+            if values is not None and values[index] is not None:
+                cached[key] = self._to_value(values[index])
+            else:
+                not_cached.append(key)
+        self._count("redis_hits", len(cached))
+        self._count("misses", len(not_cached))
+        self._set_local(cached, generation)
+        result.update(cached)
+        if len(not_cached) == 0:
+            return result
+
+        loaded: Dict[str, str] = loader(not_cached)
+        if values is not None and len(loaded) > 0:
+            versions: Dict[str, Optional[str]] = dict(zip(missing, values[len(missing):2 * len(missing)]))
+            try:
+                with self.redis.pipeline(transaction=False) as pipe:
+                    for key, value in loaded.items():
+                        self._set_script(keys=[self._redis_key(key), self._version_key(key), self._version_key()],
+                                         args=[versions.get(key) or "", values[-1] or "", value, self.ttl],
+                                         client=pipe)
+                    pipe.execute()
+            except RedisError as exc:
+                logger.warning("写入缓存失败: " + str(exc))
+        loaded_values: Dict[str, Any] = {key: self._to_value(value) for key, value in loaded.items()}
+        self._set_local(loaded_values, generation)
+        result.update(loaded_values)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ 当前进程的命中统计 """
+        with self._counter_lock:
+            total: int = self.local_hits + self.redis_hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.local_hits + self.redis_hits) / total, 4) if total > 0 else None,
+                "local_size": len(self._local),
+            }
+
+    def set(self, key: str, value: str) -> None:
+        self._local.set(key, self._to_value(value))
+        try:
+            self.redis.set(self._redis_key(key), value, ex=self.ttl)
+        except RedisError as exc:
+            logger.warning("写入缓存失败: " + str(exc))
+
+    def delete(self, *keys: str) -> None:
+        try:
+            with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(self._version_key(key), StringUtil.get_unique_key(), ex=self.ttl)
+                pipe.delete(*[self._redis_key(key) for key in keys])
+                pipe.execute()
+        except RedisError as exc:
+            logger.warning("清除缓存失败: " + str(exc))
+        if self.bus is not None:
+            self.bus.publish(self.namespace, *keys)
+        else:
+            for key in keys:
+                self._on_evict(key)
+
+    def clear(self) -> None:
+        """ 清除该命名空间下的所有缓存 """
+        try:
+            self.redis.set(self._version_key(), StringUtil.get_unique_key(), ex=self.ttl)
+            keys: List[str] = list(self.redis.scan_iter(match=self._redis_key("*"), count=1000))
+            for start in range(0, len(keys), 1000):
+                self.redis.delete(*keys[start:start + 1000])
+        except RedisError as exc:
+            logger.warning("清除缓存失败: " + str(exc))
+        if self.bus is not None:
+            self.bus.publish(self.namespace, InvalidationBus.ALL)
+        else:
+            self._on_evict(InvalidationBus.ALL)
+
+    def _count(self, name: str, count: int = 1) -> None:
+        if count == 0:
+            return
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def _to_value(self, cached: str) -> Any:
+        return cached if self._decode is None else self._decode(cached)
+
+    def _set_local(self, values: Dict[str, Any], generation: int) -> None:
+        """ 写入本地缓存。读取之后本地缓存被清除过时不写入，避免清除前读到的旧值在清除之后写入 """
+        if len(values) == 0:
+            return
+        with self._counter_lock:
+            if generation != self._generation:
+                return
+            for key, value in values.items():
+                self._local.set(key, value)
+
+    def _redis_key(self, key: str) -> str:
+        return Constant.CACHE_REDIS_KEY + self.namespace + ":" + key
+
+    def _version_key(self, key: Optional[str] = None) -> str:
+        """ 缓存键的版本号，key为空时为整个命名空间的版本号 """
+        if key is None:
+            return Constant.CACHE_VERSION_REDIS_KEY + self.namespace
+        return Constant.CACHE_VERSION_REDIS_KEY + self.namespace + ":" + key
+
+    def _on_evict(self, key: str) -> None:
+        with self._counter_lock:
+            self._generation += 1
+            if key == InvalidationBus.ALL:
+                self._local.clear()
+            else:
+                self._local.delete(key)
+
+
+__all__ = ["LocalCache", "InvalidationBus", "TwoLevelCache"]
@@ -0,0 +1,65 @@
+import statistics
+import time
+from typing import Callable, List
+
+import click
+from flask.cli import AppGroup
+
+from jose import jwt
+from jose.constants import ALGORITHMS
+
+from settings import settings
+from src.core.web.session import TokenCache
+from src.utils import PasswordUtil, SecurityUtil
+
+benchmark_cli = AppGroup("benchmark", help="在当前机器上进行性能基准测试")
+
+
+def _measure(func: Callable[[], object], rounds: int) -> float:
+    """ 执行rounds次，返回耗时的中位数(毫秒) """
+    timings: List[float] = []
+    for _ in range(rounds):
+        start: float = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+@benchmark_cli.command("hash")
+@click.option("--rounds", default=5, show_default=True, help="每种配置的执行次数")
+def hash_benchmark(rounds: int) -> None:
+    """ 各密码哈希算法在当前配置及半倍、两倍计算代价下的耗时 """
+    default_name: str = PasswordUtil.get_default().name
+    click.echo(f"{'profile':<44}{'hash(ms)':>10}{'verify(ms)':>12}")
+    for algorithm in PasswordUtil.get_algorithms():
+        for factor in (0.5, 1, 2):
+            profile = algorithm if factor == 1 else algorithm.scaled(factor)
+            hashed: str = profile.hash("benchmark-password")
+            hash_ms: float = _measure(lambda: profile.hash("benchmark-password"), rounds)
+            verify_ms: float = _measure(lambda: profile.verify("benchmark-password", hashed), rounds)
+            # 标记当前用于生成新密码的配置
+            marker: str = " *" if factor == 1 and algorithm.name == default_name else ""
+            click.echo(f"{str(profile) + marker:<44}{hash_ms:>10.1f}{verify_ms:>12.1f}")
+
+
+@benchmark_cli.command("jwt")
+@click.option("--rounds", default=10000, show_default=True, help="每种方式的执行次数")
+def jwt_benchmark(rounds: int) -> None:
+    """ token解析耗时: 每次使用原始密钥解码、使用预先构造的密钥解码、命中校验结果缓存 """
+    token: str = SecurityUtil.create_token(subject=1)
+    cache: TokenCache = TokenCache()
+    cache.parse(token)
+    cases = [
+        ("jwt.decode(secret)", lambda: jwt.decode(token, key=settings.SECRET_KEY, algorithms=[ALGORITHMS.HS256])),
+        ("SecurityUtil.parse_token", lambda: SecurityUtil.parse_token(token)),
+        ("TokenCache.parse(hit)", lambda: cache.parse(token)),
+    ]
+    click.echo(f"{'case':<30}{'per call(us)':>14}")
+    for name, func in cases:
+        start: float = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        click.echo(f"{name:<30}{(time.perf_counter() - start) / rounds * 1e6:>14.2f}")
+
+
+__all__ = ["benchmark_cli"]
@@ -0,0 +1,132 @@
+import bisect
+import threading
+import time
+from typing import Any, Dict, Final, List, Optional, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import Pool, QueuePool
+
+
+class PoolMetrics:
+    """
+    连接池指标(当前进程)。
+     - 计数: 新建连接、取出、归还、失效(连接断开或pre-ping失败)、等待超时
+     - 取出连接的等待时间直方图，用于判断连接池是否过小
+    """
+
+    # 等待时间直方图的桶上限(毫秒)
+    buckets: Final[Sequence[float]] = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._lock: Final[threading.Lock] = threading.Lock()
+        self.connects: int = 0
+        self.checkouts: int = 0
+        self.checkins: int = 0
+        self.invalidations: int = 0
+        self.timeouts: int = 0
+        # 最后一个桶对应超出所有上限的等待
+        self._wait_counts: List[int] = [0] * (len(self.buckets) + 1)
+        self._wait_sum: float = 0
+        self._wait_max: float = 0
+
+    def observe_wait(self, seconds: float, timeout: bool = False) -> None:
+        """
+        记录一次取出连接的等待时间
+
+        :param seconds: 等待时间(秒)
+        :param timeout: 是否等待超时
+        :return:
+        """
+        millis: float = seconds * 1000
+        with self._lock:
+            self._wait_counts[bisect.bisect_left(self.buckets, millis)] += 1
+            self._wait_sum += millis
+            self._wait_max = max(self._wait_max, millis)
+            if timeout:
+                self.timeouts += 1
+
+    def attach(self, engine: Engine) -> None:
+        """ 注册连接池事件，统计连接的新建、取出、归还及失效 """
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+        if isinstance(engine.pool, InstrumentedQueuePool):
+            engine.pool.metrics = self
+
+    def snapshot(self, pool: Optional[Pool] = None) -> Dict[str, Any]:
+        """
+        当前的指标
+
+        :param pool: 连接池，用于读取当前取出及溢出的连接数
+        :return: 指标
+        """
+        with self._lock:
+            wait_count: int = sum(self._wait_counts)
+            histogram: Dict[str, int] = {}
+            cumulative: int = 0
+            for bucket, count in zip(list(self.buckets) + ["+Inf"], self._wait_counts):
+                cumulative += count
+                histogram[f"le_{bucket}"] = cumulative
+            result: Dict[str, Any] = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_ms": {
+                    "count": wait_count,
+                    "sum": round(self._wait_sum, 3),
+                    "max": round(self._wait_max, 3),
+                    "histogram": histogram,
+                },
+            }
+        if isinstance(pool, QueuePool):
+            result.update(size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(),
+                          overflow=max(pool.overflow(), 0))
+        return result
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        with self._lock:
+            self.invalidations += 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """ 记录取出连接等待时间的QueuePool。连接池的事件中没有"开始等待"，需要在_do_get中计时 """
+
+    metrics: Optional[PoolMetrics] = None
+
+    def _do_get(self):
+        start: float = time.perf_counter()
+        timeout: bool = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timeout = True
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe_wait(time.perf_counter() - start, timeout)
+
+    def recreate(self) -> "InstrumentedQueuePool":
+        # engine.dispose()等操作会重新创建连接池，需要保留指标
+        pool: InstrumentedQueuePool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+__all__ = ["PoolMetrics", "InstrumentedQueuePool"]
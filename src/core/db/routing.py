@@ -0,0 +1,138 @@
+import itertools
+import threading
+import time
+from typing import Any, Dict, Final, List, Optional, Sequence
+
+from flask import g, has_request_context
+from sqlalchemy import event, text
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+from logger import logger
+from src.core.db.pool import PoolMetrics
+
+# session.info中的键，为True时该session中的查询可以发送到只读副本
+REPLICA_INFO_KEY: Final[str] = "use_replica"
+
+
+class ReplicaRouter:
+    """
+    只读副本的选择。按轮询方式选择副本；副本连接失败后在retry_interval秒内不再使用，到期后先检测连接再恢复使用。
+    没有可用副本时返回空，由调用方使用主库
+    """
+
+    def __init__(self, engines: Sequence[Engine], retry_interval: float = 30):
+        """
+        :param engines: 各只读副本的engine
+        :param retry_interval: 副本不可用后重新检测的间隔(秒)
+        """
+        self.engines: Final[List[Engine]] = list(engines)
+        self.metrics: Final[List[PoolMetrics]] = [PoolMetrics() for _ in self.engines]
+        self.retry_interval: Final[float] = retry_interval
+        self._cycle = itertools.cycle(range(len(self.engines)))
+        self._lock: Final[threading.Lock] = threading.Lock()
+        # 副本序号 -> 不可用状态的截止时间
+        self._down_until: Dict[int, float] = {}
+        for index, (engine, metrics) in enumerate(zip(self.engines, self.metrics)):
+            metrics.attach(engine)
+            event.listen(engine, "handle_error", self._on_error(index))
+
+    def choose(self) -> Optional[Engine]:
+        """ 选择一个可用的副本 """
+        for _ in range(len(self.engines)):
+            with self._lock:
+                index: int = next(self._cycle)
+            down_until: Optional[float] = self._down_until.get(index)
+            if down_until is None:
+                return self.engines[index]
+            if down_until <= time.monotonic() and self._check(index):
+                return self.engines[index]
+        return None
+
+    def get_status(self) -> List[Dict[str, Any]]:
+        """ 各副本的可用状态及连接池指标 """
+        return [dict(metrics.snapshot(engine.pool), available=index not in self._down_until)
+                for index, (engine, metrics) in enumerate(zip(self.engines, self.metrics))]
+
+    def _check(self, index: int) -> bool:
+        """ 检测副本是否恢复，同一时间只由一个线程检测 """
+        with self._lock:
+            down_until: Optional[float] = self._down_until.get(index)
+            if down_until is None:
+                return True
+            if down_until > time.monotonic():
+                return False
+            # 检测期间其他线程继续跳过该副本
+            self._down_until[index] = time.monotonic() + self.retry_interval
+        try:
+            with self.engines[index].connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except Exception as exc:
+            logger.warning(f"只读副本{index}仍不可用: {exc}")
+            return False
+        self._down_until.pop(index, None)
+        logger.info(f"只读副本{index}已恢复")
+        return True
+
+    def _on_error(self, index: int):
+        def handler(context) -> None:
+            # 连接断开或无法建立连接时暂停使用该副本。SQL本身的错误不影响副本的可用状态
+            if context.is_disconnect or context.connection is None:
+                self._down_until[index] = time.monotonic() + self.retry_interval
+                logger.warning(f"只读副本{index}不可用: {context.original_exception}")
+
+        return handler
+
+
+class RoutingSession(Session):
+    """
+    读写分离的session。
+    仅当session被标记为可读副本(info[REPLICA_INFO_KEY])、执行的是SELECT、且当前请求中还没有执行过写操作时，
+    查询发送到只读副本；其他情况(写操作、flush、标记以外的查询、请求中已执行写操作后的查询)都使用主库，
+    保证在同一请求中能读到自己刚写入的数据
+    """
+
+    def __init__(self, router: Optional[ReplicaRouter] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.router: Final[Optional[ReplicaRouter]] = router
+
+    def get_bind(self, mapper=None, clause=None, bind=None, _sa_skip_events=None,
+                 _sa_skip_for_implicit_returning=False, **kwargs):
+        if isinstance(clause, UpdateBase):
+            _stick_to_primary()
+        elif self._use_replica(clause):
+            engine: Optional[Engine] = self.router.choose()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, _sa_skip_events=_sa_skip_events,
+                                _sa_skip_for_implicit_returning=_sa_skip_for_implicit_returning)
+
+    def _use_replica(self, clause) -> bool:
+        if self.router is None or len(self.router.engines) == 0:
+            return False
+        if not self.info.get(REPLICA_INFO_KEY) or self._flushing:
+            return False
+        if clause is not None and not isinstance(clause, Select):
+            return False
+        return not has_written()
+
+
+def has_written() -> bool:
+    """ 当前请求中是否执行过写操作 """
+    return has_request_context() and g.get("db_primary_sticky", False)
+
+
+def _stick_to_primary() -> None:
+    # 写入后(包括事务尚未提交时)当前请求的查询都使用主库(读己之写)
+    if has_request_context():
+        g.db_primary_sticky = True
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _on_flush(session: Session, flush_context) -> None:
+    _stick_to_primary()
+
+
+__all__ = ["ReplicaRouter", "RoutingSession", "REPLICA_INFO_KEY", "has_written"]
@@ -1,46 +1,121 @@
-from typing import Final, Optional
+from typing import Any, Dict, Final, Optional, Sequence
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import sessionmaker, scoped_session, Session
+from sqlalchemy.pool import QueuePool
+
+from src.core.db.pool import PoolMetrics, InstrumentedQueuePool
+from src.core.db.routing import ReplicaRouter, REPLICA_INFO_KEY
+from src.core.db.unit_of_work import UnitOfWork, UnitOfWorkSession, UNIT_OF_WORK_INFO_KEY, get_unit_of_work
 
 
 class SessionFactory:
     """ Session工厂 """
 
-    def __init__(self, dsn: str) -> None:
-        self._engine: Final[Engine] = create_engine(dsn, future=True, echo=False)
+    def __init__(self, dsn: str, pool_size: int = 5, max_overflow: int = 10, pool_timeout: float = 30,
+                 pool_recycle: int = -1, pool_pre_ping: bool = False, replicas: Sequence[str] = (),
+                 replica_retry_interval: float = 30) -> None:
+        """
+        :param dsn: 数据库连接串
+        :param pool_size: 连接池保持的连接数
+        :param max_overflow: 连接池已满时允许额外创建的连接数
+        :param pool_timeout: 连接池已满时等待可用连接的超时时间(秒)
+        :param pool_recycle: 连接的最长使用时间(秒)，超过后重新建立，应小于MySQL的wait_timeout。-1表示不回收
+        :param pool_pre_ping: 取出连接时是否先检测连接可用，不可用时重新建立
+        :param replicas: 只读副本的连接串，连接池配置与主库相同
+        :param replica_retry_interval: 只读副本不可用后重新检测的间隔(秒)
+        """
+        options: Dict[str, Any] = {"pool_size": pool_size, "max_overflow": max_overflow, "pool_timeout": pool_timeout,
+                                   "pool_recycle": pool_recycle, "pool_pre_ping": pool_pre_ping}
+        self.metrics: Final[PoolMetrics] = PoolMetrics()
+        self._engine: Final[Engine] = self._create_engine(dsn, options)
+        self.metrics.attach(self._engine)
+        self.router: Final[ReplicaRouter] = ReplicaRouter(
+            [self._create_engine(replica, options) for replica in replicas], retry_interval=replica_retry_interval
+        )
         self._scoped_session: Final[scoped_session] = scoped_session(
             sessionmaker(
-                class_=Session,
+                class_=UnitOfWorkSession,
                 autoflush=False,
                 autocommit=False,
                 bind=self._engine,
-                expire_on_commit=False
+                expire_on_commit=False,
+                router=self.router
             )
         )
 
+    @staticmethod
+    def _create_engine(dsn: str, options: Dict[str, Any]) -> Engine:
+        url = make_url(dsn)
+        # sqlite内存数据库等使用的不是QueuePool，不支持连接数相关的参数
+        if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+            return create_engine(dsn, future=True, echo=False, poolclass=InstrumentedQueuePool, **options)
+        return create_engine(dsn, future=True, echo=False, pool_recycle=options["pool_recycle"],
+                             pool_pre_ping=options["pool_pre_ping"])
+
     def get_session(self) -> Session:
         """ 根据engine获取session """
         return self._scoped_session()
 
+    def get_pool_status(self) -> Dict[str, Any]:
+        """ 当前进程的连接池状态及指标，replicas为各只读副本的状态 """
+        return dict(self.metrics.snapshot(self._engine.pool), replicas=self.router.get_status())
+
+    def create_session(self) -> Session:
+        """ 创建独立的session(不与当前线程的session共享)，由调用方负责关闭 """
+        return self._scoped_session.session_factory()
+
 
 class SessionContext:
 
-    """ sql session 上下文管理器 """
+    """
+    sql session 上下文管理器。
+    在请求中使用时session加入请求级工作单元，退出时不关闭session，由工作单元在请求结束时统一提交并关闭
+    """
 
-    def __init__(self, factory: SessionFactory):
+    def __init__(self, factory: SessionFactory, read_only: bool = False, isolated: bool = False):
+        """
+        :param factory: session工厂
+        :param read_only: 为True时其中的查询可以发送到只读副本
+        :param isolated: 为True时不加入请求级工作单元，使用独立的session并立即提交
+        """
         self.session: Optional[Session] = None
         self.factory: Final[SessionFactory] = factory
+        self.read_only: Final[bool] = read_only
+        self.isolated: Final[bool] = isolated
+
+    def reading(self) -> "SessionContext":
+        """ 只读的上下文，其中的查询可以发送到只读副本(请求中已执行过写操作时仍使用主库) """
+        return SessionContext(self.factory, read_only=True)
+
+    def independent(self) -> "SessionContext":
+        """ 独立事务的上下文，用于需要分批提交、不受请求中其他操作成败影响的写操作(如批量导入) """
+        return SessionContext(self.factory, isolated=True)
 
     def __enter__(self) -> Session:
         """ 创建数据库会话 """
-        self.session = self.factory.get_session()
+        unit: Optional[UnitOfWork] = get_unit_of_work()
+        if unit is not None and self.isolated:
+            self.session = self.factory.create_session()
+        else:
+            self.session = self.factory.get_session()
+            if unit is not None:
+                unit.join(self.session)
+        if self.read_only:
+            self.session.info[REPLICA_INFO_KEY] = True
         return self.session
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """ 关闭session，并对发生错误的情况下进行事务回滚 """
         if self.session is not None:
+            self.session.info.pop(REPLICA_INFO_KEY, None)
+            unit: Optional[UnitOfWork] = self.session.info.get(UNIT_OF_WORK_INFO_KEY)
+            if unit is not None:
+                if exc_type is not None:
+                    unit.fail()
+                return
             if exc_type is not None:
                 self.session.rollback()
             self.session.close()
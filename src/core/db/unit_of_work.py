@@ -0,0 +1,125 @@
+from typing import Callable, Final, List, Optional
+
+from flask import g, has_request_context, Response
+from sqlalchemy.orm import Session
+
+from logger import logger
+from src.core.db.routing import RoutingSession
+
+# session.info中的键，值为该session所属的工作单元
+UNIT_OF_WORK_INFO_KEY: Final[str] = "unit_of_work"
+
+
+class UnitOfWork:
+    """
+    请求级工作单元。请求中所有repository调用共享当前线程的session，即同一个连接、同一个事务:
+     - repository中的commit只执行flush，事务在请求处理完成后统一提交，响应为错误(状态码>=400)时回滚
+     - repository调用中抛出异常时立即回滚，工作单元标记为失败，请求结束时不再提交
+     - 数据变更后的回调(如清除缓存)在事务结束后执行
+    """
+
+    def __init__(self):
+        self.sessions: Final[List[Session]] = []
+        self.callbacks: Final[List[Callable[[], None]]] = []
+        self.active: bool = True
+        self.failed: bool = False
+
+    def join(self, session: Session) -> None:
+        """ session加入工作单元，在工作单元结束前不关闭 """
+        if session.info.get(UNIT_OF_WORK_INFO_KEY) is not self:
+            session.info[UNIT_OF_WORK_INFO_KEY] = self
+            self.sessions.append(session)
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """ 注册事务结束后执行的回调，同一个回调只执行一次 """
+        if callback not in self.callbacks:
+            self.callbacks.append(callback)
+
+    def fail(self) -> None:
+        """ 回滚并标记为失败 """
+        self.failed = True
+        for session in self.sessions:
+            session.rollback()
+
+    def finish(self, commit: bool) -> None:
+        """
+        结束工作单元
+
+        :param commit: 是否提交，工作单元已失败时总是回滚
+        :return:
+        """
+        if not self.active:
+            return
+        self.active = False
+        if commit and self.failed:
+            logger.warning("请求中的数据库操作出现异常，工作单元已回滚")
+        try:
+            for session in self.sessions:
+                session.info.pop(UNIT_OF_WORK_INFO_KEY, None)
+                if commit and not self.failed:
+                    session.commit()
+                else:
+                    session.rollback()
+        finally:
+            for session in self.sessions:
+                session.close()
+            # 缓存失效即使在回滚后执行也只是多一次未命中，不影响正确性
+            for callback in self.callbacks:
+                callback()
+
+
+class UnitOfWorkSession(RoutingSession):
+    """ 加入工作单元的session中，commit只执行flush，由工作单元统一提交 """
+
+    def commit(self) -> None:
+        if self.info.get(UNIT_OF_WORK_INFO_KEY) is not None:
+            self.flush()
+            return
+        super().commit()
+
+
+def get_unit_of_work() -> Optional[UnitOfWork]:
+    """ 当前请求的工作单元，不在请求中或工作单元已结束时返回空 """
+    if not has_request_context():
+        return None
+    unit: Optional[UnitOfWork] = g.get("db_unit_of_work")
+    return unit if unit is not None and unit.active else None
+
+
+def after_commit(callback: Callable[[], None]) -> None:
+    """
+    在当前请求的事务结束后执行回调(如清除缓存)，不在工作单元中时立即执行。
+    在提交前清除缓存时，并发的请求可能读到尚未提交前的数据并重新写入缓存
+
+    :param callback: 回调
+    :return:
+    """
+    unit: Optional[UnitOfWork] = get_unit_of_work()
+    if unit is not None:
+        unit.after_commit(callback)
+    else:
+        callback()
+
+
+def begin_unit_of_work() -> None:
+    """ 请求开始时创建工作单元(before_request) """
+    g.db_unit_of_work = UnitOfWork()
+
+
+def commit_unit_of_work(response: Response) -> Response:
+    """ 生成响应后提交工作单元(after_request)。在响应返回之前提交，提交失败时客户端能收到错误 """
+    unit: Optional[UnitOfWork] = g.get("db_unit_of_work")
+    if unit is not None:
+        unit.finish(commit=response.status_code < 400)
+    return response
+
+
+def close_unit_of_work(exc: Optional[BaseException] = None) -> None:
+    """ 应用上下文销毁时回滚未提交的工作单元并释放连接(teardown_appcontext)，如请求处理中出现未处理的异常 """
+    unit: Optional[UnitOfWork] = g.pop("db_unit_of_work", None)
+    if unit is not None:
+        unit.finish(commit=False)
+
+
+__all__ = ["UnitOfWork", "UnitOfWorkSession", "UNIT_OF_WORK_INFO_KEY", "get_unit_of_work", "after_commit",
+           "begin_unit_of_work", "commit_unit_of_work", "close_unit_of_work"]
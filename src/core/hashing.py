@@ -0,0 +1,105 @@
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, Future
+from typing import Callable, Final, Generator, List, Optional, Sequence, TypeVar
+
+from src.exceptions import ProximaException
+from src.utils import SecurityUtil
+
+R = TypeVar("R")
+
+
+class PasswordHasher:
+    """
+    密码哈希执行器。密码哈希/校验是刻意设计为CPU密集的运算，放在独立的进程池中执行，避免在登录高峰时占满请求线程的CPU。
+    等待中的任务数有上限，达到上限后新的请求在超时时间内等待空位，仍然没有空位时直接返回服务繁忙(背压)，而不是无限排队
+    """
+
+    def __init__(self, max_workers: int = 0, max_pending: int = 64, timeout: float = 10):
+        """
+        :param max_workers: 进程数，为0时在调用线程中直接执行
+        :param max_pending: 同时提交到进程池的任务数上限(包括执行中的任务)
+        :param timeout: 等待空位及等待结果的超时时间(秒)
+        """
+        self.max_workers: Final[int] = max_workers
+        self.timeout: Final[float] = timeout
+        self._slots: Final[threading.BoundedSemaphore] = threading.BoundedSemaphore(max_pending)
+        self._lock: Final[threading.Lock] = threading.Lock()
+        self._executor: Optional[Executor] = None
+        self._pid: Optional[int] = None
+
+    def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        校验密码
+
+        :param plain_password: 明文码
+        :param hashed_password: 哈希码
+        :return: 是否匹配
+        """
+        return self._run(SecurityUtil.verify_password, plain_password, hashed_password)
+
+    def generate(self, password: str) -> str:
+        """
+        生成密码
+
+        :param password: 明文码
+        :return: 哈希码
+        """
+        return self._run(SecurityUtil.generate_password, password)
+
+    def generate_many(self, passwords: Sequence[str]) -> List[str]:
+        """
+        批量生成密码，用于批量导入用户。所有任务只占用一个空位，分批交给进程池并行计算
+
+        :param passwords: 明文码
+        :return: 哈希码，与明文码的顺序一致
+        """
+        if self.max_workers <= 0:
+            return [SecurityUtil.generate_password(password) for password in passwords]
+        self._acquire()
+        try:
+            chunksize: int = max(1, len(passwords) // (self.max_workers * 4))
+            return list(self._get_executor().map(SecurityUtil.generate_password, passwords, chunksize=chunksize))
+        finally:
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _run(self, func: Callable[..., R], *args) -> R:
+        if self.max_workers <= 0:
+            return func(*args)
+        self._acquire()
+        try:
+            future: Future = self._get_executor().submit(func, *args)
+            return future.result(timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+    def _acquire(self) -> None:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ProximaException(code=503, description="服务繁忙，请稍后重试")
+
+    def _get_executor(self) -> Executor:
+        """ 首次使用时创建进程池。fork出的子进程不能使用父进程的进程池，需要重新创建 """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # 子进程只执行哈希运算，不会使用从父进程继承的连接池、日志等资源，因此可以使用默认的fork方式
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                self._pid = os.getpid()
+            return self._executor
+
+
+def init_password_hasher(max_workers: int, max_pending: int,
+                         timeout: float) -> Generator[PasswordHasher, None, None]:
+    hasher: PasswordHasher = PasswordHasher(max_workers=max_workers, max_pending=max_pending, timeout=timeout)
+    try:
+        yield hasher
+    finally:
+        hasher.shutdown()
+
+
+__all__ = ["PasswordHasher", "init_password_hasher"]
@@ -0,0 +1,281 @@
+import functools
+import hashlib
+import inspect
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Final, List, Optional, Sequence, Tuple, TypeVar
+
+import orjson
+from redis import Redis, RedisError
+
+from logger import logger
+from src.common.constant import Constant
+from src.core.cache import LocalCache, InvalidationBus
+from src.core.db.routing import has_written
+from src.utils import StringUtil
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class QueryCacheBackend(ABC):
+    """
+    查询结果缓存的存储。标签失效通过版本号实现: 缓存值中记录写入时各标签的版本号，读取时与标签的当前版本号比较，
+    不一致即视为失效。使标签失效只需更新版本号，不需要找出并删除该标签下的所有缓存
+    """
+
+    @abstractmethod
+    def get(self, key: str, tags: Sequence[str]) -> Tuple[Optional[str], List[str]]:
+        """
+        读取缓存值及标签的当前版本号
+
+        :param key: 缓存键
+        :param tags: 标签
+        :return: 缓存值(不存在时为空)、与tags顺序一致的版本号
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: int) -> None:
+        raise NotImplemented
+
+    @abstractmethod
+    def invalidate(self, tags: Sequence[str]) -> None:
+        """ 更新标签的版本号，使带有这些标签的缓存失效 """
+        raise NotImplemented
+
+
+class LocalQueryCacheBackend(QueryCacheBackend):
+    """ 进程内存储。配置了InvalidationBus时，标签失效会广播到所有进程 """
+
+    # 缓存失效广播的主题
+    topic: Final[str] = "query-cache"
+
+    def __init__(self, maxsize: int = 4096, bus: Optional[InvalidationBus] = None, tag_ttl: int = 86400):
+        """
+        :param maxsize: 缓存值及标签版本号的条目上限
+        :param bus: 缓存失效广播
+        :param tag_ttl: 标签版本号的有效期(秒)，缓存值的有效期不会超过它
+        """
+        self.bus: Final[Optional[InvalidationBus]] = bus
+        self.tag_ttl: Final[int] = tag_ttl
+        self._entries: Final[LocalCache] = LocalCache(maxsize=maxsize)
+        self._versions: Final[LocalCache] = LocalCache(maxsize=maxsize, ttl=tag_ttl)
+        self._lock: Final[threading.Lock] = threading.Lock()
+        if bus is not None:
+            bus.subscribe(self.topic, self._on_invalidate)
+
+    def get(self, key: str, tags: Sequence[str]) -> Tuple[Optional[str], List[str]]:
+        return self._entries.get(key), [self._get_version(tag) for tag in tags]
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self._entries.set(key, value, ttl=min(ttl, self.tag_ttl))
+
+    def invalidate(self, tags: Sequence[str]) -> None:
+        if self.bus is not None:
+            self.bus.publish(self.topic, *tags)
+        else:
+            for tag in tags:
+                self._on_invalidate(tag)
+
+    def _get_version(self, tag: str) -> str:
+        """ 标签的当前版本号。版本号过期或被淘汰后生成新的版本号，之前写入的缓存值不会重新生效 """
+        with self._lock:
+            version: Optional[str] = self._versions.get(tag)
+            if version is None:
+                version = StringUtil.get_unique_key()
+                self._versions.set(tag, version)
+            return version
+
+    def _on_invalidate(self, tag: str) -> None:
+        if tag == InvalidationBus.ALL:
+            self._entries.clear()
+        else:
+            self._versions.set(tag, StringUtil.get_unique_key())
+
+
+class RedisQueryCacheBackend(QueryCacheBackend):
+    """ redis存储，所有进程共享。缓存值与标签版本号通过一次MGET读取 """
+
+    def __init__(self, redis: Redis, tag_ttl: int = 86400):
+        """
+        :param redis: redis客户端
+        :param tag_ttl: 标签版本号的有效期(秒)，缓存值的有效期不会超过它，避免版本号过期后旧的缓存值重新生效
+        """
+        self.redis: Final[Redis] = redis
+        self.tag_ttl: Final[int] = tag_ttl
+
+    def get(self, key: str, tags: Sequence[str]) -> Tuple[Optional[str], List[str]]:
+        values: List[Optional[str]] = self.redis.mget([self._entry_key(key)] + [self._tag_key(tag) for tag in tags])
+        return values[0], [version or "0" for version in values[1:]]
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self.redis.set(self._entry_key(key), value, ex=min(ttl, self.tag_ttl))
+
+    def invalidate(self, tags: Sequence[str]) -> None:
+        with self.redis.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.set(self._tag_key(tag), StringUtil.get_unique_key(), ex=self.tag_ttl)
+            pipe.execute()
+
+    @staticmethod
+    def _entry_key(key: str) -> str:
+        return Constant.QUERY_CACHE_REDIS_KEY + key
+
+    @staticmethod
+    def _tag_key(tag: str) -> str:
+        return Constant.QUERY_CACHE_TAG_REDIS_KEY + tag
+
+
+class _Flight:
+    """ 正在执行的查询，同一进程中相同缓存键的其他调用等待其结果 """
+
+    def __init__(self):
+        self.done: Final[threading.Event] = threading.Event()
+        self.value: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class QueryCache:
+    """
+    查询结果缓存，配合@cached使用。
+     - 查询结果序列化为json保存，每次返回新的对象，只能缓存可以序列化为json的结果(不能是orm映射对象)
+     - single-flight: 同一进程中相同缓存键的查询同时未命中时，只有一个线程查询数据库，其他线程等待并共享结果
+     - 存储不可用时直接执行查询
+    """
+
+    def __init__(self, backend: QueryCacheBackend, ttl: int = 300, namespace: str = "query"):
+        """
+        :param backend: 存储
+        :param ttl: 默认有效期(秒)
+        :param namespace: 缓存键前缀
+        """
+        self.backend: Final[QueryCacheBackend] = backend
+        self.ttl: Final[int] = ttl
+        self.namespace: Final[str] = namespace
+        self._lock: Final[threading.Lock] = threading.Lock()
+        self._flights: Final[Dict[str, _Flight]] = {}
+        # 命中统计(当前进程): 命中、未命中、等待其他线程的查询结果
+        self.hits: int = 0
+        self.misses: int = 0
+        self.shared: int = 0
+
+    def get_or_load(self, key: str, tags: Sequence[str], loader: Callable[[], Any], ttl: Optional[int] = None) -> Any:
+        """
+        读取缓存，未命中时执行查询并写入缓存
+
+        :param key: 缓存键
+        :param tags: 标签
+        :param loader: 查询
+        :param ttl: 有效期(秒)，为空时使用默认有效期
+        :return: 查询结果
+        """
+        key = self.namespace + ":" + key
+        try:
+            cached, versions = self.backend.get(key, tags)
+        except RedisError as exc:
+            logger.warning("读取查询缓存失败: " + str(exc))
+            return loader()
+        if cached is not None:
+            entry: Dict[str, Any] = orjson.loads(cached)
+            if entry["tags"] == versions:
+                self._count(hit=True)
+                return entry["value"]
+
+        with self._lock:
+            flight: Optional[_Flight] = self._flights.get(key)
+            leader: bool = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            with self._lock:
+                self.shared += 1
+            return orjson.loads(flight.value)
+
+        self._count(hit=False)
+        try:
+            value: Any = loader()
+            flight.value = orjson.dumps(value).decode()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        try:
+            # 记录查询之前读取的版本号，查询期间标签失效时该缓存值不会被使用
+            self.backend.set(key, orjson.dumps({"tags": versions, "value": value}).decode(), ttl or self.ttl)
+        except RedisError as exc:
+            logger.warning("写入查询缓存失败: " + str(exc))
+        return orjson.loads(flight.value)
+
+    def invalidate(self, *tags: str) -> None:
+        """ 使带有这些标签的缓存失效 """
+        if len(tags) == 0:
+            return
+        try:
+            self.backend.invalidate(tags)
+        except RedisError as exc:
+            logger.warning("清除查询缓存失败: " + str(exc))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ 当前进程的命中统计 """
+        with self._lock:
+            total: int = self.hits + self.misses + self.shared
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "hit_ratio": round((self.hits + self.shared) / total, 4) if total > 0 else None,
+            }
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+def cached(tags: Sequence[str] = (), ttl: Optional[int] = None) -> Callable[[F], F]:
+    """
+    缓存repository方法的查询结果。repository未配置query_cache时直接执行查询；当前请求中执行过写操作时也不使用缓存
+    (缓存在事务提交后才失效)。
+    缓存键由方法名及参数计算。标签可以引用参数，如"role:{role_id}"；形如"a:b"的标签同时带有"a:*"，
+    用于在无法确定具体对象时使其全部失效(见Repository._on_changed)
+
+    :param tags: 标签
+    :param ttl: 有效期(秒)，为空时使用QueryCache的默认有效期
+    :return:
+    """
+
+    def decorator(func: F) -> F:
+        signature: inspect.Signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            query_cache: Optional[QueryCache] = getattr(self, "query_cache", None)
+            if query_cache is None or has_written():
+                return func(self, *args, **kwargs)
+            bound: inspect.BoundArguments = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments: Dict[str, Any] = dict(list(bound.arguments.items())[1:])
+            digest: str = hashlib.md5(orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+            resolved: List[str] = []
+            for tag in tags:
+                tag = tag.format(**arguments)
+                resolved.append(tag)
+                if ":" in tag:
+                    resolved.append(tag.split(":", 1)[0] + ":*")
+            return query_cache.get_or_load(f"{func.__qualname__}:{digest}", resolved,
+                                           lambda: func(self, *args, **kwargs), ttl)
+
+        return wrapper
+
+    return decorator
+
+
+__all__ = ["QueryCacheBackend", "LocalQueryCacheBackend", "RedisQueryCacheBackend", "QueryCache", "cached"]
@@ -1,13 +1,29 @@
+import hashlib
+from functools import partial
 from math import ceil
-from typing import List, Optional, Union, Generic, Dict, Sequence, TypeVar, Any, Final
+from typing import List, Optional, Union, Generic, Dict, Sequence, TypeVar, Any, Final, Tuple, Iterator
 
+import orjson
 from pydantic import BaseModel
+from redis import Redis, RedisError
+from sqlalchemy import inspect
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.engine.cursor import Result, CursorResult
-from sqlalchemy.sql import update, Update, delete, Delete, insert, Insert, select, Select, func
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.sql import update, Update, delete, Delete, insert, Insert, select, Select, func, and_, or_, text
 
+from logger import logger
+from src.common.constant import Constant
+from src.common.enums import CountMode
+from src.core.cache import TwoLevelCache
 from src.core.db.model import DeclarativeModel
+from src.core.db.routing import has_written
 from src.core.db.session import SessionContext
-from src.core.web.schemas import Page
+from src.core.db.unit_of_work import after_commit
+from src.core.query_cache import QueryCache
+from src.core.web.schemas import Page, CursorPage
+from src.exceptions import ProximaException
+from src.utils import CursorUtil, StringUtil
 
 T = TypeVar("T", bound=DeclarativeModel)
 DataSchema = TypeVar("DataSchema", bound=BaseModel)
@@ -15,12 +31,34 @@ DataSchema = TypeVar("DataSchema", bound=BaseModel)
 
 class Repository(Generic[T]):
     entity_class: T
+    # 允许用于游标分页的排序字段。必须是非空且有索引的列，否则keyset分页会退化为全表扫描
+    cursor_columns: Tuple[str, ...] = ("id",)
+    # 分页查询默认的总数统计方式
+    count_mode: CountMode = CountMode.exact
+    # 总数缓存有效期(秒)
+    count_cache_ttl: int = 300
+    # 导出时的列，为空时导出所有列。敏感列(如密码)不应出现在其中
+    export_columns: Optional[Tuple[str, ...]] = None
+    # 批量upsert时判断冲突的唯一键(MySQL的ON DUPLICATE KEY UPDATE对所有唯一键生效，其他数据库需要指定)
+    upsert_keys: Tuple[str, ...] = ("id",)
+    # 无法读取max_allowed_packet时，批量upsert每条语句的最大字节数
+    upsert_packet_size: int = 1024 * 1024
 
-    def __init__(self, session_context: SessionContext):
+    def __init__(self, session_context: SessionContext, redis: Optional[Redis] = None,
+                 entity_cache: Optional[TwoLevelCache] = None, query_cache: Optional[QueryCache] = None):
+        """
+        :param session_context: 数据库会话上下文
+        :param redis: redis客户端，用于总数缓存及数据版本号
+        :param entity_cache: 实体缓存(二级缓存)，为空时get_by_id直接查询数据库。同一实体类的所有repository应共享同一个实例
+        :param query_cache: 查询结果缓存，用于@cached修饰的方法。数据变更时使以表名及"表名:主键"为标签的缓存失效
+        """
         self.session_context: Final[SessionContext] = session_context
+        self.redis: Final[Optional[Redis]] = redis
+        self.entity_cache: Final[Optional[TwoLevelCache]] = entity_cache
+        self.query_cache: Final[Optional[QueryCache]] = query_cache
 
     def execute_query(self, stmt: Select) -> Result:
-        with self.session_context as session:
+        with self.session_context.reading() as session:
             return session.execute(stmt)
 
     def save(self, entity: Union[T, DataSchema]) -> int:
@@ -34,24 +72,56 @@ class Repository(Generic[T]):
             if isinstance(entity, DeclarativeModel):
                 session.add(entity)
                 session.commit()
+                self._on_changed()
                 return entity.id
             else:
                 data = entity.dict(exclude_none=True)
                 stmt: Insert = insert(self.entity_class).values(**data)
                 insert_result: CursorResult = session.execute(stmt)
                 session.commit()
+                self._on_changed()
                 return insert_result.inserted_primary_key[0]
 
     def get_by_id(self, ident: int) -> Optional[T]:
         """
-        根据主键获取数据库对象
+        根据主键获取数据库对象。配置了实体缓存时先读取缓存，未命中时查询数据库并写入缓存。
+        当前请求中执行过写操作时不读取缓存(缓存在事务提交后才失效)
 
         :param ident: 主键值
         :return: orm映射对象
         """
-        with self.session_context as session:
+        if self.entity_cache is None or has_written():
+            return self._load_by_id(ident)
+        loaded: List[T] = []
+
+        def load() -> Optional[str]:
+            # 写入缓存的数据从主库读取，只读副本的复制延迟可能使缓存中保存旧数据
+            entity: Optional[T] = self._load_by_id(ident, primary=True)
+            if entity is None:
+                return None
+            loaded.append(entity)
+            return self._to_cache(entity)
+
+        cached: Optional[str] = self.entity_cache.get_or_load(str(ident), load)
+        if len(loaded) > 0:
+            return loaded[0]
+        return self._from_cache(cached) if cached is not None else None
+
+    def _load_by_id(self, ident: int, primary: bool = False) -> Optional[T]:
+        with (self.session_context if primary else self.session_context.reading()) as session:
             return session.get(self.entity_class, ident=ident)
 
+    def _to_cache(self, entity: T) -> str:
+        """ 实体的所有列序列化为json """
+        return orjson.dumps({attr.key: getattr(entity, attr.key)
+                             for attr in inspect(self.entity_class).column_attrs}).decode()
+
+    def _from_cache(self, value: str) -> T:
+        """ 由缓存还原实体，并标记为已持久化的游离对象(与从session中加载后关闭session的对象一致) """
+        entity: T = self.entity_class(**orjson.loads(value))
+        make_transient_to_detached(entity)
+        return entity
+
     def get_by_ids(self, ident_list: Sequence[int]) -> List[T]:
         """
         根据主键获取数据库对象
@@ -59,43 +129,284 @@ class Repository(Generic[T]):
         :param ident_list: 主键序列
         :return: orm映射对象
         """
-        with self.session_context as session:
+        with self.session_context.reading() as session:
             stmt: Select = select(self.entity_class).where(self.entity_class.id.in_(ident_list))
             result: Result = session.execute(stmt)
             return result.scalars().all()
 
-    def get_by_map(self, params: Dict[str, Any] = None) -> List[T]:
+    def get_by_map(self, params: Dict[str, Any] = None, primary: bool = False) -> List[T]:
         """
         根据主键获取数据库对象
 
         :param params: 查询条件，应用于SQL WHERE语句
+        :param primary: 是否从主库读取，查询结果要写入缓存时使用，避免缓存只读副本上尚未同步的旧数据
         :return: orm映射对象的集合
         """
-        with self.session_context as session:
+        with (self.session_context if primary else self.session_context.reading()) as session:
             if params is None or len(params) == 0:
                 return session.execute(select(self.entity_class).distinct()).scalars().all()
             return session.execute(select(self.entity_class).distinct().filter_by(**params)).scalars().all()
 
-    def get_page(self, current: int, size: int, params: Optional[Dict] = None) -> Page[T]:
+    def get_export_columns(self) -> List[str]:
+        """ 导出时的列 """
+        if self.export_columns is not None:
+            return list(self.export_columns)
+        # 列名可能是str的子类quoted_name，转换为str以便序列化
+        return [str(column.name) for column in self.entity_class.__table__.columns]
+
+    def iter_all(self, batch_size: int = 1000) -> Iterator[T]:
+        """
+        按主键顺序流式读取所有数据，见iter_by_map
+
+        :param batch_size: 每批读取的行数
+        :return: orm映射对象的迭代器
+        """
+        return self.iter_by_map(None, batch_size)
+
+    def iter_by_map(self, params: Optional[Dict[str, Any]] = None, batch_size: int = 1000) -> Iterator[T]:
+        """
+        按主键顺序流式读取符合条件的数据，用于批处理任务，内存占用与结果集大小无关。
+        返回的是生成器，迭代时才查询数据库；数据库会话在迭代结束(或生成器被关闭)时才释放
+
+        :param params: 查询条件，应用于SQL WHERE语句
+        :param batch_size: 每批读取的行数
+        :return: orm映射对象的迭代器
+        """
+        stmt: Select = select(self.entity_class)
+        if params is not None and len(params) > 0:
+            stmt = stmt.filter_by(**params)
+        return self._iter_stream(stmt, batch_size, scalars=True)
+
+    def iter_rows(self, columns: Optional[Sequence[str]] = None, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        按主键顺序流式读取整张表，用于导出。不经过ORM映射，内存占用与表的大小无关
+
+        :param columns: 读取的列，为空时使用export_columns
+        :param batch_size: 每批读取的行数
+        :return: 以列名为键的行数据
+        """
+        table = self.entity_class.__table__
+        names: Sequence[str] = columns or self.get_export_columns()
+        # 第一列固定为主键，用于按主键分批读取
+        stmt: Select = select(table.c.id, *[table.c[name] for name in names])
+        for row in self._iter_stream(stmt, batch_size, scalars=False):
+            yield dict(zip(names, row[1:]))
+
+    def _iter_stream(self, stmt: Select, batch_size: int, scalars: bool) -> Iterator[Any]:
+        """
+        按主键顺序流式执行查询。
+         - 驱动支持服务端游标(如pymysql)时，使用stream_results在一次查询中边读取边返回，每次从游标读取batch_size行
+         - 否则按主键分批查询(keyset，WHERE id > 上一批的最大主键 LIMIT batch_size)，每批是一次独立的短查询，不使用OFFSET
+
+        :param stmt: 查询语句(不含排序)，scalars为False时第一列必须是主键
+        :param batch_size: 每批读取的行数
+        :param scalars: 是否返回orm映射对象(查询语句的第一个实体)
+        :return: 迭代器
+        """
+        key_column = self.entity_class.__table__.c.id
+        stmt = stmt.order_by(key_column)
+        # 游标读取期间调用方可能在同一线程中执行其他数据库操作，使用独立的session，避免当前线程共享的session被提前关闭
+        with self.session_context.factory.create_session() as session:
+            if session.get_bind().dialect.supports_server_side_cursors:
+                result: Result = session.execute(stmt.execution_options(stream_results=True)).yield_per(batch_size)
+                yield from result.scalars() if scalars else result
+                return
+
+        last_key: Any = None
+        while True:
+            chunk_stmt: Select = stmt.limit(batch_size)
+            if last_key is not None:
+                chunk_stmt = chunk_stmt.where(key_column > last_key)
+            with self.session_context as session:
+                result: Result = session.execute(chunk_stmt)
+                rows: List = result.scalars().all() if scalars else result.all()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_key = rows[-1].id if scalars else rows[-1][0]
+
+    def get_page(self, current: int, size: int, params: Optional[Dict] = None,
+                 count_mode: Optional[CountMode] = None) -> Page[T]:
         """
         获取分页数据 TODO 页码超出上限时的处理逻辑
         :param current: 请求的页码
         :param size: 请求的条数
         :param params: 请求的额外参数
+        :param count_mode: 总数统计方式，为空时使用该repository默认的统计方式
         :return:
         """
-        with self.session_context as session:
+        count_mode = count_mode or self.count_mode
+        with self.session_context.reading() as session:
 
             stmt: Select = select(self.entity_class).distinct()
             if params is not None:
-                stmt.filter_by(**params)
-            total: int = session.execute(select(func.count("*")).select_from(stmt)).scalar()
+                stmt = stmt.filter_by(**params)
+            offset: int = (current - 1) * size
+            if count_mode == CountMode.none:
+                # 不统计总数，多查询一条数据用于判断是否存在下一页
+                records: List[T] = session.execute(stmt.slice(offset, offset + size + 1)).scalars().all()
+                return Page(current=current, size=size, total=None, pages=None, has_next=len(records) > size,
+                            records=records[:size])
+            total: int = self._count(session, stmt, params, count_mode)
             records: List[T] = []
             if total > 0:
-                records = session.execute(stmt.slice((current - 1) * size, current * size)).scalars().all()
+                records = session.execute(stmt.slice(offset, offset + size)).scalars().all()
             page: Page = Page(current=current, size=size, total=total, pages=ceil(total / size), records=records)
+            page.has_next = current * size < total
             return page
 
+    def get_cursor_page(self, size: int, after: Optional[str] = None, before: Optional[str] = None,
+                        order_by: Optional[str] = None, params: Optional[Dict] = None) -> CursorPage[T]:
+        """
+        获取游标分页数据(keyset分页)。不使用OFFSET和COUNT，任意页的查询代价与首页相同
+
+        :param size: 请求的条数
+        :param after: 下一页游标，获取该游标之后的数据
+        :param before: 上一页游标，获取该游标之前的数据
+        :param order_by: 排序字段，以"-"开头表示倒序。仅在未携带游标时生效，携带游标时使用游标中的排序方式
+        :param params: 请求的额外参数
+        :return:
+        """
+        cursor: Optional[str] = after or before
+        if cursor:
+            column_name, desc, value, ident = CursorUtil.decode(cursor)
+        else:
+            order_by = order_by or "id"
+            column_name, desc, value, ident = order_by.lstrip("-"), order_by.startswith("-"), None, None
+        if column_name not in self.cursor_columns:
+            raise ProximaException(description=f"不支持的排序字段: {column_name}")
+
+        pk = self.entity_class.id
+        column = getattr(self.entity_class, column_name)
+        # 向前翻页时反向查询，取到数据后再翻转回来
+        backward: bool = not after and bool(before)
+        reverse: bool = desc != backward
+
+        stmt: Select = select(self.entity_class)
+        if params is not None:
+            stmt = stmt.filter_by(**params)
+        if cursor:
+            if column_name == "id":
+                stmt = stmt.where(pk < ident if reverse else pk > ident)
+            elif reverse:
+                stmt = stmt.where(or_(column < value, and_(column == value, pk < ident)))
+            else:
+                stmt = stmt.where(or_(column > value, and_(column == value, pk > ident)))
+        orders = [column.desc(), pk.desc()] if reverse else [column.asc(), pk.asc()]
+        if column_name == "id":
+            orders = orders[:1]
+        # 多取一条用于判断是否还有更多数据
+        stmt = stmt.order_by(*orders).limit(size + 1)
+
+        with self.session_context.reading() as session:
+            records: List[T] = session.execute(stmt).scalars().all()
+        has_more: bool = len(records) > size
+        records = records[:size]
+        if backward:
+            records.reverse()
+
+        page: CursorPage = CursorPage(size=size, records=records)
+        page.has_next = True if backward else has_more
+        page.has_previous = has_more if backward else bool(cursor)
+        if len(records) > 0:
+            first, last = records[0], records[-1]
+            if page.has_next:
+                page.next = CursorUtil.encode(column_name, desc, getattr(last, column_name), last.id)
+            if page.has_previous:
+                page.previous = CursorUtil.encode(column_name, desc, getattr(first, column_name), first.id)
+        return page
+
+    def _count(self, session: Session, stmt: Select, params: Optional[Dict], count_mode: CountMode) -> int:
+        """
+        按统计方式获取分页总数
+
+        :param session: 数据库会话
+        :param stmt: 分页查询语句
+        :param params: 查询条件
+        :param count_mode: 统计方式
+        :return: 总数
+        """
+        if count_mode == CountMode.estimated and not params:
+            total: Optional[int] = self._get_estimated_count(session)
+            if total is not None:
+                return total
+        if count_mode in (CountMode.cached, CountMode.estimated) and self.redis is not None:
+            return self._get_cached_count(session, stmt, params)
+        return session.execute(select(func.count()).select_from(stmt.order_by(None).subquery())).scalar()
+
+    def _get_cached_count(self, session: Session, stmt: Select, params: Optional[Dict]) -> int:
+        """
+        获取缓存的精确总数。同一张表所有查询条件的总数保存在同一个redis hash中，写操作时整体删除
+
+        :param session: 数据库会话
+        :param stmt: 分页查询语句
+        :param params: 查询条件
+        :return: 总数
+        """
+        field: str = hashlib.md5(orjson.dumps(params or {}, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+        redis_key: str = Constant.COUNT_REDIS_KEY + self.entity_class.__tablename__
+        try:
+            cached: Optional[str] = self.redis.hget(redis_key, field)
+            if cached is not None:
+                return int(cached)
+        except RedisError as exc:
+            logger.warning("读取总数缓存失败: " + str(exc))
+        total: int = session.execute(select(func.count()).select_from(stmt.order_by(None).subquery())).scalar()
+        try:
+            with self.redis.pipeline() as pipe:
+                pipe.hset(redis_key, field, total)
+                pipe.expire(redis_key, self.count_cache_ttl)
+                pipe.execute()
+        except RedisError as exc:
+            logger.warning("写入总数缓存失败: " + str(exc))
+        return total
+
+    def _get_estimated_count(self, session: Session) -> Optional[int]:
+        """
+        读取MySQL表统计信息中的估算行数(InnoDB下误差可能达到40%)，非MySQL数据库时返回空
+
+        :param session: 数据库会话
+        :return: 估算行数
+        """
+        if session.get_bind().dialect.name != "mysql":
+            return None
+        stmt = text("SELECT TABLE_ROWS FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name")
+        return session.execute(stmt, {"table_name": self.entity_class.__tablename__}).scalar()
+
+    def _on_changed(self, idents: Optional[Sequence[int]] = ()) -> None:
+        """
+        数据发生变更(新增、更新、删除)后调用，用于使相关缓存失效，并更新数据版本号(用于计算ETag)。
+        在请求级工作单元中时推迟到事务结束后执行，避免其他请求在提交前用旧数据重新填充缓存
+
+        :param idents: 被更新或删除的主键，用于清除实体缓存及查询结果缓存；为空时清除所有。仅新增数据时不需要传入
+        """
+        if self.redis is None and self.entity_cache is None and self.query_cache is None:
+            return
+        after_commit(partial(self._clear_caches, None if idents is None else tuple(idents)))
+
+    def _clear_caches(self, idents: Optional[Tuple[int, ...]]) -> None:
+        if self.entity_cache is not None:
+            if idents is None:
+                self.entity_cache.clear()
+            elif len(idents) > 0:
+                self.entity_cache.delete(*[str(ident) for ident in idents])
+        table_name: str = self.entity_class.__tablename__
+        if self.query_cache is not None:
+            if idents is None:
+                self.query_cache.invalidate(table_name, table_name + ":*")
+            else:
+                self.query_cache.invalidate(table_name, *[f"{table_name}:{ident}" for ident in idents])
+        if self.redis is None:
+            return
+        try:
+            with self.redis.pipeline(transaction=False) as pipe:
+                pipe.delete(Constant.COUNT_REDIS_KEY + table_name)
+                pipe.set(Constant.VERSION_REDIS_KEY + table_name, StringUtil.get_unique_key())
+                pipe.execute()
+        except RedisError as exc:
+            logger.warning("清除总数缓存失败: " + str(exc))
+
     def update(self, ident: int, schema: DataSchema) -> None:
         """
         根据主键更新对象
@@ -109,6 +420,7 @@ class Repository(Generic[T]):
             stmt: Update = update(self.entity_class).where(self.entity_class.id == ident).values(**update_data)
             session.execute(stmt)
             session.commit()
+            self._on_changed([ident])
 
     def delete(self, ident: int) -> None:
         """
@@ -120,16 +432,108 @@ class Repository(Generic[T]):
             stmt: Delete = delete(self.entity_class).where(self.entity_class.id == ident)
             session.execute(stmt)
             session.commit()
+            self._on_changed([ident])
 
-    def batch_insert(self, schemas: Sequence[DataSchema]) -> None:
+    def batch_insert(self, entities: Sequence[Union[T, DataSchema]]) -> None:
         """
-        批量保存
-        :param schemas: 待保存的对象
+        批量保存，所有数据在同一个事务中提交
+        :param entities: 待保存的对象。orm映射对象保存后会填充主键值
         :return:
         """
         with self.session_context as session:
-            mappings = [schema.dict(exclude_none=True) for schema in schemas]
-            session.bulk_insert_mappings(self.entity_class, mappings=mappings)
+            models: List[T] = [entity for entity in entities if isinstance(entity, DeclarativeModel)]
+            mappings = [entity.dict(exclude_none=True) for entity in entities
+                        if not isinstance(entity, DeclarativeModel)]
+            if len(models) > 0:
+                session.add_all(models)
+            if len(mappings) > 0:
+                session.bulk_insert_mappings(self.entity_class, mappings=mappings)
+            session.commit()
+            self._on_changed()
+
+    def batch_upsert(self, entities: Sequence[Union[Dict[str, Any], DataSchema]],
+                     update_columns: Optional[Sequence[str]] = None) -> int:
+        """
+        批量新增或更新(MySQL: INSERT ... ON DUPLICATE KEY UPDATE)，用于同步任务。
+        使用多行VALUES，按max_allowed_packet拆分为尽可能少的语句，所有语句在同一个事务中提交
+
+        :param entities: 数据，键相同的数据合并到同一条语句中
+        :param update_columns: 冲突时更新的列，为空时更新除唯一键外提交的所有列
+        :return: 受影响的行数。MySQL中新增的行计为1，更新的行计为2，未发生变化的行计为0
+        """
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for entity in entities:
+            row: Dict[str, Any] = entity if isinstance(entity, dict) else entity.dict(exclude_unset=True)
+            groups.setdefault(tuple(row.keys()), []).append(row)
+        if len(groups) == 0:
+            return 0
+        affected: int = 0
+        with self.session_context as session:
+            max_size: int = int(self._get_max_packet_size(session) * 0.8)
+            for keys, rows in groups.items():
+                columns: Sequence[str] = update_columns or [key for key in keys if key not in self.upsert_keys]
+                for chunk in self._split_by_size(rows, max_size):
+                    result: CursorResult = session.execute(self._build_upsert(session, chunk, columns))
+                    affected += max(result.rowcount, 0)
+            session.commit()
+            # 按其他唯一键upsert时无法确定被更新的主键，清除所有实体缓存
+            rows: List[Dict[str, Any]] = [row for group in groups.values() for row in group]
+            self._on_changed([row["id"] for row in rows] if all("id" in row for row in rows) else None)
+        return affected
+
+    def _build_upsert(self, session: Session, rows: List[Dict[str, Any]], columns: Sequence[str]) -> Insert:
+        table = self.entity_class.__table__
+        dialect: str = session.get_bind().dialect.name
+        if dialect == "mysql":
+            stmt = mysql.insert(table).values(rows)
+            excluded = stmt.inserted
+        elif dialect in ("sqlite", "postgresql"):
+            stmt = (sqlite if dialect == "sqlite" else postgresql).insert(table).values(rows)
+            excluded = stmt.excluded
+        else:
+            raise ProximaException(description=f"数据库{dialect}不支持批量upsert")
+        values: Dict[str, Any] = {column: excluded[column] for column in columns}
+        # 多行VALUES会应用新增时的默认值，但冲突时的更新不会触发onupdate，需要显式设置(如更新时间)
+        for column in table.columns:
+            if len(columns) == 0 or column.onupdate is None or column.name in values:
+                continue
+            values[column.name] = column.onupdate.arg(None) if column.onupdate.is_callable else column.onupdate.arg
+        if len(values) == 0:
+            # 没有需要更新的列时保持原值
+            values = {key: table.c[key] for key in self.upsert_keys}
+        if dialect == "mysql":
+            return stmt.on_duplicate_key_update(values)
+        return stmt.on_conflict_do_update(index_elements=list(self.upsert_keys), set_=values)
+
+    def _get_max_packet_size(self, session: Session) -> int:
+        """ MySQL单条语句的字节数上限(max_allowed_packet) """
+        if session.get_bind().dialect.name != "mysql":
+            return self.upsert_packet_size
+        try:
+            return int(session.execute(text("SELECT @@max_allowed_packet")).scalar())
+        except Exception as exc:
+            logger.warning("读取max_allowed_packet失败: " + str(exc))
+            return self.upsert_packet_size
+
+    @staticmethod
+    def _split_by_size(rows: List[Dict[str, Any]], max_size: int) -> Iterator[List[Dict[str, Any]]]:
+        """ 按估算的SQL字节数拆分数据。每个值按其字面量长度加上引号、逗号等开销估算，二进制值按转义后最长的两倍估算 """
+        chunk: List[Dict[str, Any]] = []
+        size: int = 0
+        for row in rows:
+            row_size: int = 4
+            for value in row.values():
+                if isinstance(value, bytes):
+                    row_size += len(value) * 2 + 12
+                else:
+                    row_size += len(str(value).encode(Constant.UTF8)) + 4
+            if len(chunk) > 0 and size + row_size > max_size:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(row)
+            size += row_size
+        if len(chunk) > 0:
+            yield chunk
 
     def batch_update(self, schemas: Sequence[DataSchema]) -> None:
         """
@@ -141,6 +545,7 @@ class Repository(Generic[T]):
             mappings = [schema.dict(exclude_unset=True) for schema in schemas]
             session.bulk_update_mappings(self.entity_class, mappings=mappings)
             session.commit()
+            self._on_changed([mapping["id"] for mapping in mappings])
 
     def batch_delete(self, idents: Sequence[int]) -> None:
         """
@@ -152,3 +557,4 @@ class Repository(Generic[T]):
             stmt: Delete = delete(self.entity_class).where(self.entity_class.id.in_(idents))
             session.execute(stmt)
             session.commit()
+            self._on_changed(idents)
@@ -1,11 +1,13 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional, Union, Generic, Dict, Sequence, TypeVar, Final
+from typing import List, Optional, Union, Generic, Dict, Sequence, TypeVar, Final, Iterator, Any
 
 from pydantic import BaseModel
 
+from src.common.enums import CountMode, DataFormat
 from src.core.db.model import DeclarativeModel
 from src.core.repository import Repository
-from src.core.web.schemas import Page
+from src.core.web.schemas import Page, CursorPage
+from src.utils import TabularUtil
 
 M = TypeVar("M", bound=Repository)
 T = TypeVar("T", bound=DeclarativeModel)
@@ -54,11 +56,27 @@ class IService(ABC):
         raise NotImplemented
 
     @abstractmethod
-    def get_page(self, current: Optional[int] = 1, size: Optional[int] = 10) -> Page[T]:
+    def export(self, data_format: DataFormat, batch_size: int = 1000) -> Iterator[bytes]:
         """
-        获取分页数据
+        按主键顺序流式导出所有数据(repository的export_columns列)
+        :param data_format: 数据格式
+        :param batch_size: 每批从数据库读取的行数
+        :return: 序列化后的数据块
+        """
+        raise NotImplemented
+
+    @abstractmethod
+    def get_page(self, current: Optional[int] = 1, size: Optional[int] = 10, after: Optional[str] = None,
+                 before: Optional[str] = None, order_by: Optional[str] = None,
+                 count_mode: Optional[CountMode] = None) -> Union[Page[T], CursorPage[T]]:
+        """
+        获取分页数据。携带after或before参数(允许为空字符串，表示首页)时使用游标分页，否则使用页码分页
         :param current: 目标页
         :param size: 每页数据条数
+        :param after: 下一页游标
+        :param before: 上一页游标
+        :param order_by: 游标分页的排序字段，以"-"开头表示倒序
+        :param count_mode: 页码分页的总数统计方式，为空时使用repository默认的统计方式
         :return: 分页结果
         """
         raise NotImplemented
@@ -83,14 +101,25 @@ class IService(ABC):
         raise NotImplemented
 
     @abstractmethod
-    def batch_insert(self, mappings: Sequence[DataSchema]) -> None:
+    def batch_insert(self, mappings: Sequence[Union[T, DataSchema]]) -> None:
         """
-        批量保存
+        批量保存，所有数据在同一个事务中提交
         :param mappings: 待保存的对象
         :return:
         """
         raise NotImplemented
 
+    @abstractmethod
+    def batch_upsert(self, mappings: Sequence[Union[Dict[str, Any], DataSchema]],
+                     update_columns: Optional[Sequence[str]] = None) -> int:
+        """
+        批量新增或更新，所有数据在同一个事务中提交
+        :param mappings: 待保存的数据
+        :param update_columns: 数据已存在时更新的列，为空时更新除唯一键外提交的所有列
+        :return: 受影响的行数
+        """
+        raise NotImplemented
+
     @abstractmethod
     def batch_update(self, mappings: Sequence[DataSchema]) -> None:
         """
@@ -150,15 +179,35 @@ class ServiceImpl(Generic[M, T], ABC):
         """
         return self.repository.get_by_map(params)
 
-    def get_page(self, current: Optional[int] = 1, size: Optional[int] = 10) -> Page[T]:
+    def export(self, data_format: DataFormat, batch_size: int = 1000) -> Iterator[bytes]:
+        """
+        按主键顺序流式导出所有数据(repository的export_columns列)。返回的是生成器，在迭代时才读取数据库
+
+        :param data_format: 数据格式
+        :param batch_size: 每批从数据库读取的行数
+        :return: 序列化后的数据块
+        """
+        columns: List[str] = self.repository.get_export_columns()
+        rows: Iterator[Dict[str, Any]] = self.repository.iter_rows(columns, batch_size)
+        return TabularUtil.write_rows(rows, columns, data_format)
+
+    def get_page(self, current: Optional[int] = 1, size: Optional[int] = 10, after: Optional[str] = None,
+                 before: Optional[str] = None, order_by: Optional[str] = None,
+                 count_mode: Optional[CountMode] = None) -> Union[Page[T], CursorPage[T]]:
         """
-        获取分页数据
+        获取分页数据。携带after或before参数(允许为空字符串，表示首页)时使用游标分页，否则使用页码分页
         
         :param current: 目标页
         :param size: 每页数据条数
+        :param after: 下一页游标
+        :param before: 上一页游标
+        :param order_by: 游标分页的排序字段，以"-"开头表示倒序
+        :param count_mode: 页码分页的总数统计方式，为空时使用repository默认的统计方式
         :return: 分页结果
         """
-        return self.repository.get_page(current=current, size=size)
+        if after is not None or before is not None:
+            return self.repository.get_cursor_page(size=size, after=after, before=before, order_by=order_by)
+        return self.repository.get_page(current=current, size=size, count_mode=count_mode)
 
     def update(self, ident: int, schema: DataSchema) -> None:
         """
@@ -179,14 +228,24 @@ class ServiceImpl(Generic[M, T], ABC):
         """
         self.repository.delete(ident)
 
-    def batch_insert(self, mappings: Sequence[DataSchema]) -> None:
+    def batch_insert(self, mappings: Sequence[Union[T, DataSchema]]) -> None:
         """
-        批量保存
+        批量保存，所有数据在同一个事务中提交
         :param mappings: 待保存的对象
         :return:
         """
         self.repository.batch_insert(mappings)
 
+    def batch_upsert(self, mappings: Sequence[Union[Dict[str, Any], DataSchema]],
+                     update_columns: Optional[Sequence[str]] = None) -> int:
+        """
+        批量新增或更新，所有数据在同一个事务中提交
+        :param mappings: 待保存的数据
+        :param update_columns: 数据已存在时更新的列，为空时更新除唯一键外提交的所有列
+        :return: 受影响的行数
+        """
+        return self.repository.batch_upsert(mappings, update_columns)
+
     def batch_update(self, mappings: Sequence[DataSchema]) -> None:
         """
         批量更新
@@ -0,0 +1,99 @@
+import hashlib
+from functools import wraps
+from typing import Callable, List, Optional, Sequence, Type
+
+from dependency_injector.wiring import Provide, inject
+from flask import current_app, request, make_response
+from redis import Redis, RedisError
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+from container import Container
+from logger import logger
+from settings import settings
+from src.common.constant import Constant
+from src.core.db.model import DeclarativeModel
+from src.utils import StringUtil
+
+
+@inject
+def get_versions(tables: Sequence[str], redis: Redis = Provide[Container.redis]) -> Optional[List[str]]:
+    """
+    获取数据表的版本号。版本号在repository写操作后更新，不存在时初始化为随机值(避免redis数据丢失后与旧版本号重复)
+
+    :param tables: 表名
+    :param redis: redis客户端
+    :return: 与表名一一对应的版本号，redis不可用时为空
+    """
+    keys: List[str] = [Constant.VERSION_REDIS_KEY + table for table in tables]
+    try:
+        versions: List[Optional[str]] = redis.mget(keys)
+        missing: List[str] = [key for key, version in zip(keys, versions) if version is None]
+        if len(missing) > 0:
+            with redis.pipeline(transaction=False) as pipe:
+                for key in missing:
+                    pipe.set(key, StringUtil.get_unique_key(), nx=True)
+                pipe.execute()
+            versions = redis.mget(keys)
+        return versions
+    except RedisError as exc:
+        logger.warning("读取数据版本号失败: " + str(exc))
+        return None
+
+
+def conditional(*entities: Type[DeclarativeModel]) -> Callable:
+    """
+    条件请求(ETag)校验，用于读多写少的GET接口。
+    ETag由请求路径和所依赖数据表的版本号计算得出，请求头If-None-Match与之匹配时直接返回304，不会执行视图函数(不访问数据库)；
+    redis不可用时退化为根据响应内容计算ETag，仅能节省传输。
+    需要放在登录/权限校验装饰器之后，保证未授权的请求不会得到304
+
+    :param entities: 响应数据所依赖的数据库模型，任一模型对应的表发生写操作后ETag随之变化
+    """
+    tables: List[str] = [entity.__tablename__ for entity in entities]
+
+    def wrapper(func):
+        @wraps(func)
+        def inner_wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return func(*args, **kwargs)
+            versions: Optional[List[str]] = get_versions(tables)
+            if versions is None:
+                response: WerkzeugResponse = make_response(func(*args, **kwargs))
+                response.add_etag()
+                return response.make_conditional(request)
+
+            source: str = "\n".join([request.full_path] + [str(version) for version in versions])
+            etag: str = hashlib.md5(source.encode(Constant.UTF8)).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(func(*args, **kwargs))
+            response.set_etag(etag, weak=True)
+            return response
+
+        return inner_wrapper
+
+    return wrapper
+
+
+def apply_cache_control(response: WerkzeugResponse) -> WerkzeugResponse:
+    """
+    按蓝图设置GET请求响应的Cache-Control(settings.CACHE_CONTROL)，由内向外查找第一个配置了的蓝图。
+    视图函数已自行设置Cache-Control时不做修改
+
+    :param response: 响应
+    :return: 响应
+    """
+    if request.method not in ("GET", "HEAD") or response.status_code not in (200, 304):
+        return response
+    if "Cache-Control" in response.headers:
+        return response
+    for name in request.blueprints:
+        value: Optional[str] = settings.CACHE_CONTROL.get(name.rsplit(".", 1)[-1])
+        if value is not None:
+            response.headers["Cache-Control"] = value
+            break
+    return response
+
+
+__all__ = ["conditional", "get_versions", "apply_cache_control"]
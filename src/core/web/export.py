@@ -0,0 +1,27 @@
+from typing import Iterator
+
+from flask import current_app
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+from src.common.enums import DataFormat
+from src.utils import TabularUtil
+
+
+def send_export(chunks: Iterator[bytes], data_format: DataFormat, name: str) -> WerkzeugResponse:
+    """
+    以附件形式流式返回导出的数据。响应没有Content-Length，WSGI服务器使用分块传输编码边生成边发送
+
+    :param chunks: 序列化后的数据块
+    :param data_format: 数据格式
+    :param name: 下载时的文件名(不含扩展名)
+    :return: 响应
+    """
+    response: WerkzeugResponse = current_app.response_class(chunks, mimetype=TabularUtil.mimetypes[data_format])
+    response.headers.set("Content-Disposition", "attachment",
+                         filename=f"{name}.{TabularUtil.extensions[data_format]}")
+    # 避免前端代理缓冲整个响应
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+__all__ = ["send_export"]
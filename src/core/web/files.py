@@ -0,0 +1,67 @@
+import pathlib
+from typing import BinaryIO, Optional
+from urllib.parse import quote
+
+from flask import current_app, request, send_file
+from werkzeug.utils import send_file as werkzeug_send_file
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+from settings import settings
+from src.common.enums import DownloadOffload
+
+
+def send_local_file(path: pathlib.Path, download_name: str, mimetype: Optional[str] = None) -> WerkzeugResponse:
+    """
+    发送本地文件，支持Range请求(206 Partial Content)及ETag/Last-Modified条件请求。
+     - 配置了FILE_DOWNLOAD_OFFLOAD时，只返回X-Sendfile/X-Accel-Redirect响应头，由前端代理发送文件内容(包括Range处理)
+     - 否则由WSGI服务器的wsgi.file_wrapper发送(gunicorn等会使用os.sendfile零拷贝发送)
+
+    :param path: 文件路径
+    :param download_name: 下载时的文件名
+    :param mimetype: 文件类型
+    :return: 响应
+    """
+    if settings.FILE_DOWNLOAD_OFFLOAD:
+        return _offload(path, download_name, mimetype)
+    response: WerkzeugResponse = send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name,
+                                           conditional=True)
+    if response.status_code == 206:
+        _use_file_wrapper(response, path)
+    return response
+
+
+def _offload(path: pathlib.Path, download_name: str, mimetype: Optional[str]) -> WerkzeugResponse:
+    """ 交由前端代理发送文件，不打开文件 """
+    response: WerkzeugResponse = werkzeug_send_file(
+        path, request.environ, mimetype=mimetype, as_attachment=True, download_name=download_name,
+        conditional=False, etag=False, use_x_sendfile=True, response_class=current_app.response_class
+    )
+    if settings.FILE_DOWNLOAD_OFFLOAD == DownloadOffload.x_accel_redirect:
+        # nginx需要内部location的URI而不是文件路径
+        upload_dir = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR).resolve()
+        relative: str = pathlib.Path(path).resolve().relative_to(upload_dir).as_posix()
+        del response.headers["X-Sendfile"]
+        del response.headers["Content-Length"]
+        response.headers["X-Accel-Redirect"] = quote(settings.FILE_ACCEL_REDIRECT_LOCATION + relative)
+    return response
+
+
+def _use_file_wrapper(response: WerkzeugResponse, path: pathlib.Path) -> None:
+    """
+    werkzeug对Range请求会将响应包装为按块读取的迭代器，服务器无法再使用sendfile。
+    gunicorn的file_wrapper从文件当前位置开始发送Content-Length个字节，因此可以直接定位到区间起点后交给它发送。
+    其他服务器的file_wrapper不一定遵循Content-Length，保持werkzeug的处理方式
+    """
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is None or not request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn"):
+        return
+    content_range = response.content_range
+    if content_range is None or content_range.start is None:
+        return
+    file: BinaryIO = open(path, "rb")
+    file.seek(content_range.start)
+    response.close()
+    response.response = file_wrapper(file, settings.UPLOAD_CHUNK_SIZE)
+
+
+__all__ = ["send_local_file"]
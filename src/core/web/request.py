@@ -1,8 +1,9 @@
-from datetime import timedelta
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple, List
+from weakref import WeakKeyDictionary
 
 import orjson
 from redis import Redis
+from redis.commands.core import Script
 from werkzeug.local import LocalProxy
 from flask import has_request_context, request
 from dependency_injector.wiring import Provide, inject
@@ -10,19 +11,28 @@ from dependency_injector.wiring import Provide, inject
 from logger import logger
 from settings import settings
 from container import Container
-from src.utils import SecurityUtil
+from src.apps.manage.permission import PermissionCache
 from src.common.constant import Constant
 from src.core.web.schemas import CurrentUser, TokenPayload
+from src.core.web.session import UserSessionCache, TokenCache, TokenRevocationList
 from src.exceptions import UnAuthorizedException, TokenExpiredException
 
 
 @inject
-def load_user(redis: Redis = Provide[Container.redis]) -> Optional[CurrentUser]:
+def load_user(redis: Redis = Provide[Container.redis],
+              permission_cache: PermissionCache = Provide[Container.permission_cache],
+              session_cache: UserSessionCache = Provide[Container.session_cache],
+              token_cache: TokenCache = Provide[Container.token_cache],
+              revocation_list: TokenRevocationList = Provide[Container.revocation_list]) -> Optional[CurrentUser]:
     """
     根据token解析出的redis键，加载对应的redis用户数据，并设置为request.user。
     若request.user已经有对应的值，则直接返回值即可
 
     :param redis: redis客户端
+    :param permission_cache: 权限缓存，用于获取最新的权限(登录时的权限快照可能已过期)
+    :param session_cache: 进程内的登录用户缓存
+    :param token_cache: 进程内的token校验结果缓存
+    :param revocation_list: 已吊销token列表(按设备登出)
     :return: CurrentUser 对象
     """
     if has_request_context():
@@ -35,21 +45,63 @@ def load_user(redis: Redis = Provide[Container.redis]) -> Optional[CurrentUser]:
         # token存在时，进入token校验程序 -> 要么解析出用户，要么抛出特定异常
         if token is not None and len(token) > 0:
             token = token.replace(Constant.TOKEN_SCHEMA, "").strip()
-            payload: Dict = SecurityUtil.parse_token(token=token)
-            token_data = TokenPayload(sub=payload["sub"])
-            redis_key: str = Constant.AUTH_REDIS_KEY + token_data.sub
-            redis_value: str = redis.get(redis_key)
-            if not redis_value:
+            payload: Dict = token_cache.parse(token)
+            token_data = TokenPayload(**payload)
+            if token_data.jti is not None and revocation_list.is_revoked(token_data.jti):
                 raise TokenExpiredException
-            try:
-                info: Dict = orjson.loads(redis_value)
-                request.user = CurrentUser(**info)
-                # 刷新有效期
-                redis.expire(redis_key, time=timedelta(minutes=settings.TOKEN_EXPIRED_MINUTES))
-                return request.user
-            except Exception as exc:
-                logger.error("从redis加载用户失败， 失败信息: " + str(exc))
-                raise UnAuthorizedException
+            redis_key: str = Constant.AUTH_REDIS_KEY + token_data.sub
+            user = session_cache.get(token_data.sub)
+            if user is None:
+                user, ttl = _load_from_redis(redis, redis_key)
+                session_cache.put(token_data.sub, user, ttl)
+            user.authorities = permission_cache.resolve(user.id)
+            request.user = user
+            # 当前token的载荷，登出时用于吊销该token
+            request.token = token_data
+            return request.user
+
+
+# 读取会话并返回剩余有效期，剩余有效期低于阈值时才刷新。一次往返，大多数情况下不产生写操作
+_LOAD_SESSION_SCRIPT: str = """
+local value = redis.call('GET', KEYS[1])
+if not value then
+    return nil
+end
+local ttl = redis.call('TTL', KEYS[1])
+if ttl < tonumber(ARGV[1]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    ttl = tonumber(ARGV[2])
+end
+return {value, ttl}
+"""
+
+# 各redis客户端注册的会话读取脚本。注册时会计算脚本的sha1，只在每个客户端首次使用时注册一次
+_load_session_scripts: "WeakKeyDictionary[Redis, Script]" = WeakKeyDictionary()
+
+
+def _load_from_redis(redis: Redis, redis_key: str) -> Tuple[CurrentUser, int]:
+    """
+    从redis中加载用户，剩余有效期低于阈值时刷新有效期
+
+    :param redis: redis客户端
+    :param redis_key: 用户会话的redis键
+    :return: CurrentUser 对象及会话剩余有效期(秒)
+    """
+    threshold: int = settings.TOKEN_REFRESH_THRESHOLD_MINUTES * 60
+    expire: int = settings.TOKEN_EXPIRED_MINUTES * 60
+    script: Optional[Script] = _load_session_scripts.get(redis)
+    if script is None:
+        script = _load_session_scripts[redis] = redis.register_script(_LOAD_SESSION_SCRIPT)
+    result: Optional[List] = script(keys=[redis_key], args=[threshold, expire])
+    if not result:
+        raise TokenExpiredException
+    redis_value, ttl = result
+    try:
+        info: Dict = orjson.loads(redis_value)
+        return CurrentUser(**info), int(ttl)
+    except Exception as exc:
+        logger.error("从redis加载用户失败， 失败信息: " + str(exc))
+        raise UnAuthorizedException
 
 
 current_user: "CurrentUser" = LocalProxy(load_user)  # type: ignore
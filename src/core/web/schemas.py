@@ -9,14 +9,35 @@ T = TypeVar('T')
 
 class Page(GenericModel, Generic[T]):
     """ 分页结果 """
-    # 结果总数
-    total: int = 0
+    # 结果总数，不统计总数时为空
+    total: Optional[int] = 0
     # 当前页
     current: int = 1
     # 每页条目
     size: int = 10
-    # 总页数
-    pages: int = 0
+    # 总页数，不统计总数时为空
+    pages: Optional[int] = 0
+    # 是否存在下一页
+    has_next: bool = False
+    # 当前页数据集
+    records: List[T] = Field(default_factory=list)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+class CursorPage(GenericModel, Generic[T]):
+    """ 游标分页结果(keyset分页，任意页的查询代价与首页相同) """
+    # 每页条目
+    size: int = 10
+    # 下一页游标，没有下一页时为空
+    next: Optional[str] = None
+    # 上一页游标，没有上一页时为空
+    previous: Optional[str] = None
+    # 是否存在下一页
+    has_next: bool = False
+    # 是否存在上一页
+    has_previous: bool = False
     # 当前页数据集
     records: List[T] = Field(default_factory=list)
 
@@ -45,6 +66,8 @@ class TreeSchema(BaseModel):
     id: Any
     name: str = Field(alias="label")
     parent_id: Any
+    # 同级节点的显示顺序
+    sort: Optional[int] = 0
     children: Optional[List['TreeSchema']] = []
     disabled: Optional[bool] = False
 
@@ -55,6 +78,10 @@ class TreeSchema(BaseModel):
 
 class TokenPayload(BaseModel):
     sub: Optional[Any] = None
+    # token唯一标识，用于按token吊销。旧版本签发的token没有该字段
+    jti: Optional[str] = None
+    # 过期时间戳
+    exp: Optional[int] = None
 
 
 TreeSchema.update_forward_refs()
@@ -0,0 +1,246 @@
+import hashlib
+import threading
+import time
+from typing import Dict, Final, List, Optional
+
+from redis import Redis, RedisError
+
+from logger import logger
+from settings import settings
+from src.common.constant import Constant
+from src.core.cache import LocalCache, InvalidationBus
+from src.core.web.schemas import CurrentUser
+from src.utils import SecurityUtil, BloomFilter
+
+
+class _SessionEntry:
+    __slots__ = ("user", "expires_at")
+
+    def __init__(self, user: CurrentUser, ttl: float):
+        self.user: CurrentUser = user
+        # 根据加载时redis返回的剩余有效期推算出的会话过期时间
+        self.expires_at: float = time.monotonic() + ttl
+
+
+class UserSessionCache:
+    """
+    进程内的登录用户缓存，位于redis之前，避免每个请求都读取并反序列化redis中的用户信息。
+    登出、重新登录时通过InvalidationBus通知所有进程清除对应用户的缓存
+    """
+
+    topic: Final[str] = "session"
+
+    def __init__(self, bus: Optional[InvalidationBus] = None):
+        self.bus: Final[Optional[InvalidationBus]] = bus
+        self._local: Final[LocalCache] = LocalCache(
+            maxsize=settings.SESSION_LOCAL_CACHE_SIZE,
+            ttl=settings.SESSION_LOCAL_CACHE_TTL
+        )
+        if bus is not None:
+            bus.subscribe(self.topic, self._on_evict)
+
+    def get(self, subject: str) -> Optional[CurrentUser]:
+        """
+        获取缓存的用户。返回的是副本，调用方可以随意修改。
+        会话的剩余有效期低于刷新阈值时视为未命中，由调用方重新从redis加载并刷新有效期
+
+        :param subject: token中的sub(用户id)
+        :return: 当前用户，未命中时为空
+        """
+        entry: Optional[_SessionEntry] = self._local.get(subject)
+        if entry is None:
+            return None
+        if entry.expires_at - time.monotonic() < settings.TOKEN_REFRESH_THRESHOLD_MINUTES * 60:
+            return None
+        return entry.user.copy(deep=True)
+
+    def put(self, subject: str, user: CurrentUser, ttl: float) -> None:
+        """
+        缓存从redis中加载的用户
+
+        :param subject: token中的sub(用户id)
+        :param user: 当前用户
+        :param ttl: 会话在redis中的剩余有效期(秒)
+        :return:
+        """
+        self._local.set(subject, _SessionEntry(user.copy(deep=True), ttl))
+
+    def evict(self, subject: str) -> None:
+        """
+        清除所有进程中该用户的缓存
+
+        :param subject: token中的sub(用户id)
+        :return:
+        """
+        if self.bus is not None:
+            self.bus.publish(self.topic, subject)
+        else:
+            self._on_evict(subject)
+
+    def _on_evict(self, subject: str) -> None:
+        if subject == InvalidationBus.ALL:
+            self._local.clear()
+        else:
+            self._local.delete(subject)
+
+
+class TokenCache:
+    """
+    进程内的token校验结果缓存。同一个token在有效期内会被重复携带，校验通过后缓存其载荷，
+    再次请求时跳过jwt的解码、签名校验及声明校验。
+    缓存键为token的摘要，缓存有效期不超过token的exp，过期的token仍由jwt校验并抛出对应异常；校验失败的token不缓存
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        """
+        :param maxsize: 最大条目数
+        :param ttl: 缓存有效期(秒)
+        """
+        self.ttl: Final[float] = ttl
+        self._local: Final[LocalCache] = LocalCache(maxsize=maxsize, ttl=ttl)
+
+    def parse(self, token: str) -> Dict:
+        """
+        解析token，命中缓存时不再校验
+
+        :param token: token
+        :return: token载荷的副本
+        """
+        key: bytes = hashlib.sha256(token.encode()).digest()
+        payload: Optional[Dict] = self._local.get(key)
+        if payload is None:
+            payload = SecurityUtil.parse_token(token=token)
+            exp: Optional[float] = payload.get("exp")
+            ttl: float = self.ttl if exp is None else min(self.ttl, exp - time.time())
+            if ttl > 0:
+                self._local.set(key, payload, ttl)
+        return dict(payload)
+
+    def clear(self) -> None:
+        self._local.clear()
+
+
+class TokenRevocationList:
+    """
+    已吊销token(jti)列表，用于按设备登出。
+    吊销记录保存在redis的有序集合中(score为token的过期时间，过期后的记录会被清理)，每个进程在本地维护一个布隆过滤器：
+     - 未命中过滤器说明token一定没有被吊销，无需访问redis，这是绝大多数请求的情况
+     - 命中时可能是误判，再通过redis确认
+    新的吊销记录通过InvalidationBus通知所有进程加入本地过滤器；过滤器定期按redis中的记录重建，以清除过期记录并弥补丢失的消息
+    """
+
+    topic: Final[str] = "revocation"
+
+    def __init__(self, redis: Redis, bus: Optional[InvalidationBus] = None, capacity: int = 100000,
+                 error_rate: float = 0.001, refresh_interval: float = 300):
+        """
+        :param redis: redis客户端
+        :param bus: 缓存失效广播
+        :param capacity: 布隆过滤器的预计元素数量
+        :param error_rate: 布隆过滤器的误判率
+        :param refresh_interval: 重建本地过滤器的间隔(秒)
+        """
+        self.redis: Final[Redis] = redis
+        self.bus: Final[Optional[InvalidationBus]] = bus
+        self.capacity: Final[int] = capacity
+        self.error_rate: Final[float] = error_rate
+        self.refresh_interval: Final[float] = refresh_interval
+        self._lock: Final[threading.Lock] = threading.Lock()
+        # 保证同一时间只有一个线程重建过滤器
+        self._rebuild_lock: Final[threading.Lock] = threading.Lock()
+        self._filter: Optional[BloomFilter] = None
+        self._loaded_at: Optional[float] = None
+        # 重建过滤器期间收到的吊销记录，重建完成后补充到新的过滤器中
+        self._pending: Optional[List[str]] = None
+        if bus is not None:
+            bus.subscribe(self.topic, self._on_revoke)
+
+    def revoke(self, jti: str, expired_at: int) -> None:
+        """
+        吊销token
+
+        :param jti: token唯一标识
+        :param expired_at: token的过期时间戳，此后不再需要保留吊销记录
+        :return:
+        """
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(Constant.REVOKED_TOKEN_REDIS_KEY, {jti: expired_at})
+            pipe.zremrangebyscore(Constant.REVOKED_TOKEN_REDIS_KEY, "-inf", int(time.time()))
+            pipe.execute()
+        if self.bus is not None:
+            self.bus.publish(self.topic, jti)
+        else:
+            self._on_revoke(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        """
+        token是否已被吊销
+
+        :param jti: token唯一标识
+        :return: 是否已吊销
+        """
+        bloom: BloomFilter = self._get_filter()
+        if jti not in bloom:
+            return False
+        return self.redis.zscore(Constant.REVOKED_TOKEN_REDIS_KEY, jti) is not None
+
+    def _get_filter(self) -> BloomFilter:
+        bloom: Optional[BloomFilter] = self._filter
+        if bloom is not None and self._is_fresh():
+            return bloom
+        # 同一时间只由一个线程重建；已有过滤器时其他线程不等待，继续使用当前过滤器
+        if not self._rebuild_lock.acquire(blocking=bloom is None):
+            return bloom
+        try:
+            # 等待期间其他线程可能已完成重建
+            if self._filter is not None and self._is_fresh():
+                return self._filter
+            bloom = self._filter
+            try:
+                return self._rebuild()
+            except RedisError as exc:
+                # 已有过滤器时继续使用，稍后再重建
+                if bloom is None:
+                    raise
+                logger.warning("重建token吊销列表失败: " + str(exc))
+                self._loaded_at = time.monotonic()
+                return bloom
+        finally:
+            self._rebuild_lock.release()
+
+    def _is_fresh(self) -> bool:
+        loaded_at: Optional[float] = self._loaded_at
+        return loaded_at is not None and time.monotonic() - loaded_at < self.refresh_interval
+
+    def _rebuild(self) -> BloomFilter:
+        """ 按redis中的记录重建过滤器，调用方需持有_rebuild_lock """
+        pending: List[str] = []
+        with self._lock:
+            self._pending = pending
+        try:
+            members: List[str] = self.redis.zrangebyscore(Constant.REVOKED_TOKEN_REDIS_KEY, int(time.time()), "+inf")
+            bloom: BloomFilter = BloomFilter(max(self.capacity, len(members)), self.error_rate, members)
+            with self._lock:
+                for jti in pending:
+                    bloom.add(jti)
+                self._filter = bloom
+                self._loaded_at = time.monotonic()
+                return bloom
+        finally:
+            with self._lock:
+                if self._pending is pending:
+                    self._pending = None
+
+    def _on_revoke(self, jti: str) -> None:
+        if jti == InvalidationBus.ALL:
+            # 订阅中断期间可能丢失了消息，下次使用时重建
+            self._loaded_at = None
+            return
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+            if self._pending is not None:
+                self._pending.append(jti)
+
+
+__all__ = ["UserSessionCache", "TokenCache", "TokenRevocationList"]
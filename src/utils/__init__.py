@@ -1,7 +1,12 @@
+from src.utils.bloom import BloomFilter
+from src.utils.cursor import CursorUtil
 from src.utils.date import DateUtil
+from src.utils.password import PasswordUtil
 from src.utils.request import RequestUtil
 from src.utils.security import SecurityUtil
 from src.utils.strings import StringBuilder, StringUtil
+from src.utils.tabular import TabularUtil
 from src.utils.tree import TreeUtil
 
-__all__ = {"SecurityUtil", "StringUtil", "StringBuilder", "DateUtil", "TreeUtil", "RequestUtil"}
+__all__ = {"SecurityUtil", "StringUtil", "StringBuilder", "DateUtil", "TreeUtil", "RequestUtil", "CursorUtil",
+           "PasswordUtil", "BloomFilter", "TabularUtil"}
@@ -0,0 +1,49 @@
+import hashlib
+import math
+import threading
+from typing import Final, Iterable, Iterator
+
+
+class BloomFilter:
+    """
+    布隆过滤器，用于在本地快速判断元素"一定不存在"。判断为存在时可能是误判(概率约为error_rate)，需要再向数据源确认。
+    不支持删除元素，需要移除元素时重新构建
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001, items: Iterable[str] = ()):
+        """
+        :param capacity: 预计的元素数量，超出后误判率会升高
+        :param error_rate: 期望的误判率
+        :param items: 初始元素
+        """
+        # 位数组长度 m = -n·ln(p) / (ln2)²，哈希函数个数 k = m/n·ln2
+        self.size: Final[int] = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count: Final[int] = max(1, round(self.size / max(capacity, 1) * math.log(2)))
+        self._bits: Final[bytearray] = bytearray((self.size + 7) // 8)
+        self._count: int = 0
+        self._lock: Final[threading.Lock] = threading.Lock()
+        for item in items:
+            self.add(item)
+
+    def add(self, item: str) -> None:
+        with self._lock:
+            for position in self._positions(item):
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self._count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self) -> int:
+        """ 添加过的元素个数(重复添加的元素会重复计数) """
+        return self._count
+
+    def _positions(self, item: str) -> Iterator[int]:
+        """ 双重哈希: 由一次128位摘要拆出h1、h2，第i个位置为 h1 + i·h2 """
+        digest: bytes = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1: int = int.from_bytes(digest[:8], "little")
+        h2: int = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+
+__all__ = ["BloomFilter"]
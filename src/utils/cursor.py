@@ -0,0 +1,40 @@
+import base64
+import binascii
+from typing import Any, Tuple
+
+import orjson
+
+from src.exceptions import ProximaException
+
+
+class CursorUtil:
+    """ 游标分页工具类。游标对调用方不透明，内部为 [排序字段, 是否倒序, 排序字段值, 主键值] """
+
+    @staticmethod
+    def encode(column: str, desc: bool, value: Any, ident: int) -> str:
+        """
+        生成游标
+
+        :param column: 排序字段名
+        :param desc: 是否倒序
+        :param value: 当前记录排序字段的值
+        :param ident: 当前记录主键值(排序字段值相同时用于区分先后)
+        :return: url安全的base64字符串
+        """
+        raw: bytes = orjson.dumps([column, desc, value, ident])
+        return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+    @staticmethod
+    def decode(cursor: str) -> Tuple[str, bool, Any, int]:
+        """
+        解析游标
+
+        :param cursor: 游标字符串
+        :return: (排序字段名, 是否倒序, 排序字段值, 主键值)
+        """
+        try:
+            raw: bytes = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            column, desc, value, ident = orjson.loads(raw)
+            return str(column), bool(desc), value, int(ident)
+        except (binascii.Error, orjson.JSONDecodeError, ValueError, TypeError):
+            raise ProximaException(description="无效的分页游标")
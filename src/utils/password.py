@@ -0,0 +1,199 @@
+import hashlib
+import hmac
+import math
+import secrets
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from settings import settings
+
+try:
+    import argon2
+except ImportError:  # pragma: no cover - argon2为可选依赖
+    argon2 = None
+
+
+class PasswordAlgorithm(ABC):
+    """ 密码哈希算法。哈希码中需要包含算法名及计算参数，以便参数调整后识别出需要升级的旧哈希码 """
+
+    name: str
+
+    @abstractmethod
+    def hash(self, password: str) -> str:
+        raise NotImplemented
+
+    @abstractmethod
+    def verify(self, password: str, hashed_password: str) -> bool:
+        raise NotImplemented
+
+    @abstractmethod
+    def needs_update(self, hashed_password: str) -> bool:
+        """ 哈希码的计算参数与当前配置不一致时返回True """
+        raise NotImplemented
+
+    @abstractmethod
+    def scaled(self, factor: float) -> "PasswordAlgorithm":
+        """ 按比例调整计算代价后的算法，用于基准测试 """
+        raise NotImplemented
+
+    def identify(self, hashed_password: str) -> bool:
+        """ 是否为该算法生成的哈希码 """
+        return hashed_password.startswith(self.name + ":")
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class Pbkdf2Algorithm(PasswordAlgorithm):
+    """ werkzeug的PBKDF2实现，哈希码格式为 pbkdf2:<digest>:<iterations>$<salt>$<hash> """
+
+    name = "pbkdf2"
+
+    def __init__(self, iterations: int, digest: str = "sha256"):
+        self.iterations: int = iterations
+        self.digest: str = digest
+
+    def hash(self, password: str) -> str:
+        return generate_password_hash(password, method=f"pbkdf2:{self.digest}:{self.iterations}", salt_length=16)
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        return check_password_hash(hashed_password, password)
+
+    def needs_update(self, hashed_password: str) -> bool:
+        params: List[str] = hashed_password.split("$", 1)[0].split(":")
+        # werkzeug旧版本的哈希码可能省略迭代次数
+        return len(params) != 3 or params[1] != self.digest or params[2] != str(self.iterations)
+
+    def scaled(self, factor: float) -> "Pbkdf2Algorithm":
+        return Pbkdf2Algorithm(max(1, int(self.iterations * factor)), self.digest)
+
+    def __str__(self) -> str:
+        return f"pbkdf2:{self.digest}:{self.iterations}"
+
+
+class ScryptAlgorithm(PasswordAlgorithm):
+    """ hashlib的scrypt实现，哈希码格式与werkzeug(>=3.0)一致: scrypt:<n>:<r>:<p>$<salt>$<hash> """
+
+    name = "scrypt"
+
+    def __init__(self, n: int, r: int = 8, p: int = 1):
+        self.n: int = n
+        self.r: int = r
+        self.p: int = p
+
+    def hash(self, password: str) -> str:
+        salt: str = secrets.token_hex(8)
+        return f"{self}${salt}${self._compute(password, salt, self.n, self.r, self.p)}"
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        try:
+            method, salt, expected = hashed_password.split("$", 2)
+            _, n, r, p = method.split(":")
+            return hmac.compare_digest(self._compute(password, salt, int(n), int(r), int(p)), expected)
+        except ValueError:
+            return False
+
+    def needs_update(self, hashed_password: str) -> bool:
+        return hashed_password.split("$", 1)[0] != str(self)
+
+    def scaled(self, factor: float) -> "ScryptAlgorithm":
+        # n必须是2的幂
+        exponent: int = max(1, round(math.log2(self.n * factor)))
+        return ScryptAlgorithm(1 << exponent, self.r, self.p)
+
+    @staticmethod
+    def _compute(password: str, salt: str, n: int, r: int, p: int) -> str:
+        return hashlib.scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p, maxmem=132 * n * r * p).hex()
+
+    def __str__(self) -> str:
+        return f"scrypt:{self.n}:{self.r}:{self.p}"
+
+
+class Argon2Algorithm(PasswordAlgorithm):
+    """ argon2-cffi的Argon2id实现(可选依赖)，哈希码为标准的PHC格式 $argon2id$v=19$m=...,t=...,p=...$... """
+
+    name = "argon2"
+
+    def __init__(self, time_cost: int, memory_cost: int, parallelism: int):
+        self.time_cost: int = time_cost
+        self.memory_cost: int = memory_cost
+        self.parallelism: int = parallelism
+        self._hasher = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+    def hash(self, password: str) -> str:
+        return self._hasher.hash(password)
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        try:
+            return self._hasher.verify(hashed_password, password)
+        except argon2.exceptions.VerificationError:
+            return False
+        except argon2.exceptions.InvalidHash:
+            return False
+
+    def needs_update(self, hashed_password: str) -> bool:
+        return self._hasher.check_needs_rehash(hashed_password)
+
+    def identify(self, hashed_password: str) -> bool:
+        return hashed_password.startswith("$argon2")
+
+    def scaled(self, factor: float) -> "Argon2Algorithm":
+        return Argon2Algorithm(max(1, int(self.time_cost * factor)), self.memory_cost, self.parallelism)
+
+    def __str__(self) -> str:
+        return f"argon2:t={self.time_cost},m={self.memory_cost},p={self.parallelism}"
+
+
+class PasswordUtil:
+    """ 密码哈希算法注册表。新密码使用settings.PASSWORD_HASH_ALGORITHM指定的算法，校验时根据哈希码识别算法 """
+
+    _algorithms: Dict[str, PasswordAlgorithm] = {}
+
+    @classmethod
+    def register(cls, algorithm: PasswordAlgorithm) -> None:
+        cls._algorithms[algorithm.name] = algorithm
+
+    @classmethod
+    def get_algorithms(cls) -> List[PasswordAlgorithm]:
+        """ 所有可用的算法 """
+        return list(cls._algorithms.values())
+
+    @classmethod
+    def get_default(cls) -> PasswordAlgorithm:
+        algorithm: Optional[PasswordAlgorithm] = cls._algorithms.get(settings.PASSWORD_HASH_ALGORITHM)
+        if algorithm is None:
+            raise ValueError(f"不支持的密码哈希算法: {settings.PASSWORD_HASH_ALGORITHM}")
+        return algorithm
+
+    @classmethod
+    def identify(cls, hashed_password: str) -> Optional[PasswordAlgorithm]:
+        for algorithm in cls._algorithms.values():
+            if algorithm.identify(hashed_password):
+                return algorithm
+        return None
+
+    @classmethod
+    def hash(cls, password: str) -> str:
+        return cls.get_default().hash(password)
+
+    @classmethod
+    def verify(cls, password: str, hashed_password: str) -> bool:
+        algorithm: Optional[PasswordAlgorithm] = cls.identify(hashed_password)
+        if algorithm is None:
+            return False
+        return algorithm.verify(password, hashed_password)
+
+    @classmethod
+    def needs_update(cls, hashed_password: str) -> bool:
+        """ 哈希码不是使用当前配置的算法及参数生成时返回True，应在登录校验通过后用明文密码重新生成 """
+        default: PasswordAlgorithm = cls.get_default()
+        return not default.identify(hashed_password) or default.needs_update(hashed_password)
+
+
+PasswordUtil.register(Pbkdf2Algorithm(settings.PBKDF2_ITERATIONS, settings.PBKDF2_DIGEST))
+PasswordUtil.register(ScryptAlgorithm(settings.SCRYPT_N, settings.SCRYPT_R, settings.SCRYPT_P))
+if argon2 is not None:
+    PasswordUtil.register(Argon2Algorithm(settings.ARGON2_TIME_COST, settings.ARGON2_MEMORY_COST,
+                                          settings.ARGON2_PARALLELISM))
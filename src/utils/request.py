@@ -1,8 +1,13 @@
+from enum import Enum
+from typing import Type, TypeVar, Optional
+
 from flask import request, has_request_context
 
 from logger import logger
 from src.exceptions import ProximaException
 
+E = TypeVar("E", bound=Enum)
+
 
 class RequestUtil:
 
@@ -24,3 +29,23 @@ class RequestUtil:
             except ValueError:
                 logger.error(f"查询参数 {name} 类型错误。请使用整数类型值")
                 ProximaException(description=f"查询参数 {name} 类型错误。请使用整数类型值")
+
+    @staticmethod
+    def parse_enum_arg(name, enum_class: Type[E], default: E = None) -> Optional[E]:
+        """
+        从请求参数中解析出对应变量名的枚举值。可以指定默认值。失败时抛出自定义异常。
+
+        :param name: 待获取的参数名
+        :param enum_class: 枚举类型
+        :param default: 默认值(取不到参数或参数值为空时使用)
+        :return: 解析出的枚举值或默认值或者None
+        """
+        if has_request_context():
+            val: str = request.args.get(name, None)
+            if not val:
+                return default
+            try:
+                return enum_class(val)
+            except ValueError:
+                options: str = ",".join(str(e.value) for e in enum_class)
+                raise ProximaException(description=f"查询参数 {name} 取值错误。可选值: {options}")
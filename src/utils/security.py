@@ -5,20 +5,25 @@
 from datetime import timedelta, datetime
 from typing import Any, Dict
 
-from jose import jwt, ExpiredSignatureError, JWTError
+from jose import jwt, jwk, ExpiredSignatureError, JWTError
+from jose.backends.base import Key
 from jose.constants import ALGORITHMS
-from werkzeug.security import generate_password_hash, check_password_hash
 
 from settings import settings
 from src.exceptions import TokenExpiredException, UnAuthorizedException
+from src.utils.password import PasswordUtil
+from src.utils.strings import StringUtil
 
 
 class SecurityUtil:
 
 	""" 安全相关的功能集合 """
 
-	@staticmethod
-	def create_token(subject: Any, expires_delta: timedelta = None) -> str:
+	# 预先构造的签名密钥对象，避免每次签发/校验token时重新解析密钥
+	_token_key: Key = jwk.construct(settings.SECRET_KEY, ALGORITHMS.HS256)
+
+	@classmethod
+	def create_token(cls, subject: Any, expires_delta: timedelta = None) -> str:
 		"""
 		签发token
 
@@ -30,12 +35,13 @@ class SecurityUtil:
 			expire = datetime.utcnow() + expires_delta
 		else:
 			expire = datetime.utcnow() + timedelta(minutes=settings.TOKEN_EXPIRED_MINUTES)
-		payload = {"exp": expire, "sub": str(subject)}
-		token = jwt.encode(payload, settings.SECRET_KEY, algorithm=ALGORITHMS.HS256)
+		# jti用于按token(设备)吊销
+		payload = {"exp": expire, "sub": str(subject), "jti": StringUtil.get_unique_key()}
+		token = jwt.encode(payload, cls._token_key, algorithm=ALGORITHMS.HS256)
 		return token
 
-	@staticmethod
-	def parse_token(token: str) -> Dict:
+	@classmethod
+	def parse_token(cls, token: str) -> Dict:
 		"""
 		解析token, 获取token携带的信息
 
@@ -43,7 +49,7 @@ class SecurityUtil:
 		:return: 解析后的信息
 		"""
 		try:
-			return jwt.decode(token, key=settings.SECRET_KEY, algorithms=[ALGORITHMS.HS256])
+			return jwt.decode(token, key=cls._token_key, algorithms=[ALGORITHMS.HS256])
 		# 令牌过期
 		except ExpiredSignatureError:
 			raise TokenExpiredException
@@ -60,7 +66,7 @@ class SecurityUtil:
 		:param hashed_password: 哈希码
 		:return: 是否匹配
 		"""
-		return check_password_hash(hashed_password, plain_password)
+		return PasswordUtil.verify(plain_password, hashed_password)
 
 	@classmethod
 	def generate_password(cls, password: str) -> str:
@@ -70,4 +76,14 @@ class SecurityUtil:
 		:param password: 明文码
 		:return: 哈希码
 		"""
-		return generate_password_hash(password)
+		return PasswordUtil.hash(password)
+
+	@classmethod
+	def password_needs_rehash(cls, hashed_password: str) -> bool:
+		"""
+		哈希码是否使用了过时的算法或计算参数，需要在登录成功后重新生成
+
+		:param hashed_password: 哈希码
+		:return: 是否需要重新生成
+		"""
+		return PasswordUtil.needs_update(hashed_password)
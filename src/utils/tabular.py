@@ -0,0 +1,98 @@
+import codecs
+import csv
+import io
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, Sequence, Tuple
+
+import orjson
+
+from src.common.constant import Constant
+from src.common.enums import DataFormat
+from src.exceptions import ProximaException
+
+
+class TabularUtil:
+    """ CSV/JSONL格式数据的流式读写 """
+
+    # 各格式对应的文件扩展名及MIME类型
+    extensions: Dict[DataFormat, str] = {DataFormat.csv: "csv", DataFormat.jsonl: "jsonl"}
+    mimetypes: Dict[DataFormat, str] = {DataFormat.csv: "text/csv", DataFormat.jsonl: "application/x-ndjson"}
+
+    @classmethod
+    def read_rows(cls, stream: BinaryIO, data_format: DataFormat) -> Iterator[Tuple[int, Dict]]:
+        """
+        逐行读取UTF-8数据(可以带有BOM)，不会将全部内容读入内存
+
+        :param stream: 二进制输入流
+        :param data_format: 数据格式
+        :return: (行号, 行数据)。CSV中的空值会被忽略，无法解析的JSON行为空字典
+        """
+        lines: Iterator[str] = codecs.iterdecode(stream, Constant.UTF8_SIG)
+        if data_format == DataFormat.csv:
+            return cls._read_csv(lines)
+        return cls._read_jsonl(lines)
+
+    @classmethod
+    def write_rows(cls, rows: Iterable[Dict[str, Any]], columns: Sequence[str], data_format: DataFormat,
+                   chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        逐行序列化数据，累积到chunk_size字节后输出一块，避免为每一行产生一次写操作
+
+        :param rows: 行数据
+        :param columns: 列名，CSV的表头及列顺序
+        :param data_format: 数据格式
+        :param chunk_size: 每块的大致字节数
+        :return: 序列化后的数据块
+        """
+        if data_format == DataFormat.csv:
+            lines: Iterator[bytes] = cls._write_csv(rows, columns)
+        else:
+            lines: Iterator[bytes] = (orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+        buffer: bytearray = bytearray()
+        for line in lines:
+            buffer += line
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        if len(buffer) > 0:
+            yield bytes(buffer)
+
+    @staticmethod
+    def _write_csv(rows: Iterable[Dict[str, Any]], columns: Sequence[str]) -> Iterator[bytes]:
+        text: io.StringIO = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            yield text.getvalue().encode(Constant.UTF8)
+            text.seek(0)
+            text.truncate()
+        if text.tell() > 0:
+            yield text.getvalue().encode(Constant.UTF8)
+
+    @staticmethod
+    def _read_csv(lines: Iterator[str]) -> Iterator[Tuple[int, Dict]]:
+        reader = csv.DictReader(lines)
+        try:
+            for row in reader:
+                # 空字段视为未填写，使用默认值
+                yield reader.line_num, {k: v for k, v in row.items() if k is not None and v not in (None, "")}
+        except (csv.Error, UnicodeDecodeError) as exc:
+            raise ProximaException(description=f"第{reader.line_num}行数据格式错误: {exc}")
+
+    @staticmethod
+    def _read_jsonl(lines: Iterator[str]) -> Iterator[Tuple[int, Dict]]:
+        line_num: int = 0
+        try:
+            for line_num, line in enumerate(lines, start=1):
+                if line.strip() == "":
+                    continue
+                try:
+                    row = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    row = None
+                yield line_num, row if isinstance(row, dict) else {}
+        except UnicodeDecodeError as exc:
+            raise ProximaException(description=f"第{line_num + 1}行数据格式错误: {exc}")
+
+
+__all__ = ["TabularUtil"]
@@ -1,4 +1,5 @@
-from typing import MutableSequence, List, Dict, Any
+from collections import defaultdict
+from typing import Sequence, List, Dict, Any, Tuple
 
 from src.core.web.schemas import TreeSchema
 from src.exceptions import ProximaException
@@ -8,37 +9,33 @@ class TreeUtil:
     """ 树状结构工具类 """
 
     @classmethod
-    def build_tree(cls, elements: MutableSequence[TreeSchema]) -> List[Dict[str, Any]]:
+    def build_tree(cls, elements: Sequence[TreeSchema]) -> List[Dict[str, Any]]:
         """
-        根据列表构建树结构。该列表的每个元素都需要拥有AbstractTreeSchema中的属性id、parent_id
+        根据列表构建树结构。该列表的每个元素都需要拥有AbstractTreeSchema中的属性id、parent_id。
+        先按parent_id建立子节点索引，再逐层展开，时间复杂度O(n)，且不受递归深度限制。同级节点按sort升序排列
         :param elements: 元素列表
         :return: 树列表
         """
-        schemas: List[TreeSchema] = []
+        # parent_id -> 子节点列表
+        children: Dict[Any, List[TreeSchema]] = defaultdict(list)
         for e in elements:
-            # 从最高层级的对象开始进行遍历
-            if e.parent_id is None:
-                cls._recursion(e, elements)
-                schemas.append(e)
-        if len(schemas) == 0:
+            children[e.parent_id].append(e)
+        # 从最高层级的对象开始进行遍历
+        roots: List[TreeSchema] = cls._sorted(children.get(None, []))
+        if len(roots) == 0:
             raise ProximaException(description="找不到根节点")
-        result: List[Dict[str, Any]] = []
 
-        for schema in schemas:
-            result.append(schema.dict(by_alias=True))
+        result: List[Dict[str, Any]] = []
+        stack: List[Tuple[TreeSchema, List[Dict[str, Any]]]] = [(root, result) for root in reversed(roots)]
+        while stack:
+            node, siblings = stack.pop()
+            data: Dict[str, Any] = node.dict(by_alias=True, exclude={"children"})
+            data["children"] = []
+            siblings.append(data)
+            for child in reversed(cls._sorted(children.get(node.id, []))):
+                stack.append((child, data["children"]))
         return result
 
-    @classmethod
-    def _recursion(cls, node: TreeSchema, elements: MutableSequence[TreeSchema]) -> None:
-        """
-        递归处理。获取某个node的所有子节点。当前节点处理完后，应当将其从序列中移除以减少递归次数
-        :param node: 当前节点
-        :param elements: 所有节点
-        :return:
-        """
-        elements.remove(node)
-        for e in elements:
-            # 获取当前所有子节点，并对子节点进行同样的操作
-            if e.parent_id == node.id:
-                node.children.append(e)
-                cls._recursion(e, elements)
+    @staticmethod
+    def _sorted(nodes: List[TreeSchema]) -> List[TreeSchema]:
+        return sorted(nodes, key=lambda node: node.sort or 0)
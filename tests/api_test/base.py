@@ -1,8 +1,11 @@
+from unittest.mock import patch
+
 from flask import Flask
 from httpx import Client
 
 from app import create_app
 from container import Container
+from src.core.cache import InvalidationBus
 
 
 class AppContextMixin:
@@ -12,6 +15,9 @@ class AppContextMixin:
 
     @classmethod
     def setUpClass(cls) -> None:
+        # 不启动缓存失效消息的监听线程，测试结束后它会在后台持续重连redis
+        cls.listening = patch.object(InvalidationBus, "_ensure_listening")
+        cls.listening.start()
         cls.app = create_app()
         cls.container = getattr(cls.app, "container")
         cls.client: Client = Client(app=cls.app, base_url="http://localhost")
@@ -23,4 +29,5 @@ class AppContextMixin:
         if cls.container is not None:
             cls.container.shutdown_resources()
             cls.container.unwire()
+        cls.listening.stop()
 
@@ -72,7 +72,7 @@ class CommonApiTestCase(AppContextMixin, TestCase):
             self.assertEqual(data[0]['filename'], "fake-text-stream_1.txt")
             self.assertEqual(data[1]['filename'], "fake-text-stream_2.txt")
 
-    @patch("src.apps.common.routers.file.send_file")
+    @patch("src.apps.common.routers.file.send_local_file")
     def test_download(self, mock_send_file: Mock):
         """
         测试文件下载
@@ -93,9 +93,8 @@ class CommonApiTestCase(AppContextMixin, TestCase):
             mock_file_service.get_by_id.assert_called_once_with(file_id)
             mock_send_file.assert_called_once_with(
                 pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, "fake-filepath"),
-                as_attachment=True,
-                attachment_filename="fake-filename.txt",
-                mimetype="fake-content-type"
+                "fake-filename.txt",
+                "fake-content-type"
             )
 
     def test_delete(self):
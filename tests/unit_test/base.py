@@ -1,7 +1,11 @@
+from typing import List
 from unittest import TestCase
 from unittest.mock import Mock
 
-from src.core.db.session import SessionContext
+from src.apps.manage.models import Role
+from src.apps.manage.repository import RoleRepository
+from src.core.db.model import DeclarativeModel
+from src.core.db.session import SessionContext, SessionFactory
 
 
 class RepositoryTestCase(TestCase):
@@ -10,4 +14,25 @@ class RepositoryTestCase(TestCase):
         self.session = Mock()
         self.session_context = Mock(spec=SessionContext, __enter__=Mock(), __exit__=Mock())
         self.session_context.__enter__.return_value = self.session
+        self.session_context.reading.return_value = self.session_context
+        self.session_context.independent.return_value = self.session_context
 
+
+
+class SqliteRepositoryTestCase(TestCase):
+    """ 使用内存sqlite数据库的角色repository测试，子类可以覆盖初始数据及repository的创建 """
+
+    def setUp(self) -> None:
+        self.factory = SessionFactory(dsn="sqlite://")
+        DeclarativeModel.metadata.create_all(self.factory.get_session().get_bind(), tables=[Role.__table__])
+        with SessionContext(self.factory) as session:
+            session.add_all(self.create_roles())
+            session.commit()
+        self.repository = self.create_repository()
+
+    def create_roles(self) -> List[Role]:
+        """ 初始数据 """
+        return [Role(id=i, name=f"role-{i}") for i in range(1, 6)]
+
+    def create_repository(self) -> RoleRepository:
+        return RoleRepository(session_context=SessionContext(self.factory))
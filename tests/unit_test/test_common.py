@@ -1,6 +1,20 @@
+import hashlib
+import io
+import os
+import pathlib
+import tempfile
+import threading
+from typing import Dict
 from unittest import TestCase, main
 from unittest.mock import Mock, MagicMock, patch, ANY
 
+import orjson
+from flask import Flask
+from pydantic import ValidationError
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.compiler import compiles
+
+from settings import settings
 from src.apps.common.models import File
 from src.apps.common.repository import FileRepository
 from src.apps.common.services.auth import AuthServiceImpl
@@ -9,8 +23,16 @@ from src.apps.common.services.file import LocalFileService, FileStorage
 from src.apps.manage.models import User
 from src.apps.manage.repository import UserRepository
 from src.common.constant import Constant
-from src.core.db.session import SessionContext
-from src.exceptions import ProximaException, InvalidAccountException
+from src.common.enums import FileUploadStatus
+from src.apps.manage.permission import PermissionCache
+from src.core.db.model import DeclarativeModel
+from src.core.db.session import SessionContext, SessionFactory
+from src.core.web.request import load_user
+from src.core.web.schemas import CurrentUser
+from src.core.web.session import UserSessionCache, TokenCache, TokenRevocationList
+from src.exceptions import ProximaException, InvalidAccountException, TokenExpiredException
+from src.utils import SecurityUtil
+from src.utils.password import Pbkdf2Algorithm
 
 
 class FileRepositoryTestCase(TestCase):
@@ -33,6 +55,17 @@ class FileRepositoryTestCase(TestCase):
 
         self.assertEqual(file.id, 1)
 
+    def test_batch_insert(self):
+        """ 测试批量保存 - 所有对象在一次提交中保存 """
+        session = Mock()
+        session_context = Mock(spec=SessionContext, __enter__=Mock(), __exit__=Mock())
+        session_context.__enter__.return_value = session
+        repository = FileRepository(session_context=session_context)
+        files = [File(), File()]
+        repository.batch_insert(files)
+        session.add_all.assert_called_once_with(files)
+        session.commit.assert_called_once()
+
 
 class LocalFileServiceTestCase(TestCase):
 
@@ -56,6 +89,222 @@ class LocalFileServiceTestCase(TestCase):
         mock_repository.save.assert_called_once()
         self.assertEqual(result.filename, "Test Filename")
 
+    def test_upload_stream(self):
+        """
+        测试流式上传
+         - 分块写入后文件内容、大小、SHA-256正确，且不残留临时文件
+         - 超出大小限制时不保存文件
+        """
+        content: bytes = b"0123456789" * 1000
+        mock_repository: Mock = Mock(spec=FileRepository)
+        mock_repository.save.return_value = 1
+        service = LocalFileService(repository=mock_repository)
+        with tempfile.TemporaryDirectory() as base_dir, \
+                patch.object(settings, "BASE_DIR", base_dir), patch.object(settings, "UPLOAD_CHUNK_SIZE", 64):
+            result = service.upload_stream(io.BytesIO(content), "large.bin", "application/octet-stream")
+            path = pathlib.Path(base_dir, settings.UPLOAD_DIR, mock_repository.save.call_args[0][0].key)
+            self.assertEqual(path.read_bytes(), content)
+            self.assertEqual(result.size, len(content))
+            self.assertEqual(result.hash, hashlib.sha256(content).hexdigest())
+            self.assertEqual(os.listdir(path.parent), [path.name])
+
+            with patch.object(settings, "STREAM_UPLOAD_MAX_SIZE", 100):
+                self.assertRaises(ProximaException, service.upload_stream, io.BytesIO(content), "large.bin")
+            self.assertEqual(os.listdir(path.parent), [path.name])
+            mock_repository.save.assert_called_once()
+
+    def test_delete(self):
+        """ 非内容寻址存储的文件由记录独占，删除时不统计引用 """
+        mock_repository: Mock = Mock(spec=FileRepository)
+        service = LocalFileService(repository=mock_repository)
+        with tempfile.TemporaryDirectory() as base_dir, patch.object(settings, "BASE_DIR", base_dir):
+            result = service.upload_stream(io.BytesIO(b"avatar"), "a.png")
+            path = pathlib.Path(base_dir, result.url)
+            mock_repository.get_by_id.return_value = mock_repository.save.call_args[0][0]
+            service.delete(1)
+            self.assertFalse(path.exists())
+        mock_repository.delete.assert_called_once_with(1)
+        mock_repository.count_references.assert_not_called()
+
+
+class MultipartUploadTestCase(TestCase):
+    """ 分块上传(redis使用mock，分块写入临时目录) """
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        patcher = patch.object(settings, "BASE_DIR", self.temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis = MagicMock(spec=Redis)
+        self.repository = Mock(spec=FileRepository)
+        self.repository.save.return_value = 1
+        self.service = LocalFileService(repository=self.repository, redis=self.redis)
+        self.session = {"filename": "large.bin", "content_type": "", "status": str(FileUploadStatus.uploading.value)}
+        self.parts = {}
+        self.redis.hgetall.side_effect = lambda key: self.session if key.startswith(
+            Constant.UPLOAD_REDIS_KEY) else self.parts
+        self.redis.set.return_value = True
+        self.redis.exists.return_value = 0
+
+    def _upload_part(self, part_number: int, content: bytes) -> None:
+        part = self.service.upload_part("upload-id", part_number, io.BytesIO(content))
+        self.parts[str(part_number)] = orjson.dumps({"size": part.size, "hash": part.hash}).decode()
+
+    def test_complete(self):
+        """
+        - 分块乱序上传后按序号合并
+        - 合并完成后删除分块，保存文件记录
+        """
+        self._upload_part(2, b"world")
+        self._upload_part(1, b"hello ")
+        result = self.service.complete_multipart_upload("upload-id")
+
+        self.assertEqual(result.size, 11)
+        self.assertEqual(result.hash, hashlib.sha256(b"hello world").hexdigest())
+        file: File = self.repository.save.call_args[0][0]
+        self.assertEqual(pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, file.key).read_bytes(), b"hello world")
+        self.assertFalse(self.service._get_parts_dir("upload-id").exists())
+
+    def test_complete_missing_parts(self):
+        self._upload_part(2, b"world")
+        self.assertRaises(ProximaException, self.service.complete_multipart_upload, "upload-id")
+        self.redis.set.assert_not_called()
+        self.repository.save.assert_not_called()
+
+    def test_completing(self):
+        """
+        - 同一任务同时只能由一个请求合并，合并标记带有效期
+        - 合并期间拒绝上传分块及取消任务
+        - 合并失败时清除标记，可以重试
+        """
+        self._upload_part(1, b"hello")
+        self.redis.set.return_value = None
+        self.assertRaises(ProximaException, self.service.complete_multipart_upload, "upload-id")
+        self.redis.set.assert_called_once_with(Constant.UPLOAD_COMPLETING_REDIS_KEY + "upload-id", 1, nx=True,
+                                               ex=settings.MULTIPART_COMPLETE_TIMEOUT)
+        self.redis.exists.return_value = 1
+        self.assertRaises(ProximaException, self._upload_part, 2, b"world")
+        self.assertRaises(ProximaException, self.service.abort_multipart_upload, "upload-id")
+        self.redis.delete.assert_not_called()
+
+        self.redis.set.return_value = True
+        self.repository.save.side_effect = Exception("save failed")
+        self.assertRaises(Exception, self.service.complete_multipart_upload, "upload-id")
+        self.redis.delete.assert_called_once_with(Constant.UPLOAD_COMPLETING_REDIS_KEY + "upload-id")
+
+    def test_upload_expired(self):
+        self.session = {}
+        self.assertRaises(ProximaException, self.service.upload_part, "upload-id", 1, io.BytesIO(b"hello"))
+
+
+@compiles(BigInteger, "sqlite")
+def _compile_big_integer(element, compiler, **kw):
+    """ sqlite仅INTEGER类型的主键支持自增 """
+    return "INTEGER"
+
+
+class DeduplicatedStorageTestCase(TestCase):
+    """ 内容寻址存储(使用内存sqlite数据库统计引用) """
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        for name, value in (("BASE_DIR", self.temp_dir.name), ("FILE_DEDUPLICATE", True)):
+            patcher = patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        factory = SessionFactory(dsn="sqlite://")
+        DeclarativeModel.metadata.create_all(factory.get_session().get_bind(), tables=[File.__table__])
+        self.service = LocalFileService(repository=FileRepository(session_context=SessionContext(factory)))
+
+    def test_deduplicate(self):
+        """
+        - 相同内容只保存一份，每次上传都新增一条文件记录
+        - 已存在相同内容时可以秒传
+        - 删除最后一条引用时才删除文件
+        """
+        first = self.service.upload_stream(io.BytesIO(b"avatar"), "a.png")
+        second = self.service.upload_stream(io.BytesIO(b"avatar"), "b.png")
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(first.url, second.url)
+        path = pathlib.Path(settings.BASE_DIR, first.url)
+        self.assertEqual(path.read_bytes(), b"avatar")
+
+        third = self.service.upload_by_hash(first.hash, "c.png")
+        self.assertEqual(third.url, first.url)
+        self.assertIsNone(self.service.upload_by_hash(hashlib.sha256(b"other").hexdigest(), "d.png"))
+
+        self.service.delete(first.id)
+        self.service.delete(second.id)
+        self.assertTrue(path.exists())
+        self.service.delete(third.id)
+        self.assertFalse(path.exists())
+
+    def test_upload_batch(self):
+        """
+        - 批量上传的记录在一个事务中保存，同一批中相同的内容只保存一份
+        - 保存失败时删除本次新增的存储文件，已有的存储文件不受影响
+        """
+        existing = self.service.upload_stream(io.BytesIO(b"avatar"), "a.png")
+        storages = lambda: [FileStorage(io.BytesIO(content), filename=f"{i}.png")  # noqa: E731
+                            for i, content in enumerate((b"avatar", b"banner", b"banner"))]
+        with patch.object(self.service.repository, "batch_insert", side_effect=Exception("insert failed")):
+            self.assertRaises(Exception, self.service.upload_batch, storages())
+        banner = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR,
+                              self.service._get_blob_key(hashlib.sha256(b"banner").hexdigest()))
+        self.assertFalse(banner.exists())
+        self.assertTrue(pathlib.Path(settings.BASE_DIR, existing.url).exists())
+        self.assertEqual(len(self.service.repository.get_by_map()), 1)
+
+        with patch.object(self.service.repository, "batch_insert",
+                          wraps=self.service.repository.batch_insert) as batch_insert:
+            results = self.service.upload_batch(storages())
+            batch_insert.assert_called_once()
+        self.assertEqual(results[0].url, existing.url)
+        self.assertEqual(results[1].url, results[2].url)
+        self.assertEqual(banner.read_bytes(), b"banner")
+        self.assertEqual(len(self.service.repository.get_by_map()), 4)
+        staging = pathlib.Path(settings.BASE_DIR, settings.UPLOAD_DIR, Constant.CAS_UPLOAD_DIR, ".staging")
+        self.assertEqual(os.listdir(staging), [])
+
+
+class BatchUploadTestCase(TestCase):
+    """ 批量上传(使用内存sqlite数据库) """
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        patcher = patch.object(settings, "BASE_DIR", self.temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        factory = SessionFactory(dsn="sqlite://")
+        DeclarativeModel.metadata.create_all(factory.get_session().get_bind(), tables=[File.__table__])
+        self.repository = FileRepository(session_context=SessionContext(factory))
+        self.service = LocalFileService(repository=self.repository)
+
+    def test_upload_batch(self):
+        """
+        - 返回结果与上传顺序一致，且都已填充主键
+        - 所有记录在一个事务中保存
+        """
+        storages = [FileStorage(io.BytesIO(str(i).encode() * 10), filename=f"{i}.txt") for i in range(20)]
+        with patch.object(FileRepository, "save") as mock_save:
+            result = self.service.upload_batch(storages)
+        mock_save.assert_not_called()
+        self.assertEqual([file.filename for file in result], [f"{i}.txt" for i in range(20)])
+        self.assertEqual(len({file.id for file in result}), 20)
+        self.assertEqual(pathlib.Path(settings.BASE_DIR, result[3].url).read_bytes(), b"3" * 10)
+        self.assertEqual(len(self.repository.get_by_map()), 20)
+
+    def test_upload_batch_failed(self):
+        """ 任一文件写入失败时不保存记录，并删除已写入的文件 """
+        broken = FileStorage(Mock(read=Mock(side_effect=OSError("broken pipe"))), filename="broken.txt")
+        storages = [FileStorage(io.BytesIO(b"content"), filename="ok.txt"), broken]
+        self.assertRaises(OSError, self.service.upload_batch, storages)
+        self.assertEqual(len(self.repository.get_by_map()), 0)
+        self.assertEqual([files for _, _, files in os.walk(self.temp_dir.name) if files], [])
+
 
 class AuthServiceTestCase(TestCase):
 
@@ -97,6 +346,8 @@ class AuthServiceTestCase(TestCase):
         repository.execute_query.assert_called_once()
         mock_redis.set.assert_called_once()
         self.assertEqual(token.token_type, "Bearer")
+        # 哈希码的参数与当前配置一致，无需升级
+        repository.update_password.assert_not_called()
 
         # 密码不正确时会抛出异常
         self.assertRaises(ProximaException, service.authenticate, email, 'some_not_matched_password')
@@ -133,6 +384,141 @@ class AuthServiceTestCase(TestCase):
         mock_redis.delete.assert_not_called()
         self.assertEqual(mock_redis.exists.call_count, 1)
 
+    def test_authenticate_rehash(self):
+        """ 密码哈希使用了过时的参数时，登录成功后重新生成 """
+        repository = Mock(spec=UserRepository)
+        user = User(id=1, username="admin", email="some_email@example.cn", status=0,
+                    password=Pbkdf2Algorithm(1000).hash("123456"))
+        repository.get_user_by_email.return_value = user
+        permission_cache = Mock(spec=PermissionCache)
+        permission_cache.resolve.return_value = set()
+        service = AuthServiceImpl(Mock(), repository, permission_cache=permission_cache)
+        service.authenticate(user.email, "123456")
+
+        repository.update_password.assert_called_once_with(1, ANY)
+        hashed_password: str = repository.update_password.call_args[0][1]
+        self.assertTrue(SecurityUtil.verify_password("123456", hashed_password))
+        self.assertFalse(SecurityUtil.password_needs_rehash(hashed_password))
+
+
+class LoadUserTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+        self.redis = Mock(spec=Redis)
+        self.load_session = self.redis.register_script.return_value
+        self.load_session.return_value = [CurrentUser(id=1, username="admin", authorities=set()).json(), 3600]
+        self.permission_cache = Mock(spec=PermissionCache)
+        self.permission_cache.resolve.return_value = {"user:add"}
+        self.session_cache = UserSessionCache()
+        self.token_cache = TokenCache()
+        self.redis.zrangebyscore.return_value = []
+        self.redis.pipeline = MagicMock()
+        self.revocation_list = TokenRevocationList(redis=self.redis)
+        self.token = SecurityUtil.create_token(subject=1)
+        self.headers = {"Authorization": Constant.TOKEN_SCHEMA + " " + self.token}
+
+    def _load_user(self) -> CurrentUser:
+        with self.app.test_request_context(headers=self.headers):
+            return load_user(redis=self.redis, permission_cache=self.permission_cache,
+                             session_cache=self.session_cache, token_cache=self.token_cache,
+                             revocation_list=self.revocation_list)
+
+    def test_load_user_cached(self):
+        """
+        测试进程内用户缓存
+         - 首次请求通过一次脚本调用读取redis(同时按需刷新有效期)
+         - 之后的请求命中进程内缓存，不再访问redis
+         - 权限每次都通过权限缓存解析
+        """
+        user = self._load_user()
+        self.assertEqual(user.id, 1)
+        self.assertEqual(user.authorities, {"user:add"})
+        self.load_session.assert_called_once_with(keys=[Constant.AUTH_REDIS_KEY + "1"], args=ANY)
+
+        self.load_session.reset_mock()
+        self.assertEqual(self._load_user().id, 1)
+        self.load_session.assert_not_called()
+        self.assertEqual(self.permission_cache.resolve.call_count, 2)
+
+    def test_load_user_near_expiry(self):
+        """ 会话剩余有效期低于刷新阈值时，重新加载并刷新有效期 """
+        self.load_session.return_value[1] = 10
+        self._load_user()
+        self._load_user()
+        self.assertEqual(self.load_session.call_count, 2)
+        # 脚本只在首次使用时注册
+        self.redis.register_script.assert_called_once()
+
+    def test_refresh_threshold_setting(self):
+        """ 刷新阈值为空时取有效期的一半，可以设置为0；有效期为空时必须设置刷新阈值 """
+        self.assertEqual(type(settings)(TOKEN_EXPIRED_MINUTES=60).TOKEN_REFRESH_THRESHOLD_MINUTES, 30)
+        self.assertEqual(type(settings)(TOKEN_REFRESH_THRESHOLD_MINUTES=0).TOKEN_REFRESH_THRESHOLD_MINUTES, 0)
+        self.assertRaises(ValidationError, type(settings), TOKEN_EXPIRED_MINUTES=None)
+
+    def test_load_user_after_logout(self):
+        self._load_user()
+        # 登出后缓存被清除，redis中已不存在该会话
+        AuthServiceImpl(redis=self.redis, repository=Mock(), session_cache=self.session_cache).logout(1)
+        self.load_session.return_value = None
+        self.assertRaises(TokenExpiredException, self._load_user)
+
+    def test_load_user_after_device_logout(self):
+        """
+        按设备登出
+         - 未吊销的token在本地布隆过滤器中即可判定，不访问redis
+         - 吊销后该token失效，同一用户其他设备的token不受影响
+        """
+        self._load_user()
+        self.redis.zscore.assert_not_called()
+
+        payload: Dict = SecurityUtil.parse_token(self.token)
+        service = AuthServiceImpl(redis=self.redis, repository=Mock(), session_cache=self.session_cache,
+                                  revocation_list=self.revocation_list)
+        service.logout(1, jti=payload["jti"], expired_at=payload["exp"])
+        self.redis.delete.assert_not_called()
+        self.redis.zscore.return_value = payload["exp"]
+        self.assertRaises(TokenExpiredException, self._load_user)
+
+        self.redis.zscore.reset_mock()
+        self.headers = {"Authorization": Constant.TOKEN_SCHEMA + " " + SecurityUtil.create_token(subject=1)}
+        self.assertEqual(self._load_user().id, 1)
+        self.redis.zscore.assert_not_called()
+
+
+class TokenRevocationListTestCase(TestCase):
+
+    def test_single_flight_rebuild(self):
+        """
+        过滤器过期后只由一个线程重建，其他线程继续使用当前过滤器；重建期间的吊销记录补充到新的过滤器中
+        """
+        redis = MagicMock(spec=Redis)
+        redis.zrangebyscore.return_value = ["revoked-1"]
+        revocation_list = TokenRevocationList(redis=redis)
+        redis.zscore.return_value = 1
+        self.assertTrue(revocation_list.is_revoked("revoked-1"))
+
+        started, release = threading.Event(), threading.Event()
+
+        def slow_load(*args):
+            started.set()
+            release.wait(5)
+            return ["revoked-1"]
+
+        redis.zrangebyscore.side_effect = slow_load
+        revocation_list._loaded_at = None
+        rebuilding = threading.Thread(target=revocation_list.is_revoked, args=("revoked-2",))
+        rebuilding.start()
+        self.assertTrue(started.wait(5))
+        self.assertFalse(revocation_list.is_revoked("revoked-2"))
+        revocation_list.revoke("revoked-3", 0)
+        release.set()
+        rebuilding.join(5)
+
+        self.assertEqual(redis.zrangebyscore.call_count, 2)
+        self.assertIsNone(revocation_list._pending)
+        self.assertTrue(revocation_list.is_revoked("revoked-3"))
+
 
 if __name__ == '__main__':
     main()
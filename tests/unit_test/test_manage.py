@@ -1,8 +1,19 @@
-from unittest import main
-from unittest.mock import ANY
+import io
+from unittest import TestCase, main
+from unittest.mock import ANY, MagicMock, Mock, patch
+
+import orjson
+from redis import Redis
+from sqlalchemy.exc import IntegrityError
 
 from src.apps.manage.models import *
+from src.apps.manage.permission import PermissionCache
 from src.apps.manage.repository import *
+from src.apps.manage.services import AuthorityServiceImpl, UserServiceImpl
+from src.core.cache import TwoLevelCache
+from src.common.constant import Constant
+from src.common.enums import DataFormat
+from src.utils import SecurityUtil
 from tests.unit_test.base import RepositoryTestCase
 
 
@@ -55,6 +66,16 @@ class UserRepositoryTestCase(RepositoryTestCase):
         self.assertEqual(self.session.execute.call_count, 2)
         self.session.commit.assert_called_once()
 
+    def test_bulk_add_users(self):
+        """ 用户与角色绑定各一次多行插入，通过邮箱查回主键，一次提交 """
+        self.session.execute.side_effect = [None, [("a@example.com", 1), ("b@example.com", 2)], None]
+        users = [{"username": "alice", "email": "a@example.com"}, {"username": "bob", "email": "b@example.com"}]
+        self.repository.bulk_add_users(users, [[1, 2], []])
+        self.assertEqual(self.session.execute.call_count, 3)
+        self.assertEqual(self.session.execute.call_args[0][1],
+                         [{"user_id": 1, "role_id": 1}, {"user_id": 1, "role_id": 2}])
+        self.session.commit.assert_called_once()
+
     def test_get_user_by_email(self):
         self.repository.get_user_by_email(ANY)
         self.session.execute.assert_called_once()
@@ -64,6 +85,61 @@ class UserRepositoryTestCase(RepositoryTestCase):
         self.session.execute.assert_called_once()
 
 
+class UserImportTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.repository = Mock(spec=UserRepository)
+        self.repository.get_existing_accounts.return_value = ({"exists"}, set(), {"13900000000"})
+        self.repository.get_existing_role_ids.return_value = {1}
+        self.service = UserServiceImpl(self.repository)
+
+    def test_import_csv(self):
+        """
+        - 整批数据只做一次唯一性查询、一次角色查询、一次插入
+        - 校验失败、重复、已存在、角色不存在的行记录在错误中，不影响其他行
+        - 手机号唯一，未填写手机号的行以空字符串写入，多于一行时同样视为重复
+        - 可以带有BOM(如Excel导出的CSV)
+        """
+        data = b"\xef\xbb\xbfusername,email,password,roles,mobile\n" \
+               b"alice,alice@example.com,123456,1,13800000001\n" \
+               b"bobby,bobby@example.com,123456,1;2,13800000002\n" \
+               b"exists,exists@example.com,123456,,13800000003\n" \
+               b"carol,alice@example.com,123456,,13800000004\n" \
+               b"dave,invalid,123456,,\n" \
+               b"erin,erin@example.com,123456,,\n" \
+               b"frank,frank@example.com,123456,,13800000001\n" \
+               b"grace,grace@example.com,123456,,\n" \
+               b"heidi,heidi@example.com,123456,,13900000000\n"
+        with patch.object(SecurityUtil, "generate_password", return_value="hashed"):
+            result = self.service.import_users(io.BytesIO(data), DataFormat.csv)
+        self.assertEqual((result.total, result.created, result.failed), (9, 2, 7))
+        self.assertEqual([error.line for error in result.errors], [3, 4, 5, 6, 8, 9, 10])
+        self.assertEqual(result.errors[4].errors, ["手机号重复"])
+        self.assertEqual(result.errors[5].errors, ["未填写手机号的用户重复"])
+        self.assertEqual(result.errors[6].errors, ["手机号已存在"])
+        self.repository.get_existing_accounts.assert_called_once()
+        self.assertEqual(self.repository.get_existing_accounts.call_args[0][2],
+                         ["13800000001", "13800000002", "13800000003", "", "13900000000"])
+        self.repository.get_existing_role_ids.assert_called_once_with([1, 2])
+        users, roles = self.repository.bulk_add_users.call_args[0]
+        self.assertEqual([user["username"] for user in users], ["alice", "erin"])
+        self.assertEqual(users[0]["password"], "hashed")
+        self.assertEqual(users[1]["mobile"], "")
+        self.assertEqual(roles, [[1], []])
+
+    def test_import_conflict(self):
+        """ 多行插入违反唯一约束时逐行插入，定位出错的行 """
+        data = b'{"username": "alice", "email": "alice@example.com", "password": "123456", "mobile": "1"}\n' \
+               b'{"username": "bobby", "email": "bobby@example.com", "password": "123456", "mobile": "2"}\n'
+        self.repository.bulk_add_users.side_effect = [IntegrityError("", {}, Exception()), None,
+                                                      IntegrityError("", {}, Exception("duplicate"))]
+        with patch.object(SecurityUtil, "generate_password", return_value="hashed"):
+            result = self.service.import_users(io.BytesIO(data), DataFormat.jsonl)
+        self.assertEqual((result.created, result.failed), (1, 1))
+        self.assertEqual(result.errors[0].line, 2)
+        self.assertEqual(self.repository.bulk_add_users.call_count, 3)
+
+
 class RoleRepositoryTestCase(RepositoryTestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -118,5 +194,91 @@ class RoleRepositoryTestCase(RepositoryTestCase):
         self.session.execute.assert_called_once()
 
 
+class PermissionCacheTestCase(TestCase):
+    """
+    权限缓存相关单元测试
+    """
+
+    def setUp(self) -> None:
+        self.redis = MagicMock(spec=Redis)
+        self.redis.mget.side_effect = lambda keys: [None] * len(keys)
+        self.user_repository = Mock(spec=UserRepository)
+        self.user_repository.get_role_ids.return_value = [1, 2]
+        self.authority_repository = Mock(spec=AuthorityRepository)
+        self.authority_repository.get_codes_by_roles.return_value = {1: {"user:add"}, 2: {"user:add", "role:add"}}
+        self.cache = PermissionCache(self.redis, lambda: self.user_repository, lambda: self.authority_repository)
+
+    def test_resolve(self):
+        """
+        - 首次解析时查询数据库并写入redis
+        - 再次解析时命中进程内缓存，不再访问redis和数据库
+        """
+        self.assertEqual(self.cache.resolve(1), {"user:add", "role:add"})
+        self.user_repository.get_role_ids.assert_called_once_with(1)
+        self.authority_repository.get_codes_by_roles.assert_called_once_with([1, 2])
+        self.redis.register_script.return_value.assert_called()
+
+        self.redis.reset_mock()
+        self.assertEqual(self.cache.resolve(1), {"user:add", "role:add"})
+        self.redis.mget.assert_not_called()
+        self.assertEqual(self.user_repository.get_role_ids.call_count, 1)
+
+    def test_resolve_from_redis(self):
+        self.redis.mget.side_effect = lambda keys: ['[1]' if keys[0].startswith("cache:perm-user") else '["user:add"]',
+                                                    None, None]
+        self.assertEqual(self.cache.resolve(1), {"user:add"})
+        self.user_repository.get_role_ids.assert_not_called()
+        self.authority_repository.get_codes_by_roles.assert_not_called()
+
+    def test_evict(self):
+        self.cache.resolve(1)
+        self.authority_repository.get_codes_by_roles.return_value = {1: set(), 2: {"role:add"}}
+        self.cache.evict_roles([1, 2])
+        self.redis.pipeline.return_value.__enter__.return_value.delete.assert_called_once_with(
+            *[Constant.CACHE_REDIS_KEY + Constant.PERM_ROLE_CACHE_NAMESPACE + ":" + str(i) for i in (1, 2)])
+        self.assertEqual(self.cache.resolve(1), {"role:add"})
+
+        self.user_repository.get_role_ids.return_value = [1]
+        self.cache.evict_user(1)
+        self.assertEqual(self.cache.resolve(1), set())
+
+    def test_evict_during_load(self):
+        """ 加载期间角色授权被撤销时，加载到的旧权限不写入本地缓存，下次解析重新加载 """
+        def revoke_during_load(role_ids):
+            self.cache.evict_roles(role_ids)
+            return {1: {"user:add"}, 2: {"user:add", "role:add"}}
+
+        self.authority_repository.get_codes_by_roles.side_effect = revoke_during_load
+        self.assertEqual(self.cache.resolve(1), {"user:add", "role:add"})
+        self.authority_repository.get_codes_by_roles.side_effect = None
+        self.authority_repository.get_codes_by_roles.return_value = {1: set(), 2: set()}
+        self.assertEqual(self.cache.resolve(1), set())
+        self.assertEqual(self.authority_repository.get_codes_by_roles.call_count, 2)
+
+
+class AuthorityServiceTestCase(TestCase):
+
+    def test_authority_tree_cache(self):
+        """
+        - 首次获取权限树时查询数据库，之后直接返回缓存的序列化结果
+        - 权限变更后缓存失效
+        """
+        root = Authority(id=1, name="root", parent_id=None, sort=0, code="root")
+        repository = Mock(spec=AuthorityRepository)
+        repository.get_by_map.return_value = [root]
+        redis = MagicMock(spec=Redis, **{"get.return_value": None, "mget.return_value": [None, None, None]})
+        tree_cache = TwoLevelCache(redis, "authority-tree", ttl=60)
+        service = AuthorityServiceImpl(repository, tree_cache=tree_cache)
+
+        body = service.get_authority_tree_response()
+        self.assertEqual(orjson.loads(body)["data"][0]["label"], "root")
+        self.assertEqual(service.get_authority_tree_response(), body)
+        repository.get_by_map.assert_called_once_with(None, primary=True)
+
+        service.update(1, Mock())
+        service.get_authority_tree_response()
+        self.assertEqual(repository.get_by_map.call_count, 2)
+
+
 if __name__ == '__main__':
     main()